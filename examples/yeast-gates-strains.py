@@ -22,26 +22,17 @@ yg_members = sbhp.objects_for(sbh_query,
                               sbhp.SBOL_MEMBER)
 print('Found {} yeast gate challenge problem members'.format(len(yg_members)))
 
-# Iterate through the members, finding contained strains
-all_strains = []
-print('Looking for strains...', end='', flush=True)
-yg_count = 0
-for yg in yg_members:
-    # print(yg)
-    strains = sbhp.find_contained_strains(sbh_query, yg)
-    all_strains.extend(strains)
-    yg_count += 1
-    if yg_count % 10 == 0:
-        print('.', end='', flush=True)
-print()
-print('Found {} strains'.format(len(all_strains)))
-
-# I don't know if strains can be used in more than one, but in case
-# they can, let's use a set to remove duplicates.
-unique_strains = set(all_strains)
-print('Found {} unique strains'.format(len(unique_strains)))
-
-# Print out all the unique strains we found
+# Search all the members at once. Modules shared by several members
+# are only queried once.
+print('Looking for strains...', flush=True)
+strains_by_member, members_by_strain = sbhp.find_contained_strains_bulk(sbh_query, yg_members)
+print('Found {} strains in {} members'.format(
+    sum(len(strains) for strains in strains_by_member.values()),
+    sum(1 for strains in strains_by_member.values() if strains)))
+print('Found {} unique strains'.format(len(members_by_strain)))
+
+# Print out all the unique strains we found, with the number of
+# members that contain each one
 print('Strains:')
-for strain in sorted(unique_strains):
-    print('\t', strain)
+for strain in sorted(members_by_strain):
+    print('\t', strain, len(members_by_strain[strain]))
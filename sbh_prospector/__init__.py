@@ -1 +1,13 @@
 from .prospector import *
+from .cache import CachedQuery, MemoryQueryCache, QueryCache, SQLiteQueryCache
+from .closure import ClosureIndex
+from .coalesce import AsyncCoalescingQuery, CoalescingQuery, SingleFlight
+from .executor import QueryExecutor, SparqlSession
+from .snapshot import SnapshotIndex
+
+
+def __getattr__(name):
+    # See prospector.__getattr__
+    if name == 'CHALLENGE_PROBLEMS':
+        return challenge_problems()
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
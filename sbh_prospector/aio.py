@@ -0,0 +1,419 @@
+"""Asyncio versions of the query helpers in prospector.py.
+
+The `sbh_query` passed to these coroutines has a coroutine
+`fetch_SPARQL`: an `AsyncSparqlSession`, which talks to SynBioHub over
+aiohttp, or an `AsyncQuery`, which runs any synchronous `sbh_query` (a
+`SnapshotIndex`, a `CachedQuery`, ...) on worker threads. Both bound
+the number of queries in flight with a semaphore, so hundreds of
+lookups can be started at once:
+
+    async with AsyncSparqlSession(server, max_concurrency=16) as sbh_query:
+        strains = await find_contained_strains(sbh_query, uri)
+
+aiohttp is only needed for `AsyncSparqlSession`.
+"""
+
+import asyncio
+import collections
+import functools
+import json
+import logging
+import sys
+
+from . import instrument, sparql
+from .coalesce import SingleFlight
+from .executor import MAX_GET_QUERY_LENGTH
+from .memoization import DEFAULT_MAXSIZE, MISSING, memo, memo_server
+from .prospector import (CHEBI_IDENTIFIERS_PREFIX, CHEBI_PURL_PREFIX, COMPILED_CHILD_DEFINITIONS_QUERY,
+                         COMPILED_O_QUERY, COMPILED_PARENT_DEFINITIONS_QUERY, COMPILED_REAGENTS_QUERY,
+                         COMPILED_SPO_QUERY, COMPILED_STRAINS_QUERY, COMPILED_SUBJECT_QUERY, NCIT_STRAIN, RDF_TYPE,
+                         SBOL_DEFINITION, SBOL_FUNCTIONAL_COMPONENT, SBOL_MODULE, SBOL_ROLE, SBOL_TYPE,
+                         VALUES_CHUNK_SIZE, ExploredGraph, chunks, closure_lookup, format_query_result,
+                         implementations_query)
+
+
+def memoize_async(relation, maxsize=DEFAULT_MAXSIZE, ttl=None, many=None):
+    """`memo.memoize` for coroutine functions of (sbh_query, uri, ...).
+    Values are kept in the same relation as the synchronous function of
+    the same name, so either can answer for the other, and concurrent
+    calls for the same key share the call in flight. Exceptions are not
+    cached. `many` is a batched coroutine, exposed memoized as the
+    `many` attribute.
+    """
+    def decorator(func):
+        cache = memo.relation(relation, maxsize, ttl)
+        flight = SingleFlight()
+
+        @functools.wraps(func)
+        async def wrapper(sbh_query, uri, *args, **kwargs):
+            key = (memo_server(sbh_query), uri)
+            value = cache.get(key)
+            if value is MISSING:
+                value = await flight.do_async(key, lambda: func(sbh_query, uri, *args, **kwargs))
+                cache.put(key, value)
+            return value
+
+        async def cached_many(sbh_query, uris, chunk_size=None):
+            server = memo_server(sbh_query)
+            values = {}
+            missing = []
+            for uri in dict.fromkeys(uris):
+                value = cache.get((server, uri))
+                if value is MISSING:
+                    missing.append(uri)
+                else:
+                    values[uri] = value
+            if missing:
+                found = await many(sbh_query, missing, chunk_size=chunk_size)
+                for uri in missing:
+                    cache.put((server, uri), found[uri])
+                    values[uri] = found[uri]
+            return values
+
+        if many is not None:
+            wrapper.many = cached_many
+        wrapper.relation = relation
+        wrapper.cache_info = cache.info
+        wrapper.cache_clear = functools.partial(memo.invalidate, relation)
+        return wrapper
+
+    return decorator
+
+
+class _Bounded:
+    """Keeps one semaphore of `max_concurrency` per event loop, since a
+    semaphore cannot be shared between loops.
+    """
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self._semaphores = {}
+
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+
+class AsyncSparqlSession(_Bounded):
+    """The asyncio counterpart of `SparqlSession`: a SynBioHub SPARQL
+    client on an aiohttp session, with at most `max_concurrency`
+    queries in flight.
+    """
+
+    def __init__(self, server, max_concurrency=10, timeout=60):
+        super().__init__(max_concurrency)
+        self._server = server.rstrip('/')
+        self.timeout = timeout
+        self.headers = {'Accept': 'application/sparql-results+json'}
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _client(self):
+        if self._session is None:
+            import aiohttp
+            self._session = aiohttp.ClientSession(headers=self.headers,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def login(self, user, password):
+        async with self._client().post(self._server + '/login', data=dict(email=user, password=password),
+                                       headers={'Accept': 'text/plain'}) as response:
+            response.raise_for_status()
+            self._session.headers['X-authorization'] = await response.text()
+
+    async def fetch_SPARQL(self, server, query):
+        url = (server or self._server) + '/sparql'
+        async with self._semaphore():
+            if len(query) > MAX_GET_QUERY_LENGTH:
+                request = self._client().post(url, data=dict(query=query))
+            else:
+                request = self._client().get(url, params=dict(query=query))
+            async with request as response:
+                response.raise_for_status()
+                body = await response.read()
+        instrument.record_response_bytes(len(body))
+        return json.loads(body)
+
+    def format_query_result(self, query_result, binding_keys, group_key=None):
+        return sparql.format_bindings(query_result, binding_keys)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class AsyncQuery(_Bounded):
+    """Wrap a synchronous `sbh_query` for use with these coroutines. Its
+    `fetch_SPARQL` runs on the default executor of the event loop, at
+    most `max_concurrency` at a time, so it must be safe to call from
+    several threads (see `QueryExecutor`).
+    """
+
+    def __init__(self, sbh_query, max_concurrency=10):
+        super().__init__(max_concurrency)
+        self.sbh_query = sbh_query
+
+    def __getattr__(self, name):
+        if name == 'sbh_query':
+            raise AttributeError(name)
+        return getattr(self.sbh_query, name)
+
+    async def fetch_SPARQL(self, server, query):
+        async with self._semaphore():
+            return await asyncio.get_running_loop().run_in_executor(None, self.sbh_query.fetch_SPARQL, server,
+                                                                    query)
+
+
+async def run_query(sbh_query, sparql, template, bindings=(), helper=None):
+    """Coroutine version of `prospector.run_query`."""
+    logging.debug('Query is %s', sparql)
+    if not instrument.enabled():
+        return await sbh_query.fetch_SPARQL(None, sparql)
+    if helper is None:
+        helper = sys._getframe(1).f_code.co_name
+    return await instrument.traced_fetch_async(sbh_query, sparql, helper, template, bindings)
+
+
+async def fetch_all(sbh_query, sparqls, template=None, bindings=None, helper=None):
+    """Run each query in `sparqls` concurrently and return the raw
+    results in order.
+    """
+    if helper is None:
+        helper = sys._getframe(1).f_code.co_name
+    if bindings is None:
+        bindings = [()] * len(sparqls)
+    return await asyncio.gather(*[run_query(sbh_query, sparql, template, b, helper)
+                                  for sparql, b in zip(sparqls, bindings)])
+
+
+async def run_compiled(sbh_query, query, rows, chunk_size=None, helper=None):
+    """Coroutine version of `prospector.run_compiled`."""
+    if helper is None:
+        helper = sys._getframe(1).f_code.co_name
+    if chunk_size is None:
+        chunk_size = VALUES_CHUNK_SIZE
+    rows = [tuple(row) for row in rows]
+    row_chunks = list(chunks(dict.fromkeys(rows), chunk_size))
+    results = await asyncio.gather(*[run_query(sbh_query, query.render(chunk), query.name,
+                                               chunk[0] if len(chunk) == 1 else chunk, helper)
+                                     for chunk in row_chunks])
+    split = {}
+    for chunk, result in zip(row_chunks, results):
+        split.update(zip(chunk, query.split(result, chunk)))
+    return [split[row] for row in rows]
+
+
+async def subjects_for(sbh_query, pred, obj):
+    result = (await run_compiled(sbh_query, COMPILED_SUBJECT_QUERY, [(pred, obj)]))[0]
+    return sbh_query.format_query_result(result, ['s'])
+
+
+async def objects_for(sbh_query, subj, pred):
+    result = (await run_compiled(sbh_query, COMPILED_O_QUERY, [(subj, pred)]))[0]
+    return format_query_result(sbh_query, result)
+
+
+async def triple_exists(sbh_query, subj, pred, obj):
+    """Determine if the given triple exists. Returns a bool."""
+    result = (await run_compiled(sbh_query, COMPILED_SPO_QUERY, [(subj, pred, obj)]))[0]
+    return bool(format_query_result(sbh_query, result))
+
+
+async def has_type(sbh_query, subj, rdf_type):
+    result = (await run_compiled(sbh_query, COMPILED_SPO_QUERY, [(subj, RDF_TYPE, rdf_type)]))[0]
+    return [(r['s'], r['o']) for r in format_query_result(sbh_query, result)]
+
+
+async def find_implementations(sbh_query, obj, media=None):
+    """See `prospector.find_implementations`."""
+    result = await run_query(sbh_query, implementations_query(obj, media), 'find_implementations', (obj, media))
+    return format_query_result(sbh_query, result)
+
+
+async def child_definitions_many(sbh_query, uris, preds, chunk_size=None):
+    """See `prospector.child_definitions_many`. The chunks are fetched
+    concurrently.
+    """
+    if chunk_size is None:
+        chunk_size = VALUES_CHUNK_SIZE
+    result = {uri: {pred: set() for pred in preds} for uri in uris}
+    rows = [(uri, pred, SBOL_DEFINITION) for uri in result for pred in preds]
+    results = await run_compiled(sbh_query, COMPILED_CHILD_DEFINITIONS_QUERY, rows, chunk_size * max(1, len(preds)))
+    for (uri, pred, _), children in zip(rows, results):
+        result[uri][pred].update(format_query_result(sbh_query, children, ['o']))
+    return result
+
+
+async def child_module_definitions_many(sbh_query, uris, chunk_size=None):
+    children = await child_definitions_many(sbh_query, uris, [SBOL_MODULE], chunk_size)
+    return {uri: children[uri][SBOL_MODULE] for uri in children}
+
+
+async def child_component_definitions_many(sbh_query, uris, chunk_size=None):
+    children = await child_definitions_many(sbh_query, uris, [SBOL_FUNCTIONAL_COMPONENT], chunk_size)
+    return {uri: children[uri][SBOL_FUNCTIONAL_COMPONENT] for uri in children}
+
+
+async def child_definitions_all_many(sbh_query, uris, chunk_size=None):
+    preds = [SBOL_MODULE, SBOL_FUNCTIONAL_COMPONENT]
+    children = await child_definitions_many(sbh_query, uris, preds, chunk_size)
+    return {uri: [c for pred in preds for c in children[uri][pred]] for uri in children}
+
+
+async def parent_module_definitions_many(sbh_query, uris, chunk_size=None):
+    """See `prospector.parent_module_definitions_many`."""
+    if chunk_size is None:
+        chunk_size = VALUES_CHUNK_SIZE
+    preds = [SBOL_MODULE, SBOL_FUNCTIONAL_COMPONENT]
+    result = {uri: set() for uri in uris}
+    rows = [(uri, pred, SBOL_DEFINITION) for uri in result for pred in preds]
+    results = await run_compiled(sbh_query, COMPILED_PARENT_DEFINITIONS_QUERY, rows, chunk_size * len(preds))
+    for (uri, _, _), parents in zip(rows, results):
+        result[uri].update(format_query_result(sbh_query, parents, ['s']))
+    return result
+
+
+async def matching_many(sbh_query, uris, query, args=(), chunk_size=None):
+    """See `prospector.matching_many`. The chunks are fetched
+    concurrently.
+    """
+    uris = list(dict.fromkeys(uris))
+    results = await run_compiled(sbh_query, query, [(uri,) + tuple(args) for uri in uris], chunk_size,
+                                 sys._getframe(1).f_code.co_name)
+    return {uri: bool(result['results']['bindings']) for uri, result in zip(uris, results)}
+
+
+async def module_is_strain_many(sbh_query, uris, chunk_size=None):
+    return await matching_many(sbh_query, uris, COMPILED_STRAINS_QUERY, (SBOL_ROLE, NCIT_STRAIN), chunk_size)
+
+
+async def is_reagent_many(sbh_query, uris, chunk_size=None):
+    return await matching_many(sbh_query, uris, COMPILED_REAGENTS_QUERY,
+                               (SBOL_TYPE, CHEBI_PURL_PREFIX, CHEBI_IDENTIFIERS_PREFIX), chunk_size)
+
+
+# cache size 256 is an arbitrary choice
+@memoize_async('parent_module_definitions')
+async def parent_module_definitions(sbh_query, uri):
+    return (await parent_module_definitions_many(sbh_query, [uri]))[uri]
+
+
+# cache size 256 is an arbitrary choice
+@memoize_async('child_module_definitions')
+async def child_module_definitions(sbh_query, uri):
+    return (await child_module_definitions_many(sbh_query, [uri]))[uri]
+
+
+# cache size 256 is an arbitrary choice
+@memoize_async('child_component_definitions')
+async def child_component_definitions(sbh_query, uri):
+    return (await child_component_definitions_many(sbh_query, [uri]))[uri]
+
+
+# cache size 256 is an arbitrary choice
+@memoize_async('module_is_strain', many=module_is_strain_many)
+async def module_is_strain(sbh_query, module_uri):
+    return await triple_exists(sbh_query, module_uri, SBOL_ROLE, NCIT_STRAIN)
+
+
+# cache size 256 is an arbitrary choice
+@memoize_async('is_reagent', many=is_reagent_many)
+async def is_reagent(sbh_query, uri):
+    types = await objects_for(sbh_query, uri, SBOL_TYPE)
+    return any(typ.startswith(CHEBI_PURL_PREFIX) or typ.startswith(CHEBI_IDENTIFIERS_PREFIX) for typ in types)
+
+
+async def walk_levels(sbh_query, uris, expand, chunk_size=None, max_depth=None, graph=None):
+    """Async generator version of `prospector.walk_levels`. `expand` is
+    one of the batched coroutines above.
+    """
+    if graph is None:
+        graph = ExploredGraph()
+    queue = collections.deque(uri for uri in uris if graph.add_node(uri, 0))
+    depth = 0
+    while queue:
+        frontier = [queue.popleft() for _ in range(len(queue))]
+        yield depth, frontier
+        if max_depth is not None and depth >= max_depth:
+            return
+        children = await expand(sbh_query, frontier, chunk_size=chunk_size)
+        depth += 1
+        for uri in frontier:
+            graph.add_children(uri, children[uri])
+            queue.extend(child for child in children[uri] if graph.add_node(child, depth))
+
+
+# cache size 256 is an arbitrary choice
+@memoize_async('root_module_definitions')
+async def root_module_definitions(sbh_query, uri, chunk_size=None):
+    """See `prospector.root_module_definitions`."""
+    roots = closure_lookup(sbh_query, 'roots', uri)
+    if roots is not None:
+        return roots
+    graph = ExploredGraph()
+    async for _ in walk_levels(sbh_query, [uri], parent_module_definitions_many, chunk_size, graph=graph):
+        pass
+    return graph.leaves()
+
+
+async def iter_contained(sbh_query, uri, predicate, expand, max_depth=None, limit=None, chunk_size=None,
+                         graph=None):
+    """Async generator version of `prospector.iter_contained`. The items
+    of each level are checked by `predicate`, a coroutine, concurrently,
+    or by its batched version, `predicate.many`, if it has one.
+    """
+    if limit is not None and limit <= 0:
+        return
+    found = 0
+    async for _, frontier in walk_levels(sbh_query, [uri], expand, chunk_size, max_depth, graph):
+        if hasattr(predicate, 'many'):
+            matched = await predicate.many(sbh_query, frontier, chunk_size=chunk_size)
+            flags = [matched[item] for item in frontier]
+        else:
+            flags = await asyncio.gather(*[predicate(sbh_query, item) for item in frontier])
+        for item, flag in zip(frontier, flags):
+            if not flag:
+                continue
+            yield item
+            found += 1
+            if limit is not None and found >= limit:
+                return
+
+
+def iter_contained_reagents(sbh_query, uri, max_depth=None, limit=None, chunk_size=None, graph=None):
+    return iter_contained(sbh_query, uri, is_reagent, child_definitions_all_many, max_depth, limit, chunk_size,
+                          graph)
+
+
+def iter_contained_strains(sbh_query, uri, max_depth=None, limit=None, chunk_size=None, graph=None):
+    return iter_contained(sbh_query, uri, module_is_strain, child_module_definitions_many, max_depth, limit,
+                          chunk_size, graph)
+
+
+# cache size 256 is an arbitrary choice
+@memoize_async('find_contained_reagents')
+async def find_contained_reagents(sbh_query, uri, chunk_size=None):
+    """See `prospector.find_contained_reagents`."""
+    reagents = closure_lookup(sbh_query, 'contained_reagents', uri)
+    if reagents is not None:
+        return reagents
+    return [item async for item in iter_contained_reagents(sbh_query, uri, chunk_size=chunk_size)]
+
+
+# cache size 256 is an arbitrary choice
+@memoize_async('find_contained_strains')
+async def find_contained_strains(sbh_query, uri, chunk_size=None):
+    """See `prospector.find_contained_strains`."""
+    strains = closure_lookup(sbh_query, 'contained_strains', uri)
+    if strains is not None:
+        return strains
+    return [item async for item in iter_contained_strains(sbh_query, uri, chunk_size=chunk_size)]
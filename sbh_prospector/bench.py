@@ -0,0 +1,329 @@
+"""Benchmark prospector operations against a synthetic SBOL hierarchy.
+
+The hierarchy is served either directly from a `SnapshotIndex` or over
+HTTP by a `StandInServer`, a local SPARQL endpoint that stands in for
+SynBioHub. Query counts, wall time and peak memory are reported as JSON
+so that runs of different versions can be compared:
+
+    python -m sbh_prospector.bench --depth 4 --fanout 3 --output bench.json
+"""
+
+import argparse
+import http.server
+import json
+import logging
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.parse
+
+from . import prospector
+from .snapshot import SnapshotIndex
+from .sparql import SparqlError, encode_literal
+
+DESIGN_PREFIX = 'https://hub.sd2e.org/user/sd2e/design/'
+CHEBI_TYPE = prospector.CHEBI_PURL_PREFIX + '_15377'
+DNA_TYPE = 'http://www.biopax.org/release/biopax-level3.owl#DnaRegion'
+SBOL_MODULE_DEFINITION = prospector.SBOL_ROOT + '#ModuleDefinition'
+SBOL_COMPONENT_DEFINITION = prospector.SBOL_ROOT + '#ComponentDefinition'
+
+
+class CountingQuery:
+    """Wrap an `sbh_query`, counting the queries made through it and
+    optionally sleeping `latency` seconds per query to simulate the
+    round trip to a real server.
+    """
+
+    def __init__(self, sbh_query, latency=0.0):
+        self.sbh_query = sbh_query
+        self.latency = latency
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name == 'sbh_query':
+            raise AttributeError(name)
+        return getattr(self.sbh_query, name)
+
+    def fetch_SPARQL(self, server, query):
+        with self._lock:
+            self.queries += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.sbh_query.fetch_SPARQL(server, query)
+
+
+class StandInServer:
+    """A local HTTP SPARQL endpoint answering queries from `index`. It
+    speaks enough of the SynBioHub API (/login and /sparql) for a
+    `SparqlSession` to use it in place of a real server.
+    """
+
+    def __init__(self, index, host='127.0.0.1', port=0, latency=0.0):
+        self.index = index
+        self.latency = latency
+        self.queries = 0
+        self._lock = threading.Lock()
+        self.httpd = http.server.ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.url = 'http://{}:{}'.format(*self.httpd.server_address[:2])
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def answer(self, query):
+        with self._lock:
+            self.queries += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.index.fetch_SPARQL(None, query)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                url = urllib.parse.urlparse(self.path)
+                self.respond(url.path, urllib.parse.parse_qs(url.query))
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length).decode('utf-8')
+                self.respond(urllib.parse.urlparse(self.path).path, urllib.parse.parse_qs(body))
+
+            def respond(self, path, params):
+                if path == '/login':
+                    self.send(200, 'text/plain', b'stand-in-token')
+                elif path == '/sparql' and 'query' in params:
+                    try:
+                        result = server.answer(params['query'][0])
+                    except SparqlError as err:
+                        self.send(400, 'text/plain', str(err).encode('utf-8'))
+                    else:
+                        self.send(200, 'application/sparql-results+json', json.dumps(result).encode('utf-8'))
+                else:
+                    self.send(404, 'text/plain', b'Not found')
+
+            def send(self, status, content_type, body):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug('Stand-in server: ' + format, *args)
+
+        return Handler
+
+
+def synthetic_hierarchy(depth=3, fanout=3, strain_fraction=0.3, reagent_fraction=0.5, shared_fraction=0.1,
+                        experiments=3, seed=0):
+    """Build a `SnapshotIndex` holding a SynBioHub-like SBOL hierarchy:
+    a tree of ModuleDefinitions `depth` levels deep, each with `fanout`
+    child modules and one functional component, some of the modules
+    shared by two parents. Also adds a construct used by `experiments`
+    built designs, for `find_construct_experiments`.
+
+    Returns the index and a dict of the URIs the benchmarks start from:
+    'root', 'leaf' and 'construct'.
+    """
+    rng = random.Random(seed)
+    index = SnapshotIndex()
+    counter = [0]
+
+    def new_uri(kind):
+        counter[0] += 1
+        return '{}{}_{}/1'.format(DESIGN_PREFIX, kind, counter[0])
+
+    def add_child(parent, pred, definition, name):
+        child = '{}/{}_{}/1'.format(parent[:-2], name, counter[0])
+        counter[0] += 1
+        index.add(parent, pred, child)
+        index.add(child, prospector.SBOL_DEFINITION, definition)
+
+    root = new_uri('module')
+    index.add(root, prospector.RDF_TYPE, SBOL_MODULE_DEFINITION)
+    level = [root]
+    for _ in range(depth):
+        next_level = []
+        for parent in level:
+            for _ in range(fanout):
+                module = new_uri('module')
+                index.add(module, prospector.RDF_TYPE, SBOL_MODULE_DEFINITION)
+                if rng.random() < strain_fraction:
+                    index.add(module, prospector.SBOL_ROLE, prospector.NCIT_STRAIN)
+                add_child(parent, prospector.SBOL_MODULE, module, 'module')
+                next_level.append(module)
+            component = new_uri('component')
+            index.add(component, prospector.RDF_TYPE, SBOL_COMPONENT_DEFINITION)
+            index.add(component, prospector.SBOL_TYPE,
+                      CHEBI_TYPE if rng.random() < reagent_fraction else DNA_TYPE)
+            add_child(parent, prospector.SBOL_FUNCTIONAL_COMPONENT, component, 'fc')
+        for module in next_level:
+            if rng.random() < shared_fraction:
+                add_child(rng.choice(level), prospector.SBOL_MODULE, module, 'shared')
+        level = next_level
+
+    construct = new_uri('construct')
+    for _ in range(experiments):
+        member = new_uri('plasmid')
+        definer = '{}/component_{}/1'.format(member[:-2], counter[0])
+        index.add(member, prospector.SBOL_PRED_COMPONENT, definer)
+        index.add(definer, prospector.RDF_TYPE, prospector.SBOL_TYPE_COMPONENT)
+        index.add(definer, prospector.SBOL_DEFINITION, construct)
+        circuit_design = new_uri('circuit')
+        add_child(circuit_design, prospector.SBOL_FUNCTIONAL_COMPONENT, member, 'fc')
+        experiment_design = new_uri('experiment')
+        add_child(experiment_design, prospector.SBOL_MODULE, circuit_design, 'module')
+        implementation = new_uri('implementation')
+        index.add(implementation, prospector.SBOL_BUILT, experiment_design)
+        index.add(implementation, prospector.DC_TERMS_TITLE, encode_literal('Implementation ' + implementation))
+
+    return index, dict(root=root, leaf=level[0] if level else root, construct=construct)
+
+
+def clear_caches():
+    """Clear the memoized functions of prospector.py so every run starts
+    cold.
+    """
+    prospector.memo.clear()
+
+
+def operations(uris):
+    """The benchmarked operations, as (name, function of sbh_query)."""
+    return [
+        ('find_contained_strains', lambda q: prospector.find_contained_strains(q, uris['root'])),
+        ('find_contained_strains_by_path', lambda q: prospector.find_contained_strains_by_path(q, uris['root'])),
+        ('find_contained_reagents', lambda q: prospector.find_contained_reagents(q, uris['root'])),
+        ('find_contained_reagents_by_path',
+         lambda q: prospector.find_contained_reagents_by_path(q, uris['root'])),
+        ('root_module_definitions', lambda q: prospector.root_module_definitions(q, uris['leaf'])),
+        ('find_construct_experiments', lambda q: prospector.find_construct_experiments(q, uris['construct'])),
+        ('find_construct_experiments_joined',
+         lambda q: prospector.find_construct_experiments_joined(q, uris['construct'])[0]),
+    ]
+
+
+def measure(name, func, sbh_query, repeat=1):
+    """Run `func(sbh_query)` cold `repeat` times for the best wall time,
+    then once more under tracemalloc for the peak memory.
+    """
+    counting = CountingQuery(sbh_query)
+    best = None
+    for _ in range(repeat):
+        clear_caches()
+        counting.queries = 0
+        start = time.perf_counter()
+        result = func(counting)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    queries = counting.queries
+
+    clear_caches()
+    tracemalloc.start()
+    func(counting)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return dict(operation=name, queries=queries, seconds=best, peak_memory_bytes=peak, result_size=len(result))
+
+
+def measure_startup(repeat=3):
+    """The best time over `repeat` fresh interpreters to import the
+    command line, less the time to start Python itself.
+    """
+    def best(code):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], check=True)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    return best('import sbh_prospector.cli') - best('pass')
+
+
+def package_version():
+    try:
+        from importlib.metadata import version
+        return version('sbh_prospector')
+    except Exception:
+        return 'unknown'
+
+
+def run_benchmarks(depth=3, fanout=3, repeat=3, latency=0.0, http=False, seed=0):
+    """Run every operation against a fresh synthetic hierarchy. Returns
+    a JSON-serializable report.
+    """
+    index, uris = synthetic_hierarchy(depth, fanout, seed=seed)
+    report = dict(version=package_version(), python=platform.python_version(),
+                  parameters=dict(depth=depth, fanout=fanout, repeat=repeat, latency=latency, http=http, seed=seed),
+                  triples=len(index), startup_seconds=measure_startup(repeat), results=[])
+    if http:
+        from .executor import SparqlSession
+        with StandInServer(index, latency=latency) as server:
+            sbh_query = SparqlSession(server.url)
+            for name, func in operations(uris):
+                report['results'].append(measure(name, func, sbh_query, repeat))
+            sbh_query.close()
+    else:
+        sbh_query = CountingQuery(index, latency) if latency else index
+        for name, func in operations(uris):
+            report['results'].append(measure(name, func, sbh_query, repeat))
+    clear_caches()
+    return report
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description='Benchmark sbh_prospector against a synthetic hierarchy')
+    parser.add_argument('--depth', type=int, default=3,
+                        help="(default: %(default)s)")
+    parser.add_argument('--fanout', type=int, default=3,
+                        help="(default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="(default: %(default)s)")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="simulated seconds per query (default: %(default)s)")
+    parser.add_argument('--http', action='store_true',
+                        help="query a local stand-in server over HTTP (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="(default: %(default)s)")
+    parser.add_argument('-o', '--output',
+                        help="write the JSON report here instead of stdout")
+    return parser.parse_args(args)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmarks(args.depth, args.fanout, args.repeat, args.latency, args.http, args.seed)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
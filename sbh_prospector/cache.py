@@ -0,0 +1,219 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from . import instrument
+from .prospector import server_for
+
+# Default upper bound on the number of cached query results
+DEFAULT_MAX_ENTRIES = 100000
+
+# The SQLite cache counts its entries, a scan of the whole table, only
+# every this many inserts, so it may hold up to this many too many
+MAX_TRIM_INTERVAL = 1000
+
+
+def normalize_sparql(sparql):
+    """Collapse runs of whitespace so that queries differing only in
+    indentation or line breaks share a cache entry.
+    """
+    return ' '.join(sparql.split())
+
+
+def cache_key(server, sparql):
+    """Key for a query result: the server URL plus the normalized
+    SPARQL text, hashed to keep keys small.
+    """
+    text = '{}\n{}'.format(server, normalize_sparql(sparql))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def default_cache_path():
+    """Location of the on-disk cache shared by all processes of a user."""
+    cache_home = os.getenv('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'sbh_prospector', 'queries.sqlite')
+
+
+class QueryCache:
+    """Base class for query result caches. Subclasses implement `_get`,
+    `_put` and `clear`. Results are evicted least recently used first
+    once there are more than `max_entries`, and treated as missing once
+    they are older than `ttl` seconds (never, if `ttl` is None).
+    """
+
+    def __init__(self, ttl=None, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Return the cached result for `key`, or None."""
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._put(key, value)
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    expirations=self.expirations, entries=len(self))
+
+    def _expired(self, created):
+        return self.ttl is not None and created + self.ttl < time.time()
+
+
+class MemoryQueryCache(QueryCache):
+    """Per-process LRU cache of query results."""
+
+    def __init__(self, ttl=None, max_entries=DEFAULT_MAX_ENTRIES):
+        super().__init__(ttl, max_entries)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created, value = entry
+            if self._expired(created):
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteQueryCache(QueryCache):
+    """On-disk LRU cache of query results. The SQLite file can be shared
+    by any number of processes, so notebook sessions and cron jobs
+    reuse each other's results.
+
+    Entries beyond `max_entries` are evicted every 1% of `max_entries`
+    inserts (at most `MAX_TRIM_INTERVAL`) rather than on every insert.
+    """
+
+    def __init__(self, path=None, ttl=None, max_entries=DEFAULT_MAX_ENTRIES):
+        super().__init__(ttl, max_entries)
+        if path is None:
+            path = default_cache_path()
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._trim_interval = max(1, min(MAX_TRIM_INTERVAL, max_entries // 100))
+        self._unchecked_puts = 0
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        if path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS queries (
+                key TEXT PRIMARY KEY,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL,
+                value TEXT NOT NULL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS queries_accessed ON queries (accessed)')
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM queries').fetchone()[0]
+
+    def _get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT created, value FROM queries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            created, value = row
+            if self._expired(created):
+                self._conn.execute('DELETE FROM queries WHERE key = ?', (key,))
+                self.expirations += 1
+                return None
+            self._conn.execute('UPDATE queries SET accessed = ? WHERE key = ?', (time.time(), key))
+            return value
+
+    def _put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO queries (key, created, accessed, value) VALUES (?, ?, ?, ?)',
+                               (key, now, now, value))
+            self._unchecked_puts += 1
+            if self._unchecked_puts < self._trim_interval:
+                return
+            self._unchecked_puts = 0
+            excess = self._conn.execute('SELECT COUNT(*) FROM queries').fetchone()[0] - self.max_entries
+            if excess > 0:
+                cursor = self._conn.execute("""
+                    DELETE FROM queries WHERE key IN (
+                        SELECT key FROM queries ORDER BY accessed LIMIT ?
+                    )
+                """, (excess,))
+                self.evictions += cursor.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM queries')
+
+    def close(self):
+        self._conn.close()
+
+
+class CachedQuery:
+    """Wrap a `SynBioHubQuery` (or anything with a compatible
+    `fetch_SPARQL`) so that results are looked up in `cache` before
+    going to the server. Everything else is passed through, so a
+    `CachedQuery` can be used anywhere a `SynBioHubQuery` is.
+
+    Keys are the server URL plus the normalized SPARQL text, so a fresh
+    `SynBioHubQuery` for the same server shares the cached results.
+    """
+
+    def __init__(self, sbh_query, cache=None):
+        if cache is None:
+            cache = SQLiteQueryCache()
+        self.sbh_query = sbh_query
+        self.cache = cache
+
+    def __getattr__(self, name):
+        if name == 'sbh_query':
+            raise AttributeError(name)
+        return getattr(self.sbh_query, name)
+
+    def fetch_SPARQL(self, server, sparql):
+        key = cache_key(server or server_for(self.sbh_query), sparql)
+        value = self.cache.get(key)
+        instrument.record_cache(value is not None)
+        if value is not None:
+            return json.loads(value)
+        logging.debug('Cache miss, querying server')
+        result = self.sbh_query.fetch_SPARQL(server, sparql)
+        self.cache.put(key, json.dumps(result))
+        return result
@@ -0,0 +1,219 @@
+"""The sbh-prospector command line.
+
+    sbh-prospector strains URI...      strains contained in each module definition
+    sbh-prospector reagents URI...     reagents contained in each module definition
+    sbh-prospector roots URI...        root module definitions of each URI
+    sbh-prospector experiments URI...  experiments using each construct
+    sbh-prospector describe URI...     every predicate and object of each URI
+    sbh-prospector members [URI...]    members of the challenge problems
+
+Rows are written as they are found, as JSON lines or CSV, except that
+with --processes the strains and reagents commands split the URIs
+between worker processes and write the rows once all are done. Queries go to
+SynBioHub, logging in as --user with the password in $SBH_PASSWORD, or
+with --snapshot to local RDF files instead. Start up is kept short for
+wrappers that run a command at a time: pandas, synbiohub_adapter and
+requests are only imported by the commands and backends that use them.
+`python -m sbh_prospector.bench` reports the start up time.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+
+from . import prospector
+
+
+def strains(sbh_query, uris, args, executor):
+    for uri in uris:
+        for strain in prospector.iter_contained_strains(sbh_query, uri, executor=executor):
+            yield uri, strain
+
+
+def reagents(sbh_query, uris, args, executor):
+    for uri in uris:
+        for reagent in prospector.iter_contained_reagents(sbh_query, uri, executor=executor):
+            yield uri, reagent
+
+
+# commands that --processes splits between worker processes -> the kind
+# of item they scan for
+SHARDED = {'strains': 'strain', 'reagents': 'reagent'}
+
+
+def sharded(uris, args, kind):
+    """Scan `uris` on --processes worker processes, each connecting as
+    `connect(args)` does.
+    """
+    import functools
+    from . import shard
+    with shard.ShardPool(functools.partial(connect, args), args.processes, args.workers) as pool:
+        frame = shard.scan_contained(pool, uris, kind)
+    yield from frame.itertuples(index=False)
+
+
+def roots(sbh_query, uris, args, executor):
+    for uri in uris:
+        for root in prospector.root_module_definitions(sbh_query, uri):
+            yield uri, root
+
+
+def experiments(sbh_query, uris, args, executor):
+    for uri in uris:
+        frame = prospector.find_construct_experiments(sbh_query, uri, args.media, executor)
+        for row in frame.itertuples(index=False):
+            yield uri, row.uri, row.title
+
+
+def describe(sbh_query, uris, args, executor):
+    for uri in uris:
+        for pred, obj in prospector.subject_info(sbh_query, uri):
+            yield uri, pred, obj
+
+
+def members(sbh_query, uris, args, executor):
+    frame = prospector.challenge_problem_report(sbh_query, uris or None, executor=executor)
+    yield from frame.itertuples(index=False)
+
+
+# name -> (function yielding rows, column names, help)
+COMMANDS = {
+    'strains': (strains, ['uri', 'strain'], 'find the strains contained in each URI'),
+    'reagents': (reagents, ['uri', 'reagent'], 'find the reagents contained in each URI'),
+    'roots': (roots, ['uri', 'root'], 'find the root module definitions of each URI'),
+    'experiments': (experiments, ['construct', 'uri', 'title'], 'find the experiments using each construct'),
+    'describe': (describe, ['uri', 'predicate', 'object'], 'list every predicate and object of each URI'),
+    'members': (members, ['member', 'title', 'collection', 'collections'],
+                'list the members of the given collections, by default the challenge problems'),
+}
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(prog='sbh-prospector', description='Explore a SynBioHub database')
+    parser.add_argument('-d', '--debug', action='store_true',
+                        help="(default: %(default)s)")
+    parser.add_argument('--staging', action='store_true',
+                        help="(default: %(default)s)")
+    parser.add_argument('-u', '--user', default='sd2e',
+                        help="(default: %(default)s)")
+    parser.add_argument('--snapshot', metavar='FILE', action='append',
+                        help="query these SBOL2, N-Triples or Turtle files instead of SynBioHub")
+    parser.add_argument('-f', '--format', choices=['jsonl', 'csv'], default='jsonl',
+                        help="(default: %(default)s)")
+    parser.add_argument('-o', '--output',
+                        help="write rows here instead of stdout")
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help="number of concurrent queries (default: %(default)s)")
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help="split strains and reagents scans across this many processes (default: %(default)s)")
+    commands = parser.add_subparsers(dest='command', metavar='command', required=True)
+    for name, (_, _, help) in COMMANDS.items():
+        command = commands.add_parser(name, help=help)
+        command.add_argument('uris', metavar='URI', nargs='*' if name == 'members' else '+')
+        if name == 'experiments':
+            command.add_argument('--media', help="only experiments using this media")
+    args = parser.parse_args(args)
+    if args.staging and args.workers > 1:
+        # The staging server is queried through a SynBioHubQuery, which
+        # cannot be shared between threads
+        parser.error('--staging cannot be used with more than one worker')
+    return args
+
+
+def init_logging(debug=False):
+    msgFormat = '%(asctime)s %(levelname)s %(message)s'
+    dateFormat = '%m/%d/%Y %H:%M:%S'
+    level = logging.INFO
+    if debug:
+        level = logging.DEBUG
+    logging.basicConfig(format=msgFormat, datefmt=dateFormat, level=level)
+
+
+def connect(args):
+    """The `sbh_query` the command runs against."""
+    if args.snapshot:
+        from .snapshot import SnapshotIndex
+        return SnapshotIndex.from_files(args.snapshot)
+
+    # Get SynBioHub password
+    sbh_password = os.getenv('SBH_PASSWORD')
+    if sbh_password is None:
+        raise Exception('Environment does not contain SBH_PASSWORD')
+
+    import synbiohub_adapter as sbha
+    if args.staging:
+        sbh_query = sbha.SynBioHubQuery(sbha.SD2Constants.SD2_STAGING_SERVER,
+                                        spoofed_url=sbha.SD2Constants.SD2_SERVER)
+    else:
+        # Unlike a SynBioHubQuery, a SparqlSession can be used by
+        # several workers at once
+        from .executor import SparqlSession
+        sbh_query = SparqlSession(sbha.SD2Constants.SD2_SERVER, pool_size=args.workers)
+    logging.info('Authenticating to {}'.format(sbh_query._server))
+    sbh_query.login(args.user, sbh_password)
+    logging.info('Authentication complete')
+    return sbh_query
+
+
+def row_writer(output, format, columns):
+    """Return a function writing one row, a sequence of values in the
+    order of `columns`, to `output`.
+    """
+    if format == 'csv':
+        writer = csv.writer(output)
+        writer.writerow(columns)
+        return writer.writerow
+
+    def write_json(row):
+        output.write(json.dumps(dict(zip(columns, row))) + '\n')
+
+    return write_json
+
+
+def run(args, output):
+    """Run the command of the parsed `args`, writing its rows to
+    `output`. Returns the number of rows written.
+    """
+    func, columns, _ = COMMANDS[args.command]
+    executor = None
+    if args.processes > 1 and args.command in SHARDED:
+        # Each worker process connects for itself
+        rows = sharded(args.uris, args, SHARDED[args.command])
+    else:
+        sbh_query = connect(args)
+        if args.workers > 1:
+            from .executor import QueryExecutor
+            executor = QueryExecutor(max_workers=args.workers)
+        rows = func(sbh_query, args.uris, args, executor)
+    write = row_writer(output, args.format, columns)
+    count = 0
+    try:
+        for row in rows:
+            write(row)
+            count += 1
+            output.flush()
+    finally:
+        if executor is not None:
+            executor.close()
+    logging.info('Wrote %d rows', count)
+    return count
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Init logging
+    init_logging(args.debug)
+
+    if args.output:
+        with open(args.output, 'w', newline='') as output:
+            run(args, output)
+    else:
+        run(args, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
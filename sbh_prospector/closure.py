@@ -0,0 +1,386 @@
+"""A materialized transitive closure of the module and component
+hierarchy of a collection, kept in SQLite.
+
+Once built, "which strains does X contain" and "what are the roots of
+X" are single indexed lookups. Registered indexes are consulted by
+`find_contained_strains`, `find_contained_reagents` and
+`root_module_definitions` before they go to the server:
+
+    members = objects_for(sbh_query, collection, SBOL_MEMBER)
+    index = ClosureIndex.build(sbh_query, members, 'yeast-gates.sqlite')
+    add_closure_index(index)
+
+Later, `index.refresh(sbh_query)` re-expands only the subjects whose
+hierarchy triples have changed.
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from .memoization import memo_server
+from .prospector import (CHEBI_IDENTIFIERS_PREFIX, CHEBI_PURL_PREFIX, COMPILED_PARENT_DEFINITIONS_QUERY, NCIT_STRAIN,
+                         SBOL_DEFINITION, SBOL_FUNCTIONAL_COMPONENT, SBOL_MODULE, SBOL_ROLE, SBOL_TYPE,
+                         VALUES_CHUNK_SIZE, ExploredGraph, child_definitions_many, format_query_result,
+                         objects_for_many, run_compiled, walk_levels)
+
+CONTAINMENT_PREDICATES = [SBOL_MODULE, SBOL_FUNCTIONAL_COMPONENT]
+# The predicates of a subject's own triples that decide whether it is a
+# strain or a reagent
+TYPE_PREDICATES = [SBOL_ROLE, SBOL_TYPE]
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS nodes (
+        uri TEXT PRIMARY KEY,
+        strain INTEGER,
+        reagent INTEGER,
+        fingerprint TEXT,
+        expanded INTEGER NOT NULL DEFAULT 0,
+        parents_known INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS edges (
+        parent TEXT NOT NULL,
+        pred TEXT NOT NULL,
+        child TEXT NOT NULL,
+        PRIMARY KEY (parent, pred, child)
+    );
+    CREATE INDEX IF NOT EXISTS edges_child ON edges (child);
+    CREATE TABLE IF NOT EXISTS closure (
+        ancestor TEXT NOT NULL,
+        descendant TEXT NOT NULL,
+        depth INTEGER NOT NULL,
+        modules_only INTEGER NOT NULL,
+        PRIMARY KEY (ancestor, descendant)
+    );
+    CREATE INDEX IF NOT EXISTS closure_descendant ON closure (descendant);
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+"""
+
+
+def fingerprint(edges, types):
+    """Hash of the hierarchy triples of a subject, used to spot the
+    subjects that changed since the index was built.
+    """
+    text = json.dumps([sorted(edges), sorted(types)])
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ClosureIndex:
+    """The transitive closure of the module and component hierarchy
+    below a set of roots, e.g. the members of a collection, plus every
+    ancestor of the nodes below them. Stored in the SQLite file at
+    `path`, so it outlives the process that built it.
+
+    The lookups return None for URIs the index cannot answer for, in
+    which case the caller should query the server.
+
+    `key` is the `memo_server` of the backends the index answers for.
+    It is set by `build`, and when an index is reopened defaults to the
+    server it was built from. An index built from a backend naming no
+    server, like a `SnapshotIndex`, answers only for that backend, so
+    once reopened it needs the `key` passed in again.
+    """
+
+    def __init__(self, path=':memory:', key=None):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        if path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        if key is None:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'server'").fetchone()
+            key = row and json.loads(row[0])
+        self.key = key
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM nodes').fetchone()[0]
+
+    def meta(self):
+        with self._lock:
+            return {key: json.loads(value) for key, value in self._conn.execute('SELECT key, value FROM meta')}
+
+    def _set_meta(self, **values):
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                                   [(key, json.dumps(value)) for key, value in values.items()])
+
+    def close(self):
+        self._conn.close()
+
+    # Lookups
+
+    def contained_strains(self, uri):
+        """The strains contained in `uri`, like `find_contained_strains`."""
+        return self._contained(uri, 'c.modules_only AND n.strain')
+
+    def contained_reagents(self, uri):
+        """The reagents contained in `uri`, like `find_contained_reagents`."""
+        return self._contained(uri, 'n.reagent')
+
+    def _contained(self, uri, condition):
+        with self._lock:
+            row = self._conn.execute('SELECT expanded FROM nodes WHERE uri = ?', (uri,)).fetchone()
+            if row is None or not row[0]:
+                return None
+            return [descendant for descendant, in self._conn.execute("""
+                SELECT c.descendant FROM closure c JOIN nodes n ON n.uri = c.descendant
+                WHERE c.ancestor = ? AND {}
+                ORDER BY c.depth, c.descendant
+            """.format(condition), (uri,))]
+
+    def roots(self, uri):
+        """The ancestors of `uri` that have no parent, like
+        `root_module_definitions`.
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT parents_known FROM nodes WHERE uri = ?', (uri,)).fetchone()
+            if row is None or not row[0]:
+                return None
+            return [ancestor for ancestor, in self._conn.execute("""
+                SELECT c.ancestor FROM closure c
+                WHERE c.descendant = ? AND c.ancestor != c.descendant
+                AND NOT EXISTS (SELECT 1 FROM edges e WHERE e.child = c.ancestor)
+                ORDER BY c.depth, c.ancestor
+            """, (uri,))]
+
+    # Building
+
+    @classmethod
+    def build(cls, sbh_query, roots, path=':memory:', chunk_size=None, executor=None):
+        """Build an index of everything below `roots` and every ancestor
+        of it. About two queries per `chunk_size` nodes at each level
+        of the hierarchy, concurrently if an `executor` is given.
+        """
+        index = cls(path, memo_server(sbh_query))
+        index.clear()
+        roots = list(roots)
+        start = time.time()
+        below = index._expand_down(sbh_query, roots, chunk_size, executor)
+        above = index._expand_up(sbh_query, below, chunk_size, executor)
+        index._recompute(below + above)
+        # A backend naming no server is keyed on itself, which cannot be
+        # stored
+        server = index.key if isinstance(index.key, str) else None
+        index._set_meta(server=server, roots=roots, built=time.time(), refreshed=time.time())
+        logging.info('Closure of %d nodes built in %.1f seconds', len(index), time.time() - start)
+        return index
+
+    def clear(self):
+        with self._lock:
+            for table in ('nodes', 'edges', 'closure', 'meta'):
+                self._conn.execute('DELETE FROM {}'.format(table))
+
+    def refresh(self, sbh_query, changed=None, chunk_size=None, executor=None):
+        """Bring the index up to date with the server. The hierarchy
+        triples of every node are fetched again (or only those of the
+        URIs in `changed`, if the caller knows which subjects changed)
+        and only the nodes whose triples differ are re-expanded. The
+        closure is recomputed for the ancestors of those nodes alone.
+
+        Returns the list of nodes that changed.
+        """
+        with self._lock:
+            expanded = [uri for uri, in self._conn.execute('SELECT uri FROM nodes WHERE expanded')]
+            parents_known = [uri for uri, in self._conn.execute('SELECT uri FROM nodes WHERE parents_known')]
+            old = dict(self._conn.execute('SELECT uri, fingerprint FROM nodes WHERE expanded'))
+        if changed is not None:
+            changed = set(changed)
+            expanded = [uri for uri in expanded if uri in changed]
+            parents_known = [uri for uri in parents_known if uri in changed]
+
+        found = self._fetch(sbh_query, expanded, chunk_size, executor)
+        dirty = [uri for uri in expanded if fingerprint(*found[uri]) != old[uri]]
+        touched = set(self._ancestors(dirty))
+        self._store({uri: found[uri] for uri in dirty})
+        with self._lock:
+            known = {uri for uri, in self._conn.execute('SELECT uri FROM nodes WHERE expanded')}
+        new = [child for uri in dirty for _, child in found[uri][0] if child not in known]
+        below = self._expand_down(sbh_query, new, chunk_size, executor)
+
+        parents = self._fetch_parents(sbh_query, parents_known + below, chunk_size, executor)
+        moved = []
+        with self._lock:
+            for uri, edges in parents.items():
+                stored = set(self._conn.execute('SELECT parent, pred FROM edges WHERE child = ?', (uri,)))
+                if stored != edges:
+                    moved.append(uri)
+        touched.update(self._ancestors(moved))
+        self._store_parents({uri: parents[uri] for uri in moved + below})
+        above = self._expand_up(sbh_query, [parent for uri in moved + below for parent, _ in parents[uri]],
+                                chunk_size, executor)
+
+        changed_nodes = list(dict.fromkeys(dirty + moved + below + above))
+        touched.update(changed_nodes)
+        touched.update(self._ancestors(touched, edges=self._edges()))
+        self._recompute(touched)
+        self._set_meta(refreshed=time.time())
+        logging.info('Refreshed closure: %d of %d nodes changed', len(changed_nodes), len(self))
+        return changed_nodes
+
+    def _fetch(self, sbh_query, uris, chunk_size=None, executor=None):
+        """Fetch the child edges and the type triples of each of `uris`.
+        Returns a dict of uri -> ([(pred, child)], [(pred, type)]).
+        """
+        if chunk_size is None:
+            chunk_size = VALUES_CHUNK_SIZE
+        children = child_definitions_many(sbh_query, uris, CONTAINMENT_PREDICATES, chunk_size, executor)
+        found = {uri: ([(pred, child) for pred in CONTAINMENT_PREDICATES for child in children[uri][pred]], [])
+                 for uri in uris}
+        pairs = [(uri, pred) for uri in found for pred in TYPE_PREDICATES]
+        for (uri, pred), objs in zip(pairs, objects_for_many(sbh_query, pairs, chunk_size * len(TYPE_PREDICATES),
+                                                             executor)):
+            found[uri][1].extend((pred, obj) for obj in objs)
+        return found
+
+    def _fetch_parents(self, sbh_query, uris, chunk_size=None, executor=None):
+        """Fetch the parent edges of each of `uris`. Returns a dict of
+        uri -> {(parent, pred)}.
+        """
+        if chunk_size is None:
+            chunk_size = VALUES_CHUNK_SIZE
+        found = {uri: set() for uri in uris}
+        rows = [(uri, pred, SBOL_DEFINITION) for uri in found for pred in CONTAINMENT_PREDICATES]
+        results = run_compiled(sbh_query, COMPILED_PARENT_DEFINITIONS_QUERY, rows,
+                               chunk_size * len(CONTAINMENT_PREDICATES), executor)
+        for (uri, pred, _), parents in zip(rows, results):
+            found[uri].update((parent, pred) for parent in format_query_result(sbh_query, parents, ['s']))
+        return found
+
+    def _store(self, found):
+        """Replace the child edges and flags of each expanded node."""
+        with self._lock:
+            self._conn.execute('BEGIN')
+            for uri, (edges, types) in found.items():
+                strain = (SBOL_ROLE, NCIT_STRAIN) in types
+                reagent = any(pred == SBOL_TYPE and obj.startswith((CHEBI_PURL_PREFIX, CHEBI_IDENTIFIERS_PREFIX))
+                              for pred, obj in types)
+                self._conn.execute("""
+                    INSERT INTO nodes (uri, strain, reagent, fingerprint, expanded) VALUES (?, ?, ?, ?, 1)
+                    ON CONFLICT (uri) DO UPDATE SET strain = excluded.strain, reagent = excluded.reagent,
+                    fingerprint = excluded.fingerprint, expanded = 1
+                """, (uri, strain, reagent, fingerprint(edges, types)))
+                self._conn.execute('DELETE FROM edges WHERE parent = ?', (uri,))
+                self._conn.executemany('INSERT INTO edges (parent, pred, child) VALUES (?, ?, ?)',
+                                       [(uri, pred, child) for pred, child in set(edges)])
+            self._conn.execute('COMMIT')
+
+    def _store_parents(self, parents):
+        """Replace the parent edges of each node whose ancestors are now
+        known.
+        """
+        with self._lock:
+            self._conn.execute('BEGIN')
+            for uri, edges in parents.items():
+                self._conn.execute('INSERT INTO nodes (uri, parents_known) VALUES (?, 1) '
+                                   'ON CONFLICT (uri) DO UPDATE SET parents_known = 1', (uri,))
+                self._conn.execute('DELETE FROM edges WHERE child = ?', (uri,))
+                self._conn.executemany('INSERT INTO edges (parent, pred, child) VALUES (?, ?, ?)',
+                                       [(parent, pred, uri) for parent, pred in edges])
+            self._conn.execute('COMMIT')
+
+    def _walk(self, sbh_query, uris, expand, done, chunk_size, executor):
+        """Walk from `uris` with `expand`, skipping the nodes in `done`.
+        Returns the nodes expanded.
+        """
+        graph = ExploredGraph()
+        for uri in done:
+            graph.add_node(uri, 0)
+        walked = []
+        for _, frontier in walk_levels(sbh_query, uris, expand, chunk_size, executor, graph=graph):
+            walked.extend(frontier)
+        return walked
+
+    def _expand_down(self, sbh_query, uris, chunk_size=None, executor=None):
+        """Expand everything below `uris` that is not yet expanded."""
+        def expand(sbh_query, frontier, chunk_size=None, executor=None):
+            found = self._fetch(sbh_query, frontier, chunk_size, executor)
+            self._store(found)
+            return {uri: [child for _, child in found[uri][0]] for uri in frontier}
+
+        with self._lock:
+            done = [uri for uri, in self._conn.execute('SELECT uri FROM nodes WHERE expanded')]
+        return self._walk(sbh_query, uris, expand, done, chunk_size, executor)
+
+    def _expand_up(self, sbh_query, uris, chunk_size=None, executor=None):
+        """Find the parents of `uris` and of all their ancestors, where
+        not yet known.
+        """
+        def expand(sbh_query, frontier, chunk_size=None, executor=None):
+            parents = self._fetch_parents(sbh_query, frontier, chunk_size, executor)
+            self._store_parents(parents)
+            return {uri: [parent for parent, _ in parents[uri]] for uri in frontier}
+
+        with self._lock:
+            done = [uri for uri, in self._conn.execute('SELECT uri FROM nodes WHERE parents_known')]
+        return self._walk(sbh_query, uris, expand, done, chunk_size, executor)
+
+    def _edges(self):
+        with self._lock:
+            return list(self._conn.execute('SELECT parent, pred, child FROM edges'))
+
+    def _ancestors(self, uris, edges=None):
+        """The ancestors of `uris`, from the stored closure or, given
+        `edges`, by walking them.
+        """
+        found = set()
+        if edges is None:
+            with self._lock:
+                for uri in uris:
+                    found.update(a for a, in self._conn.execute('SELECT ancestor FROM closure WHERE descendant = ?',
+                                                                (uri,)))
+            return found
+        parents = collections.defaultdict(set)
+        for parent, _, child in edges:
+            parents[child].add(parent)
+        queue = collections.deque(uris)
+        while queue:
+            for parent in parents[queue.popleft()]:
+                if parent not in found:
+                    found.add(parent)
+                    queue.append(parent)
+        return found
+
+    def _recompute(self, uris):
+        """Recompute the closure rows of each of `uris`: its descendants,
+        their depth, and whether they are reached through modules alone.
+        """
+        uris = set(uris)
+        children = collections.defaultdict(list)
+        for parent, pred, child in self._edges():
+            children[parent].append((pred == SBOL_MODULE, child))
+        rows = []
+        for uri in uris:
+            # Breadth first, so depth is the shortest distance. A node
+            # is queued again if it turns out to be reachable through
+            # module edges alone by a longer path.
+            depth = {uri: 0}
+            modules_only = {uri}
+            queue = collections.deque([uri])
+            while queue:
+                node = queue.popleft()
+                for is_module, child in children[node]:
+                    if child not in depth:
+                        depth[child] = depth[node] + 1
+                        queue.append(child)
+                    if is_module and node in modules_only and child not in modules_only:
+                        modules_only.add(child)
+                        queue.append(child)
+            rows.extend((uri, node, d, node in modules_only) for node, d in depth.items())
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.executemany('DELETE FROM closure WHERE ancestor = ?', [(uri,) for uri in uris])
+            self._conn.executemany('INSERT INTO closure (ancestor, descendant, depth, modules_only) '
+                                   'VALUES (?, ?, ?, ?)', rows)
+            self._conn.execute('COMMIT')
@@ -0,0 +1,146 @@
+import concurrent.futures
+import logging
+import threading
+
+from .cache import cache_key
+from .prospector import server_for
+
+
+class SingleFlight:
+    """Share one call between concurrent callers asking for the same
+    key. The first caller runs the function, and callers arriving while
+    it is in flight wait for its result (or exception) instead of
+    making the call again. Nothing is kept once the call completes, so
+    this complements a cache rather than replacing one.
+
+    `do` is for threads and `do_async` for coroutines. Callers share
+    the result object itself, so it must not be modified.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+        self.calls = 0
+        self.shared = 0
+
+    def __len__(self):
+        """The number of calls in flight."""
+        with self._lock:
+            return len(self._calls) + len(self._tasks)
+
+    def stats(self):
+        return dict(calls=self.calls, shared=self.shared, in_flight=len(self))
+
+    def do(self, key, func, *args):
+        """Return `func(*args)`, or the result of the identical call
+        already in flight for `key` in another thread.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = concurrent.futures.Future()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            logging.debug('Waiting for in-flight call %s', key)
+            return future.result()
+        try:
+            result = func(*args)
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def do_async(self, key, func, *args):
+        """Return `await func(*args)`, or the result of the identical
+        call already in flight for `key` on the same event loop.
+        """
+        # Imported here as it is slow to import and only needed by aio.py
+        import asyncio
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            future = self._tasks.get((loop, key))
+            leader = future is None
+            if leader:
+                future = self._tasks[(loop, key)] = loop.create_future()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            logging.debug('Waiting for in-flight call %s', key)
+            # Shielded so that a waiter being cancelled does not cancel
+            # the call for everyone else
+            return await asyncio.shield(future)
+        try:
+            result = await func(*args)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as err:
+            future.set_exception(err)
+            # Mark the exception retrieved in case nobody was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._tasks[(loop, key)]
+
+
+class CoalescingQuery:
+    """Wrap a `SynBioHubQuery` (or anything with a compatible
+    `fetch_SPARQL`) so that identical queries made concurrently, e.g. by
+    threads of a `QueryExecutor` exploring overlapping hierarchies, are
+    sent to the server once. Queries are identical if they are for the
+    same server and differ at most in whitespace.
+
+    Wrap it in a `CachedQuery` to also keep the results:
+
+        sbh_query = CachedQuery(CoalescingQuery(SparqlSession(server)))
+    """
+
+    def __init__(self, sbh_query, flight=None):
+        if flight is None:
+            flight = SingleFlight()
+        self.sbh_query = sbh_query
+        self.flight = flight
+
+    def __getattr__(self, name):
+        if name == 'sbh_query':
+            raise AttributeError(name)
+        return getattr(self.sbh_query, name)
+
+    def fetch_SPARQL(self, server, sparql):
+        key = cache_key(server or server_for(self.sbh_query), sparql)
+        return self.flight.do(key, self.sbh_query.fetch_SPARQL, server, sparql)
+
+
+class AsyncCoalescingQuery(CoalescingQuery):
+    """`CoalescingQuery` for asyncio callers: wraps an `sbh_query` with a
+    coroutine `fetch_SPARQL`, like an `AsyncSparqlSession`, so that
+    identical queries awaited at the same time on one event loop are
+    sent to the server once.
+
+        async with AsyncCoalescingQuery(AsyncSparqlSession(server)) as sbh_query:
+            strains = await aio.find_contained_strains(sbh_query, uri)
+    """
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.sbh_query.close()
+
+    async def fetch_SPARQL(self, server, sparql):
+        key = cache_key(server or server_for(self.sbh_query), sparql)
+        return await self.flight.do_async(key, self.sbh_query.fetch_SPARQL, server, sparql)
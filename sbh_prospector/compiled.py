@@ -0,0 +1,88 @@
+import re
+import string
+
+# A VALUES block with a single row of URI placeholders, as used by the
+# query templates in prospector.py, e.g. VALUES (?s ?p) {{ ( <{}> <{}> ) }}
+VALUES_BLOCK = re.compile(r'VALUES\s*\(([^)]*)\)\s*\{\{\s*\(\s*((?:<\{\}>\s*)+)\)\s*\}\}')
+SELECT_CLAUSE = re.compile(r'SELECT\s+(DISTINCT\s+)?((?:\?\w+\s+)+)WHERE', re.IGNORECASE)
+
+# Characters that may not appear in a SPARQL IRIREF
+INVALID_URI = re.compile(r'[<>"{}|^`\\\x00-\x20]')
+
+
+def check_uri(uri):
+    """Return `uri` if it can be placed between angle brackets in a
+    query, otherwise raise ValueError. Nothing can escape the brackets,
+    so a URI cannot inject SPARQL.
+    """
+    if not isinstance(uri, str) or not uri or INVALID_URI.search(uri):
+        raise ValueError('Invalid URI: {!r}'.format(uri))
+    return uri
+
+
+def format_uris(template, *uris, **named_uris):
+    """`template.format(*uris, **named_uris)` for a template whose every
+    parameter is a URI, each checked by `check_uri` first.
+    """
+    return template.format(*map(check_uri, uris), **{name: check_uri(uri) for name, uri in named_uris.items()})
+
+
+def values_rows(uris):
+    """Format URIs as the rows of a single-variable VALUES block."""
+    return ' '.join('( <{}> )'.format(check_uri(uri)) for uri in uris)
+
+
+class CompiledQuery:
+    """A query template parsed once, so that it can be filled with any
+    number of parameter rows without `str.format`.
+
+    `template` is one of the templates in prospector.py: a SELECT whose
+    only parameters are URIs in a one row VALUES block. `render` packs
+    many rows into a single VALUES block, adding the parameters to the
+    selected variables, and `split` demultiplexes the result back into
+    one result per row, as if each row had been queried on its own.
+    """
+
+    def __init__(self, name, template):
+        self.name = name
+        values = VALUES_BLOCK.search(template)
+        if values is None:
+            raise ValueError('{} has no VALUES block of URI parameters'.format(name))
+        self.params = [var.lstrip('?') for var in values.group(1).split()]
+        if values.group(2).count('<{}>') != len(self.params):
+            raise ValueError('{} has a VALUES row of the wrong length'.format(name))
+        head = template[:values.start()]
+        tail = template[values.end():]
+        if any(field is not None for _, field, _, _ in string.Formatter().parse(head + tail)):
+            raise ValueError('{} has parameters outside its VALUES block'.format(name))
+        head = head.replace('{{', '{').replace('}}', '}')
+        tail = tail.replace('{{', '{').replace('}}', '}')
+
+        select = SELECT_CLAUSE.search(head)
+        if select is None:
+            raise ValueError('{} is not a SELECT query'.format(name))
+        self.selected = [var.lstrip('?') for var in select.group(2).split()]
+        variables = self.selected + [p for p in self.params if p not in self.selected]
+        self._head = '{}SELECT {}{} WHERE{}'.format(head[:select.start()], select.group(1) or '',
+                                                    ' '.join('?' + var for var in variables), head[select.end():])
+        self._values = 'VALUES ({}) {{ '.format(' '.join('?' + p for p in self.params))
+        self._tail = ' }' + tail
+
+    def __repr__(self):
+        return 'CompiledQuery({!r})'.format(self.name)
+
+    def render(self, rows):
+        """The query for the parameter `rows`, each a tuple of URIs."""
+        values = ' '.join('( {} )'.format(' '.join('<{}>'.format(check_uri(uri)) for uri in row)) for row in rows)
+        return self._head + self._values + values + self._tail
+
+    def split(self, result, rows):
+        """Split the SPARQL JSON `result` of `render(rows)` into one
+        SPARQL JSON result per row, holding the originally selected
+        variables.
+        """
+        split = {tuple(row): [] for row in rows}
+        for binding in result['results']['bindings']:
+            key = tuple(binding[p]['value'] for p in self.params)
+            split[key].append({var: binding[var] for var in self.selected if var in binding})
+        return [dict(head=dict(vars=self.selected), results=dict(bindings=split[tuple(row)])) for row in rows]
@@ -0,0 +1,133 @@
+import concurrent.futures
+import logging
+import socket
+import sys
+import time
+
+from . import instrument, sparql
+from .prospector import run_query
+
+# SPARQL queries longer than this are POSTed rather than sent in the URL
+MAX_GET_QUERY_LENGTH = 4000
+
+
+def is_retryable(err):
+    """Determine if a failed query is worth retrying: timeouts,
+    dropped connections and 5xx responses.
+    """
+    if isinstance(err, (TimeoutError, ConnectionError, socket.timeout)):
+        return True
+    # requests is only imported once a SparqlSession is made, and can
+    # only have raised the error if it has been
+    requests = sys.modules.get('requests')
+    if requests is not None and isinstance(err, (requests.Timeout, requests.ConnectionError)):
+        return True
+    # SPARQLWrapper reports 500s with its own exception class
+    if type(err).__name__ == 'EndPointInternalError':
+        return True
+    status = getattr(err, 'code', None)
+    response = getattr(err, 'response', None)
+    if response is not None:
+        status = getattr(response, 'status_code', status)
+    return isinstance(status, int) and status >= 500
+
+
+class SparqlSession:
+    """A SynBioHub SPARQL client that keeps a pool of keep-alive
+    connections. Unlike `SynBioHubQuery` it is safe to share between
+    threads, so it is the backend to use with a `QueryExecutor`. It can
+    be used anywhere a `SynBioHubQuery` is.
+    """
+
+    def __init__(self, server, pool_size=10, timeout=60):
+        import requests.adapters
+        self._server = server.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['Accept'] = 'application/sparql-results+json'
+
+    def login(self, user, password):
+        response = self.session.post(self._server + '/login', data=dict(email=user, password=password),
+                                     headers={'Accept': 'text/plain'}, timeout=self.timeout)
+        response.raise_for_status()
+        self.session.headers['X-authorization'] = response.text
+
+    def fetch_SPARQL(self, server, query):
+        url = (server or self._server) + '/sparql'
+        if len(query) > MAX_GET_QUERY_LENGTH:
+            response = self.session.post(url, data=dict(query=query), timeout=self.timeout)
+        else:
+            response = self.session.get(url, params=dict(query=query), timeout=self.timeout)
+        response.raise_for_status()
+        instrument.record_response_bytes(len(response.content))
+        return response.json()
+
+    def format_query_result(self, query_result, binding_keys, group_key=None):
+        return sparql.format_bindings(query_result, binding_keys)
+
+    def close(self):
+        self.session.close()
+
+
+class QueryExecutor:
+    """Run many SPARQL queries, or many calls of a query function, on a
+    pool of `max_workers` threads. Failures that `is_retryable` are
+    retried up to `retries` times, waiting `backoff` seconds and then
+    twice as long after each further failure.
+
+    The `sbh_query` used with an executor is called from several threads
+    at once, so it should be a `SparqlSession` (or a `SnapshotIndex`)
+    rather than a `SynBioHubQuery`.
+    """
+
+    def __init__(self, max_workers=8, retries=3, backoff=0.5):
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                           thread_name_prefix='sbh-prospector')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._pool.shutdown()
+
+    def call(self, func, *args):
+        """Call `func(*args)`, retrying on transient failures."""
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                return func(*args)
+            except Exception as err:
+                if attempt == self.retries or not is_retryable(err):
+                    raise
+                logging.warning('Retrying in %.1f seconds after %s', delay, err)
+                time.sleep(delay)
+                delay *= 2
+
+    def map(self, func, items):
+        """Return [func(item) for item in items], computed concurrently."""
+        futures = [self._pool.submit(self.call, func, item) for item in items]
+        return [future.result() for future in futures]
+
+    def fetch(self, sbh_query, sparql_text, template=None, bindings=(), helper='QueryExecutor.fetch'):
+        """Run one query, retrying on transient failures. The optional
+        arguments are passed to `run_query` for tracing.
+        """
+        return self.call(run_query, sbh_query, sparql_text, template, bindings, helper)
+
+    def fetch_many(self, sbh_query, sparql_texts, template=None, bindings=None, helper='QueryExecutor.fetch_many'):
+        """Run each query concurrently. Returns the raw results in the
+        order of `sparql_texts`.
+        """
+        if bindings is None:
+            bindings = [()] * len(sparql_texts)
+        return self.map(lambda args: run_query(sbh_query, args[0], template, args[1], helper),
+                        list(zip(sparql_texts, bindings)))
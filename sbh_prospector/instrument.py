@@ -0,0 +1,212 @@
+"""Structured tracing of the SPARQL queries made by sbh_prospector.
+
+Every query dispatched by prospector.py is reported to the registered
+sinks as a `QueryEvent`. A sink is any callable taking an event;
+`MemorySink`, `JsonlSink` and `CallbackSink` are provided:
+
+    with instrument.tracing(instrument.MemorySink()) as sink:
+        find_contained_strains(sbh_query, uri)
+    print(sink.report())
+"""
+
+import collections
+import contextlib
+import contextvars
+import json
+import threading
+import time
+
+QueryEvent = collections.namedtuple('QueryEvent', [
+    'timestamp',      # when the query was sent, seconds since the epoch
+    'helper',         # the prospector function that made the query
+    'template',       # name of the query template
+    'bindings',       # the values substituted into the template
+    'seconds',        # latency
+    'rows',           # number of result rows
+    'response_bytes',  # size of the response if the backend reports it, else None
+    'cache',          # 'hit', 'miss', or None if no cache was involved
+    'error',          # repr of the exception raised, or None
+])
+
+_sinks = []
+
+# Per query details reported by the layers below `fetch_SPARQL`
+_cache_status = contextvars.ContextVar('sbh_prospector_cache_status', default=None)
+_response_bytes = contextvars.ContextVar('sbh_prospector_response_bytes', default=None)
+
+
+def add_sink(sink):
+    _sinks.append(sink)
+
+
+def remove_sink(sink):
+    _sinks.remove(sink)
+
+
+def enabled():
+    return bool(_sinks)
+
+
+@contextlib.contextmanager
+def tracing(sink):
+    """Report queries to `sink` for the duration of a `with` block."""
+    add_sink(sink)
+    try:
+        yield sink
+    finally:
+        remove_sink(sink)
+
+
+def record_cache(hit):
+    """Called by caches to report whether the current query was a hit."""
+    _cache_status.set('hit' if hit else 'miss')
+
+
+def record_response_bytes(size):
+    """Called by backends to report the size of the current response."""
+    _response_bytes.set(size)
+
+
+def traced_fetch(sbh_query, sparql, helper, template, bindings):
+    """Run `sbh_query.fetch_SPARQL` and report a `QueryEvent` to every
+    sink.
+    """
+    _cache_status.set(None)
+    _response_bytes.set(None)
+    timestamp = time.time()
+    start = time.perf_counter()
+    result = None
+    error = None
+    try:
+        result = sbh_query.fetch_SPARQL(None, sparql)
+        return result
+    except Exception as err:
+        error = repr(err)
+        raise
+    finally:
+        _report(timestamp, start, helper, template, bindings, result, error)
+
+
+async def traced_fetch_async(sbh_query, sparql, helper, template, bindings):
+    """Like `traced_fetch`, for an `sbh_query` whose `fetch_SPARQL` is
+    a coroutine.
+    """
+    _cache_status.set(None)
+    _response_bytes.set(None)
+    timestamp = time.time()
+    start = time.perf_counter()
+    result = None
+    error = None
+    try:
+        result = await sbh_query.fetch_SPARQL(None, sparql)
+        return result
+    except Exception as err:
+        error = repr(err)
+        raise
+    finally:
+        _report(timestamp, start, helper, template, bindings, result, error)
+
+
+def _report(timestamp, start, helper, template, bindings, result, error):
+    seconds = time.perf_counter() - start
+    rows = None
+    # Backends that do not report the size, like SynBioHubQuery, are not
+    # asked for it: measuring it would mean serializing the result again
+    size = _response_bytes.get()
+    if isinstance(result, dict):
+        rows = len(result.get('results', {}).get('bindings', ()))
+    event = QueryEvent(timestamp, helper, template, bindings, seconds, rows, size, _cache_status.get(), error)
+    for sink in list(_sinks):
+        sink(event)
+
+
+def summarize(events, by='helper'):
+    """Total up events by `by` (any `QueryEvent` field, e.g. 'helper' or
+    'template'). Returns a list of dicts, most time first.
+    """
+    totals = collections.OrderedDict()
+    for event in events:
+        key = getattr(event, by)
+        total = totals.setdefault(key, dict(queries=0, seconds=0.0, rows=0, response_bytes=0,
+                                            cache_hits=0, errors=0))
+        total['queries'] += 1
+        total['seconds'] += event.seconds
+        total['rows'] += event.rows or 0
+        total['response_bytes'] += event.response_bytes or 0
+        total['cache_hits'] += event.cache == 'hit'
+        total['errors'] += event.error is not None
+    grand_total = sum(t['seconds'] for t in totals.values()) or 1.0
+    summary = [dict(total, **{by: key, 'share': total['seconds'] / grand_total}) for key, total in totals.items()]
+    summary.sort(key=lambda t: t['seconds'], reverse=True)
+    return summary
+
+
+def format_summary(summary, by='helper'):
+    """Format the result of `summarize` as a text table."""
+    lines = ['{:<40} {:>8} {:>10} {:>6} {:>10} {:>12} {:>6}'.format(
+        by, 'queries', 'seconds', 'share', 'rows', 'bytes', 'hits')]
+    for total in summary:
+        lines.append('{:<40} {:>8} {:>10.3f} {:>5.0%} {:>10} {:>12} {:>6}'.format(
+            str(total[by]), total['queries'], total['seconds'], total['share'], total['rows'],
+            total['response_bytes'], total['cache_hits']))
+    return '\n'.join(lines)
+
+
+class MemorySink:
+    """Collect events in memory."""
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            self.events.append(event)
+
+    def clear(self):
+        with self._lock:
+            self.events = []
+
+    def summary(self, by='helper'):
+        return summarize(self.events, by)
+
+    def report(self, by='helper'):
+        return format_summary(self.summary(by), by)
+
+
+class JsonlSink:
+    """Append events to a file as JSON lines."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __call__(self, event):
+        line = json.dumps(event._asdict(), default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_jsonl(path):
+    """Read back the events written by a `JsonlSink`."""
+    with open(path, encoding='utf-8') as events:
+        return [QueryEvent(**json.loads(line)) for line in events if line.strip()]
+
+
+class CallbackSink:
+    """Pass each event to `callback`, optionally only those matching
+    `predicate`.
+    """
+
+    def __init__(self, callback, predicate=None):
+        self.callback = callback
+        self.predicate = predicate
+
+    def __call__(self, event):
+        if self.predicate is None or self.predicate(event):
+            self.callback(event)
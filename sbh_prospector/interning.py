@@ -0,0 +1,85 @@
+"""Interning of URIs as small integers, so that traversals holding many
+references to the same long URI strings store each string once.
+"""
+
+from array import array
+
+
+class TermTable:
+    """Interns RDF terms as small integers so that each distinct URI
+    string is stored once.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.terms = []
+
+    def __len__(self):
+        return len(self.terms)
+
+    def intern(self, term):
+        term_id = self.ids.get(term)
+        if term_id is None:
+            term_id = len(self.terms)
+            self.ids[term] = term_id
+            self.terms.append(term)
+        return term_id
+
+    def lookup(self, term):
+        return self.ids.get(term)
+
+    def __getitem__(self, term_id):
+        return self.terms[term_id]
+
+    def decode(self, term_ids):
+        """The terms of `term_ids`, as a list."""
+        terms = self.terms
+        return [terms[term_id] for term_id in term_ids]
+
+
+class Provenance:
+    """The paths found by a staged search like `find_construct_experiments`,
+    kept as parent pointers over interned URIs. Step `i` reaches
+    `uri_of(i)` from step `parent[i]` through predicate `pred[i]`, so
+    extending a path stores three integers rather than copying it, and
+    paths are only turned back into triples by `chain`.
+    """
+
+    def __init__(self):
+        self.terms = TermTable()
+        self.uri = array('l')
+        self.pred = array('l')
+        self.parent = array('l')
+
+    def __len__(self):
+        return len(self.uri)
+
+    def add(self, uri, pred=None, parent=-1):
+        """Add a step reaching `uri` from step `parent` (-1 for the start
+        of a path) through `pred`. Returns the new step.
+        """
+        self.uri.append(self.terms.intern(uri))
+        self.pred.append(-1 if pred is None else self.terms.intern(pred))
+        self.parent.append(parent)
+        return len(self.uri) - 1
+
+    def uri_of(self, step):
+        return self.terms[self.uri[step]]
+
+    def steps(self, uri):
+        """The steps that reach `uri`."""
+        term_id = self.terms.lookup(uri)
+        return [step for step, uri_id in enumerate(self.uri) if uri_id == term_id]
+
+    def chain(self, step):
+        """The path to `step` as (subject, predicate, object) triples,
+        from `step` back to the start, where the subject of each triple
+        is reached from its object.
+        """
+        terms = self.terms
+        triples = []
+        while self.parent[step] >= 0:
+            parent = self.parent[step]
+            triples.append((terms[self.uri[step]], terms[self.pred[step]], terms[self.uri[parent]]))
+            step = parent
+        return triples
@@ -0,0 +1,285 @@
+"""Memoization of the per-URI hierarchy functions of prospector.py.
+
+Results are keyed on (server, URI) within a named relation such as
+'child_module_definitions', not on the `sbh_query` object, so they
+survive a re-login or a new `SynBioHubQuery` for the same server. Each
+relation has its own size limit and time to live:
+
+    memo.configure('module_is_strain', maxsize=100000, ttl=24 * 3600)
+    memo.warm(sbh_query, 'child_module_definitions', uris)
+    memo.export('memo.json')
+    ...
+    memo.load('memo.json')
+"""
+
+import collections
+import functools
+import json
+import logging
+import threading
+import time
+
+# The size limit of a relation unless configured otherwise
+DEFAULT_MAXSIZE = 256
+
+# Returned by `RelationCache.get` for a key it does not hold
+MISSING = object()
+
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+def server_for(sbh_query):
+    """Return the URL of the server `sbh_query` talks to, if known."""
+    return getattr(sbh_query, '_server', None)
+
+
+def memo_server(sbh_query):
+    """The server part of a memo key. A backend with a `memo_key`, like a
+    `SnapshotIndex`, which may hold only part of its server's triples, is
+    keyed on that. A backend that names no server is keyed on itself so
+    that unrelated backends do not share results.
+    """
+    key = getattr(sbh_query, 'memo_key', None)
+    if key is not None:
+        return key
+    server = server_for(sbh_query)
+    return sbh_query if server is None else server
+
+
+def _encode(value):
+    if isinstance(value, (set, frozenset)):
+        return {'set': sorted(value)}
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        return set(value['set'])
+    return value
+
+
+class RelationCache:
+    """LRU cache of the values of one relation, keyed on (server, URI).
+    Values older than `ttl` seconds (never, if `ttl` is None) are
+    treated as missing.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the value for `key`, or `MISSING`."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and entry[0] + self.ttl < time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (self.ttl is None or entry[0] + self.ttl >= time.time())
+
+    def put(self, key, value, created=None):
+        with self._lock:
+            self._entries[key] = (time.time() if created is None else created, value)
+            self._entries.move_to_end(key)
+            self._trim()
+
+    def _trim(self):
+        while self.maxsize is not None and len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, server=None, uri=None):
+        """Drop the values for `server` and/or `uri`, or all of them.
+        Returns the number dropped.
+        """
+        with self._lock:
+            keys = [key for key in self._entries
+                    if (server is None or key[0] == server) and (uri is None or key[1] == uri)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def entries(self):
+        """A list of ((server, uri), created, value)."""
+        with self._lock:
+            return [(key, created, value) for key, (created, value) in self._entries.items()]
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self))
+
+
+class Memo:
+    """The relation caches of the memoized functions, by name."""
+
+    def __init__(self):
+        self.relations = {}
+        # relation -> memoized function
+        self.functions = {}
+        self._lock = threading.Lock()
+
+    def relation(self, name, maxsize=DEFAULT_MAXSIZE, ttl=None):
+        """The cache of relation `name`, created with `maxsize` and `ttl`
+        if it does not exist yet.
+        """
+        with self._lock:
+            cache = self.relations.get(name)
+            if cache is None:
+                cache = self.relations[name] = RelationCache(maxsize, ttl)
+            return cache
+
+    def configure(self, relation, maxsize=MISSING, ttl=MISSING):
+        """Set the size limit and/or time to live of `relation`. None
+        means no limit.
+        """
+        cache = self.relation(relation)
+        with cache._lock:
+            if maxsize is not MISSING:
+                cache.maxsize = maxsize
+                cache._trim()
+            if ttl is not MISSING:
+                cache.ttl = ttl
+
+    def invalidate(self, relation=None, server=None, uri=None):
+        """Drop cached values of `relation` (default: every relation)
+        for `server` and/or `uri` (default: all of them). Returns the
+        number dropped.
+        """
+        names = list(self.relations) if relation is None else [relation]
+        return sum(self.relations[name].invalidate(server, uri) for name in names if name in self.relations)
+
+    def clear(self):
+        self.invalidate()
+
+    def stats(self):
+        return {name: cache.info()._asdict() for name, cache in self.relations.items()}
+
+    def warm(self, sbh_query, relation, uris, chunk_size=None, executor=None):
+        """Compute `relation` for each of `uris` not already cached. Uses
+        the batched version of the function where there is one, so a
+        working set can be loaded with a few queries. Returns the number
+        of values computed.
+        """
+        func = self.functions[relation]
+        server = memo_server(sbh_query)
+        cache = self.relation(relation)
+        missing = [uri for uri in dict.fromkeys(uris) if (server, uri) not in cache]
+        if hasattr(func, 'many'):
+            func.many(sbh_query, missing, chunk_size=chunk_size, executor=executor)
+        elif executor is not None:
+            executor.map(lambda uri: func(sbh_query, uri), missing)
+        else:
+            for uri in missing:
+                func(sbh_query, uri)
+        logging.info('Warmed %d %s', len(missing), relation)
+        return len(missing)
+
+    def export(self, path=None):
+        """Return the cached values of every relation as a JSON-ready
+        list, and write it to `path` if given. Values of backends that
+        name no server are left out.
+        """
+        entries = []
+        for name, cache in self.relations.items():
+            for (server, uri), created, value in cache.entries():
+                if isinstance(server, str):
+                    entries.append(dict(relation=name, server=server, uri=uri, created=created,
+                                        value=_encode(value)))
+        if path is not None:
+            with open(path, 'w') as exported:
+                json.dump(entries, exported)
+        return entries
+
+    def load(self, entries):
+        """Add values from `export`, given either its result or the path
+        it was written to. Values that have outlived the time to live of
+        their relation are skipped. Returns the number added.
+        """
+        if isinstance(entries, str):
+            with open(entries) as exported:
+                entries = json.load(exported)
+        count = 0
+        for entry in entries:
+            cache = self.relation(entry['relation'])
+            if cache.ttl is not None and entry['created'] + cache.ttl < time.time():
+                continue
+            cache.put((entry['server'], entry['uri']), _decode(entry['value']), entry['created'])
+            count += 1
+        return count
+
+
+# The memo shared by all the memoized functions
+memo = Memo()
+
+
+def memoize(relation, maxsize=DEFAULT_MAXSIZE, ttl=None, many=None):
+    """Memoize a function of (sbh_query, uri, ...) in `memo` under the
+    name `relation`, keyed on the server of `sbh_query` and `uri`. Any
+    further arguments are assumed not to change the result, except that
+    a call given a `graph` to record the explored hierarchy in is not
+    memoized.
+
+    `many(sbh_query, uris, chunk_size=None, executor=None)` is the
+    batched version of the function, if any, returning a dict mapping
+    each of `uris` to its value. It is exposed, memoized in the same
+    relation, as the `many` attribute of the memoized function, and used
+    by `Memo.warm`.
+    """
+    def decorator(func):
+        params = func.__code__.co_varnames[:func.__code__.co_argcount]
+        graph_index = params.index('graph') - 2 if 'graph' in params else None
+        cache = memo.relation(relation, maxsize, ttl)
+
+        @functools.wraps(func)
+        def wrapper(sbh_query, uri, *args, **kwargs):
+            if graph_index is not None and (kwargs.get('graph') is not None or
+                                            len(args) > graph_index and args[graph_index] is not None):
+                return func(sbh_query, uri, *args, **kwargs)
+            key = (memo_server(sbh_query), uri)
+            value = cache.get(key)
+            if value is MISSING:
+                value = func(sbh_query, uri, *args, **kwargs)
+                cache.put(key, value)
+            return value
+
+        def cached_many(sbh_query, uris, chunk_size=None, executor=None):
+            server = memo_server(sbh_query)
+            values = {}
+            missing = []
+            for uri in dict.fromkeys(uris):
+                value = cache.get((server, uri))
+                if value is MISSING:
+                    missing.append(uri)
+                else:
+                    values[uri] = value
+            if missing:
+                found = many(sbh_query, missing, chunk_size=chunk_size, executor=executor)
+                for uri in missing:
+                    cache.put((server, uri), found[uri])
+                    values[uri] = found[uri]
+            return values
+
+        memo.functions[relation] = wrapper
+        if many is not None:
+            wrapper.many = cached_many
+        wrapper.relation = relation
+        wrapper.cache_info = cache.info
+        wrapper.cache_clear = functools.partial(memo.invalidate, relation)
+        return wrapper
+
+    return decorator
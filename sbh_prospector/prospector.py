@@ -1,12 +1,15 @@
-import argparse
-import functools
+import collections
+import hashlib
+import json
 import logging
 import os
 import sys
+from array import array
 
-import pandas as pd
-
-import synbiohub_adapter as sbha
+from . import instrument
+from .compiled import CompiledQuery, format_uris, values_rows
+from .interning import Provenance, TermTable
+from .memoization import memo, memo_server, memoize, server_for
 
 SUBJECT_QUERY = """
     SELECT ?s WHERE {{
@@ -50,6 +53,86 @@ SP_QUERY = """
     }}
 """
 
+# The definitions linked to ?s through an intervening node, and the
+# reverse. Run with `run_compiled`, so that a whole frontier of a
+# hierarchy walk is expanded with a single round trip.
+CHILD_DEFINITIONS_QUERY = """
+    SELECT ?o WHERE {{
+        VALUES (?s ?p ?definition) {{ ( <{}> <{}> <{}> ) }}
+        ?s ?p ?x .
+        ?x ?definition ?o .
+    }}
+"""
+
+PARENT_DEFINITIONS_QUERY = """
+    SELECT ?s WHERE {{
+        VALUES (?o ?p ?definition) {{ ( <{}> <{}> <{}> ) }}
+        ?x ?definition ?o .
+        ?s ?p ?x .
+    }}
+"""
+
+# Server side versions of `find_contained_strains` and
+# `find_contained_reagents`. The hierarchy is walked by SPARQL 1.1
+# property paths, so a whole search is a single round trip.
+CONTAINED_STRAINS_PATH_QUERY = """
+    SELECT DISTINCT ?o WHERE {{
+        VALUES (?s) {{ ( <{0}> ) }}
+        ?s (<{1}>/<{2}>)* ?o .
+        ?o <{3}> <{4}> .
+    }}
+"""
+
+CONTAINED_REAGENTS_PATH_QUERY = """
+    SELECT DISTINCT ?o WHERE {{
+        VALUES (?s) {{ ( <{0}> ) }}
+        ?s ((<{1}>|<{2}>)/<{3}>)* ?o .
+        ?o <{4}> ?type .
+        FILTER(STRSTARTS(STR(?type), "{5}") || STRSTARTS(STR(?type), "{6}"))
+    }}
+"""
+
+# Classifiers, selecting ?s if it is a strain, or a reagent. Run with
+# `run_compiled`, so that a whole level of a hierarchy walk is
+# classified with a single round trip.
+STRAINS_QUERY = """
+    SELECT DISTINCT ?s WHERE {{
+        VALUES (?s ?role ?strain) {{ ( <{}> <{}> <{}> ) }}
+        ?s ?role ?strain .
+    }}
+"""
+
+REAGENTS_QUERY = """
+    SELECT DISTINCT ?s WHERE {{
+        VALUES (?s ?type_pred ?purl_prefix ?identifiers_prefix) {{ ( <{}> <{}> <{}> <{}> ) }}
+        ?s ?type_pred ?type .
+        FILTER(STRSTARTS(STR(?type), STR(?purl_prefix)) || STRSTARTS(STR(?type), STR(?identifiers_prefix)))
+    }}
+"""
+
+# Appended to a SELECT query to fetch one page of its results. Paging
+# needs a total order, so every selected variable is sorted on.
+PAGE_QUERY = """{}
+    ORDER BY {}
+    LIMIT {} OFFSET {}
+"""
+
+GRNA_QUERY = """
+      SELECT ?s ?title WHERE {
+        ?s <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://sbols.org/v2#ComponentDefinition> .
+        ?s <http://purl.org/dc/terms/title> ?title .
+      }
+"""
+
+# Maximum number of URIs placed in the VALUES block of a single batched
+# query. Larger chunks mean fewer round trips but bigger requests, which
+# some servers reject. Can be overridden per call via `chunk_size`.
+VALUES_CHUNK_SIZE = 100
+
+# Number of rows fetched per query by the paged DataFrame helpers. Can
+# be overridden per call via `page_size`.
+QUERY_PAGE_SIZE = 10000
+
 SBOL_ROOT = 'http://sbols.org/v2'
 SBOL_TYPE_COMPONENT = 'http://sbols.org/v2#Component'
 SBOL_PRED_COMPONENT = 'http://sbols.org/v2#component'
@@ -61,45 +144,91 @@ SBOL_BUILT = SBOL_ROOT + '#built'
 SBOL_ROLE = SBOL_ROOT + '#role'
 SBOL_TYPE = SBOL_ROOT + '#type'
 
+# Strains are ModuleDefinitions with this role
+NCIT_STRAIN = 'http://purl.obolibrary.org/obo/NCIT_C14419'
+
 # CHEBI prefixes are used to identify reagents
 CHEBI_PURL_PREFIX = 'http://purl.obolibrary.org/obo/CHEBI'
 CHEBI_IDENTIFIERS_PREFIX = 'http://identifiers.org/chebi/CHEBI'
 
-CHALLENGE_PROBLEMS = [
-    sbha.SD2Constants.RULE_30_DESIGN_COLLECTION,
-    sbha.SD2Constants.YEAST_GATES_DESIGN_COLLECTION,
-    sbha.SD2Constants.RIBOSWITCHES_DESIGN_COLLECTION,
-    sbha.SD2Constants.NOVEL_CHASSIS_DESIGN_COLLECTION
-]
-
 DC_TERMS_TITLE = 'http://purl.org/dc/terms/title'
 RDF_TYPE = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
 
 # SD2-specific values
 SD2E_STUB = 'http://sd2e.org#stub_object'
 
+# The query templates, parsed once. Each can run many parameter rows in
+# one query with `run_compiled`.
+COMPILED_SUBJECT_QUERY = CompiledQuery('SUBJECT_QUERY', SUBJECT_QUERY)
+COMPILED_SUBJECT_INFO_QUERY = CompiledQuery('SUBJECT_INFO_QUERY', SUBJECT_INFO_QUERY)
+COMPILED_SPO_QUERY = CompiledQuery('SPO_QUERY', SPO_QUERY)
+COMPILED_O_QUERY = CompiledQuery('O_QUERY', O_QUERY)
+COMPILED_SO_QUERY = CompiledQuery('SO_QUERY', SO_QUERY)
+COMPILED_SP_QUERY = CompiledQuery('SP_QUERY', SP_QUERY)
+COMPILED_CHILD_DEFINITIONS_QUERY = CompiledQuery('CHILD_DEFINITIONS_QUERY', CHILD_DEFINITIONS_QUERY)
+COMPILED_PARENT_DEFINITIONS_QUERY = CompiledQuery('PARENT_DEFINITIONS_QUERY', PARENT_DEFINITIONS_QUERY)
+COMPILED_STRAINS_QUERY = CompiledQuery('STRAINS_QUERY', STRAINS_QUERY)
+COMPILED_REAGENTS_QUERY = CompiledQuery('REAGENTS_QUERY', REAGENTS_QUERY)
+
+
+def run_query(sbh_query, sparql, template, bindings=(), helper=None):
+    """Send `sparql` to `sbh_query`. Every query in this module goes
+    through here so that it can be traced by `instrument`. `template`
+    names the query and `bindings` are the values filled into it.
+    `helper` defaults to the name of the calling function.
+    """
+    logging.debug('Query is %s', sparql)
+    if not instrument.enabled():
+        return sbh_query.fetch_SPARQL(None, sparql)
+    if helper is None:
+        helper = sys._getframe(1).f_code.co_name
+    return instrument.traced_fetch(sbh_query, sparql, helper, template, bindings)
+
+
+def run_compiled(sbh_query, query, rows, chunk_size=None, executor=None, helper=None):
+    """Run the `CompiledQuery` `query` for each tuple of parameters in
+    `rows`, packing up to `chunk_size` rows into each query (the chunks
+    are fetched concurrently given an `executor`). Returns one SPARQL
+    JSON result per row, in order. `helper` defaults to the name of the
+    calling function.
+    """
+    if helper is None:
+        helper = sys._getframe(1).f_code.co_name
+    if chunk_size is None:
+        chunk_size = VALUES_CHUNK_SIZE
+    rows = [tuple(row) for row in rows]
+    row_chunks = list(chunks(dict.fromkeys(rows), chunk_size))
+    sparqls = [query.render(chunk) for chunk in row_chunks]
+    bindings = [chunk[0] if len(chunk) == 1 else chunk for chunk in row_chunks]
+    split = {}
+    for chunk, result in zip(row_chunks, fetch_all(sbh_query, sparqls, executor, query.name, bindings, helper)):
+        split.update(zip(chunk, query.split(result, chunk)))
+    return [split[row] for row in rows]
+
 
 def subjects_for(sbh_query, pred, obj):
-    sparql = SUBJECT_QUERY.format(pred, obj)
-    logging.debug('Query is %s', sparql)
-    result = sbh_query.fetch_SPARQL(None, sparql)
+    result = run_compiled(sbh_query, COMPILED_SUBJECT_QUERY, [(pred, obj)])[0]
     result = sbh_query.format_query_result(result, ['s'])
     return result
 
 
+def subjects_for_many(sbh_query, pairs, chunk_size=None, executor=None):
+    """Batched `subjects_for`. Returns the subjects for each (pred, obj)
+    pair in `pairs`, in order.
+    """
+    results = run_compiled(sbh_query, COMPILED_SUBJECT_QUERY, pairs, chunk_size, executor)
+    return [sbh_query.format_query_result(result, ['s']) for result in results]
+
+
 def subject_info(sbh_query, subj):
-    sparql = SUBJECT_INFO_QUERY.format(subj)
-    logging.debug('Query is %s', sparql)
-    result = sbh_query.fetch_SPARQL(None, sparql)
+    result = run_compiled(sbh_query, COMPILED_SUBJECT_INFO_QUERY, [(subj,)])[0]
     # result = sbh_query.format_query_result(result, [])
     result = [(r['p'], r['o']) for r in sbh_query.format_query_result(result, ['p', 'o'])]
     return result
 
 
 def o_query(sbh_query, subj, pred):
-    sparql = O_QUERY.format(subj, pred)
-    logging.debug('Query is %s', sparql)
-    result = sbh_query.fetch_SPARQL(None, sparql)
+    result = run_compiled(sbh_query, COMPILED_O_QUERY, [(subj, pred)])[0]
     result = format_query_result(sbh_query, result)
     return result
 
@@ -109,20 +238,39 @@ def objects_for(sbh_query, subj, pred):
     return o_query(sbh_query, subj, pred)
 
 
+def objects_for_many(sbh_query, pairs, chunk_size=None, executor=None):
+    """Batched `objects_for`. Returns the objects for each (subj, pred)
+    pair in `pairs`, in order.
+    """
+    results = run_compiled(sbh_query, COMPILED_O_QUERY, pairs, chunk_size, executor)
+    return [format_query_result(sbh_query, result) for result in results]
+
+
 def sp_query(sbh_query, obj):
-    sparql = SP_QUERY.format(obj)
-    logging.debug('Query is %s', sparql)
-    result = sbh_query.fetch_SPARQL(None, sparql)
+    result = run_compiled(sbh_query, COMPILED_SP_QUERY, [(obj,)])[0]
     result = format_query_result(sbh_query, result)
     return result
 
 
-def so_query(sbh_query, pred):
-    sparql = SO_QUERY.format(pred)
-    logging.debug('Query is %s', sparql)
-    result = sbh_query.fetch_SPARQL(None, sparql)
-    result = format_query_result(sbh_query, result)
-    return result
+def so_query(sbh_query, pred, page_size=None, executor=None):
+    return list(iter_so_query(sbh_query, pred, page_size, executor))
+
+
+def iter_so_query(sbh_query, pred, page_size=None, executor=None, checkpoint=None):
+    """Generator version of `so_query`, fetching `page_size` rows at a
+    time. See `iter_pages` for the optional arguments.
+    """
+    sparql = COMPILED_SO_QUERY.render([(pred,)])
+    for result in iter_pages(sbh_query, sparql, 'SO_QUERY', ['s', 'o'], page_size, executor, checkpoint, (pred,)):
+        yield from format_query_result(sbh_query, result, ['s', 'o'])
+
+
+def so_query_frame(sbh_query, pred, page_size=None, executor=None):
+    """DataFrame version of `so_query`, with columns s and o, fetched
+    `page_size` rows at a time.
+    """
+    sparql = COMPILED_SO_QUERY.render([(pred,)])
+    return query_frame(sbh_query, sparql, 'SO_QUERY', ['s', 'o'], page_size, executor=executor)
 
 
 def title_for(sbh_query, subj):
@@ -133,18 +281,91 @@ def title_for(sbh_query, subj):
         return ''
 
 
+def titles_for_many(sbh_query, uris, chunk_size=None, executor=None):
+    """Batched `title_for`. Returns a dict mapping each of `uris` to its
+    title, or '' if it has none.
+    """
+    uris = list(dict.fromkeys(uris))
+    titles = objects_for_many(sbh_query, [(uri, DC_TERMS_TITLE) for uri in uris], chunk_size, executor)
+    return {uri: title[0] if title else '' for uri, title in zip(uris, titles)}
+
+
+def collection_members_many(sbh_query, collections, chunk_size=None, executor=None):
+    """Returns a dict mapping each of `collections` to the list of its
+    members, fetched with one query per `chunk_size` collections.
+    """
+    collections = list(dict.fromkeys(collections))
+    members = objects_for_many(sbh_query, [(coll, SBOL_MEMBER) for coll in collections], chunk_size, executor)
+    return dict(zip(collections, members))
+
+
+def membership_index(members_by_collection):
+    """Invert the result of `collection_members_many`. Returns a dict
+    mapping each member to the list of collections containing it.
+    """
+    index = {}
+    for coll, members in members_by_collection.items():
+        for member in members:
+            index.setdefault(member, []).append(coll)
+    return index
+
+
+def challenge_problems():
+    """The URIs of the challenge problem collections."""
+    import synbiohub_adapter as sbha
+    return [
+        sbha.SD2Constants.RULE_30_DESIGN_COLLECTION,
+        sbha.SD2Constants.YEAST_GATES_DESIGN_COLLECTION,
+        sbha.SD2Constants.RIBOSWITCHES_DESIGN_COLLECTION,
+        sbha.SD2Constants.NOVEL_CHASSIS_DESIGN_COLLECTION
+    ]
+
+
+def challenge_problem_report(sbh_query, collections=None, chunk_size=None, executor=None):
+    """Report the members of each of `collections` (by default the
+    `challenge_problems`) as a DataFrame with one row per member and
+    collection: member, title, collection and the number of the
+    collections containing the member. Members and titles are fetched
+    in batches, concurrently if an `executor` is given, so a report
+    costs a few queries rather than one per member.
+    """
+    import pandas as pd
+    if collections is None:
+        collections = challenge_problems()
+    by_member = membership_index(collection_members_many(sbh_query, collections, chunk_size, executor))
+    titles = titles_for_many(sbh_query, by_member, chunk_size, executor)
+    rows = [(member, titles[member], coll, len(colls)) for member, colls in by_member.items() for coll in colls]
+    frame = pd.DataFrame(rows, columns=['member', 'title', 'collection', 'collections'])
+    for column in ('member', 'collection'):
+        frame[column] = frame[column].astype('category')
+    return frame.sort_values(['member', 'collection'], ignore_index=True)
+
+
+def write_frame(frame, path):
+    """Write a DataFrame to `path` as Parquet (requires pyarrow), CSV or
+    JSON lines, according to its extension.
+    """
+    if path.endswith('.parquet'):
+        frame.to_parquet(path, index=False)
+    elif path.endswith('.jsonl'):
+        frame.to_json(path, orient='records', lines=True)
+    else:
+        frame.to_csv(path, index=False)
+    logging.info('Wrote %d rows to %s', len(frame), path)
+
+
 def has_type(sbh_query, subj, rdf_type):
-    sparql = SPO_QUERY.format(subj, RDF_TYPE, rdf_type)
     logging.info('Querying %s for type %s', subj, rdf_type)
-    logging.debug('Query is %s', sparql)
-    result = sbh_query.fetch_SPARQL(None, sparql)
+    result = run_compiled(sbh_query, COMPILED_SPO_QUERY, [(subj, RDF_TYPE, rdf_type)])[0]
     result = [(r['s'], r['o']) for r in format_query_result(sbh_query, result)]
     return result
 
 
-def find_subjects(sbh_query, results, pred):
-    new_results = {}
-    for obj in results:
+def _step_up(sbh_query, objs, pred, executor=None):
+    """Return (subject, object) pairs for the subjects linked by `pred`
+    to each of `objs`, each subject once.
+    """
+    def subjects_or_log(obj):
         subjects = subjects_for(sbh_query, pred, obj)
         logging.info('Found %d %s for %s', len(subjects), pred, obj)
         if not subjects:
@@ -153,21 +374,49 @@ def find_subjects(sbh_query, results, pred):
             preds = set([sp['p'] for sp in sp_list])
             logging.info('All predicates for %s: %r', obj, preds)
             # sys.exit(0)
+        return subjects
+
+    seen = set()
+    steps = []
+    for obj, subjects in zip(objs, map_queries(executor, subjects_or_log, objs)):
         for s in subjects:
-            if s in new_results:
+            if s in seen:
                 raise Exception('Two paths to {}'.format(s))
-            new_results[s] = [(s, pred, obj)] + results[obj]
+            seen.add(s)
+            steps.append((s, obj))
             # rdf_type = o_query(sbh_query, s, RDF_TYPE)
             # logging.info('%s has type %s', s, rdf_type)
+    return steps
+
+
+def find_subjects(sbh_query, results, pred, executor=None):
+    new_results = {}
+    for s, obj in _step_up(sbh_query, list(results), pred, executor):
+        new_results[s] = [(s, pred, obj)] + results[obj]
     return new_results
 
 
+def _find_subject_steps(sbh_query, paths, results, pred, executor=None):
+    """Like `find_subjects`, but `results` maps each URI reached so far
+    to its step in `paths`, a `Provenance`, and the same is returned for
+    the subjects found.
+    """
+    return {s: paths.add(s, pred, results[obj]) for s, obj in _step_up(sbh_query, list(results), pred, executor)}
+
+
 def find_implementations(sbh_query, obj, media=None):
     """Given an object, return all the implementations that link to it by
     a SBOL #built predicate. Also include the dc/terms/title of the
     implementations.
 
     """
+    sparql = implementations_query(obj, media)
+    result = run_query(sbh_query, sparql, 'find_implementations', (obj, media))
+    return format_query_result(sbh_query, result)
+
+
+def implementations_query(obj, media=None):
+    """The query made by `find_implementations`."""
     query_template = """
         SELECT ?s ?title WHERE {{
             VALUES (?built_pred ?o ?title_pred) {{ ( <{}> <{}> <{}> ) }}
@@ -180,20 +429,30 @@ def find_implementations(sbh_query, obj, media=None):
             ?mod <http://sbols.org/v2#definition> <{0}> .
             <{0}> <http://sbols.org/v2#role> <http://purl.obolibrary.org/obo/NCIT_C85504> .
         """
-        query_template += media_clause.format(media)
+        query_template += format_uris(media_clause, media)
     query_template += "\n}}\n"
-    sparql = query_template.format(SBOL_BUILT, obj, DC_TERMS_TITLE)
-    logging.debug('Query is %s', sparql)
-    result = sbh_query.fetch_SPARQL(None, sparql)
-    return format_query_result(sbh_query, result)
+    return format_uris(query_template, SBOL_BUILT, obj, DC_TERMS_TITLE)
 
 
-def find_construct_experiments(sbh_query, construct, media=None):
+def find_construct_experiments(sbh_query, construct, media=None, executor=None, provenance=None):
+    """Find the implementations built from designs that use `construct`.
+    Returns a DataFrame of their URIs and titles. Given an `executor`,
+    the queries for each stage of the search are run concurrently.
+
+    The path from `construct` to each implementation is recorded in
+    `provenance`, a `Provenance`, if given:
+
+        for step in provenance.steps(uri):
+            print(provenance.chain(step))
+    """
+    import pandas as pd
+    paths = Provenance() if provenance is None else provenance
+    start = paths.add(construct)
     definers = subjects_for(sbh_query, SBOL_DEFINITION, construct)
 
     results = {}
     for d in definers:
-        results[d] = [(d, SBOL_DEFINITION, construct)]
+        results[d] = paths.add(d, SBOL_DEFINITION, start)
 
     logging.info('Found %d definers', len(definers))
     # for d in definers:
@@ -203,16 +462,17 @@ def find_construct_experiments(sbh_query, construct, media=None):
     #     logging.info('--------------------------------------------------')
 
     logging.info('Keeping definers of type component')
-    definers = [d for d in definers if has_type(sbh_query, d, SBOL_TYPE_COMPONENT)]
+    is_component = map_queries(executor, lambda d: has_type(sbh_query, d, SBOL_TYPE_COMPONENT), definers)
+    definers = [d for d, keep in zip(definers, is_component) if keep]
     logging.info('%d definers are components', len(definers))
     # for d in definers:
     #     logging.info('component definer: %s', d)
 
     members = []
-    for d in definers:
-        new_members = subjects_for(sbh_query, SBOL_PRED_COMPONENT, d)
+    all_members = map_queries(executor, lambda d: subjects_for(sbh_query, SBOL_PRED_COMPONENT, d), definers)
+    for d, new_members in zip(definers, all_members):
         for m in new_members:
-            results[m] = [(m, SBOL_PRED_COMPONENT, d)] + results[d]
+            results[m] = paths.add(m, SBOL_PRED_COMPONENT, results[d])
             members.append(m)
     logging.info('Found %d possible members', len(members))
     for m in members:
@@ -221,37 +481,38 @@ def find_construct_experiments(sbh_query, construct, media=None):
     # We're really looking for implementations via the `built` relationship, not challenge problem.
 
     new_results = {}
-    for m in members:
-        design_defs = subjects_for(sbh_query, SBOL_DEFINITION, m)
+    all_design_defs = map_queries(executor, lambda m: subjects_for(sbh_query, SBOL_DEFINITION, m), members)
+    for m, design_defs in zip(members, all_design_defs):
         for dd in design_defs:
             if dd in new_results:
                 raise Exception('Two paths to {}'.format(dd))
-            new_results[dd] = [(dd, SBOL_DEFINITION, m)] + results[m]
+            new_results[dd] = paths.add(dd, SBOL_DEFINITION, results[m])
     results = new_results
 
     new_results = {}
-    for dd in results:
-        circuit_designs = subjects_for(sbh_query, SBOL_FUNCTIONAL_COMPONENT, dd)
-        logging.info('Found %d circuit designs for %s', len(circuit_designs), m)
+    all_circuit_designs = map_queries(executor, lambda dd: subjects_for(sbh_query, SBOL_FUNCTIONAL_COMPONENT, dd),
+                                      results)
+    for dd, circuit_designs in zip(results, all_circuit_designs):
+        logging.info('Found %d circuit designs for %s', len(circuit_designs), dd)
         for cd in circuit_designs:
             if cd in new_results:
                 raise Exception('Two paths to {}'.format(cd))
-            new_results[cd] = [(cd, SBOL_FUNCTIONAL_COMPONENT, dd)] + results[dd]
-            rdf_type = o_query(sbh_query, cd, RDF_TYPE)
-            logging.info('%s has type %s', cd, rdf_type)
+            new_results[cd] = paths.add(cd, SBOL_FUNCTIONAL_COMPONENT, results[dd])
     results = new_results
+    rdf_types = map_queries(executor, lambda cd: o_query(sbh_query, cd, RDF_TYPE), results)
+    for cd, rdf_type in zip(results, rdf_types):
+        logging.info('%s has type %s', cd, rdf_type)
 
-    results = find_subjects(sbh_query, results, SBOL_DEFINITION)
-    results = find_subjects(sbh_query, results, SBOL_MODULE)
+    results = _find_subject_steps(sbh_query, paths, results, SBOL_DEFINITION, executor)
+    results = _find_subject_steps(sbh_query, paths, results, SBOL_MODULE, executor)
 
     # Now find implementations of the modules found above
-    new_results = {}
     df_rows = []
-    for obj in results:
-        impls = find_implementations(sbh_query, obj, media)
+    all_impls = map_queries(executor, lambda obj: find_implementations(sbh_query, obj, media), results)
+    for obj, impls in zip(results, all_impls):
         for impl in impls:
             subj = impl['s']
-            new_results[subj] = results[obj] + [(subj, SBOL_BUILT, obj)]
+            paths.add(subj, SBOL_BUILT, results[obj])
             df_rows.append(dict(uri=subj, title=impl['title']))
 
     data_frame = pd.DataFrame(df_rows)
@@ -259,16 +520,100 @@ def find_construct_experiments(sbh_query, construct, media=None):
     return data_frame
 
 
-def find_grna(sbh_query):
-    sparql = """
-      SELECT ?s ?title WHERE {
-        ?s <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://sbols.org/v2#ComponentDefinition> .
-        ?s <http://purl.org/dc/terms/title> ?title .
-      }
+# The stages of `find_construct_experiments`, from the construct down to
+# the designs that are built. Each is (variable, predicate, variable
+# of the previous stage).
+CONSTRUCT_EXPERIMENT_STAGES = [
+    ('definer', SBOL_DEFINITION, 'construct'),
+    ('member', SBOL_PRED_COMPONENT, 'definer'),
+    ('design_def', SBOL_DEFINITION, 'member'),
+    ('circuit_design', SBOL_FUNCTIONAL_COMPONENT, 'design_def'),
+    ('circuit_module', SBOL_DEFINITION, 'circuit_design'),
+    ('experiment_design', SBOL_MODULE, 'circuit_module'),
+]
+
+
+def find_construct_experiments_joined(sbh_query, construct, media=None):
+    """Like `find_construct_experiments`, but the whole path from the
+    construct to the `built` implementations is found by one joined
+    query instead of one query per intermediate URI.
+
+    Returns the same DataFrame plus a dict mapping each implementation
+    URI to its provenance chain of (subject, predicate, object) triples,
+    implementation last. Raises an exception if an intermediate design
+    is reached by two paths, as `find_construct_experiments` does.
     """
-    result = sbh_query.fetch_SPARQL(None, sparql)
-    result = [(r['s'], r['title']) for r in format_query_result(sbh_query, result)]
-    return result
+    import pandas as pd
+    query_template = """
+        SELECT ?definer ?member ?design_def ?circuit_design ?circuit_module ?experiment_design ?s ?title
+        WHERE {{
+            VALUES (?construct) {{ ( <{construct}> ) }}
+            ?definer <{definition}> ?construct .
+            ?definer <{rdf_type}> <{component_type}> .
+            ?member <{component}> ?definer .
+            ?design_def <{definition}> ?member .
+            ?circuit_design <{functional_component}> ?design_def .
+            ?circuit_module <{definition}> ?circuit_design .
+            ?experiment_design <{module}> ?circuit_module .
+            ?s <{built}> ?experiment_design .
+            ?s <{title}> ?title .
+    """
+    if media is not None:
+        media_clause = """
+            ?experiment_design <http://sbols.org/v2#module> ?mod .
+            ?mod <http://sbols.org/v2#definition> <{0}> .
+            <{0}> <http://sbols.org/v2#role> <http://purl.obolibrary.org/obo/NCIT_C85504> .
+        """
+        query_template += format_uris(media_clause, media)
+    query_template += "\n}}\n"
+    sparql = format_uris(query_template, construct=construct, definition=SBOL_DEFINITION, rdf_type=RDF_TYPE,
+                         component_type=SBOL_TYPE_COMPONENT, component=SBOL_PRED_COMPONENT,
+                         functional_component=SBOL_FUNCTIONAL_COMPONENT, module=SBOL_MODULE,
+                         built=SBOL_BUILT, title=DC_TERMS_TITLE)
+    result = run_query(sbh_query, sparql, 'find_construct_experiments_joined', (construct, media))
+    rows = format_query_result(sbh_query, result)
+
+    # Each design must be reached by a single chain of designs above it
+    upstream = {}
+    provenance = {}
+    df_rows = []
+    for row in rows:
+        row = dict(row, construct=construct)
+        chain = []
+        for var, pred, prev in CONSTRUCT_EXPERIMENT_STAGES:
+            chain.insert(0, (row[var], pred, row[prev]))
+            if var in ('definer', 'member'):
+                continue
+            if upstream.setdefault(row[var], chain[1:]) != chain[1:]:
+                raise Exception('Two paths to {}'.format(row[var]))
+        provenance[row['s']] = chain + [(row['s'], SBOL_BUILT, row['experiment_design'])]
+        df_rows.append(dict(uri=row['s'], title=row['title']))
+    logging.info('Found %d implementations', len(df_rows))
+
+    data_frame = pd.DataFrame(df_rows)
+    return data_frame, provenance
+
+
+def find_grna(sbh_query, page_size=None, executor=None):
+    return list(iter_grna(sbh_query, page_size, executor))
+
+
+def iter_grna(sbh_query, page_size=None, executor=None, checkpoint=None):
+    """Generator version of `find_grna`, fetching `page_size` rows at a
+    time. See `iter_pages` for the optional arguments; a scan resumed
+    from a `checkpoint` starts again at the first row of the page it
+    was interrupted in.
+    """
+    for result in iter_pages(sbh_query, GRNA_QUERY, 'find_grna', ['s', 'title'], page_size, executor, checkpoint):
+        for r in format_query_result(sbh_query, result):
+            yield r['s'], r['title']
+
+
+def find_grna_frame(sbh_query, page_size=None, executor=None):
+    """DataFrame version of `find_grna`, with columns s and title,
+    fetched `page_size` rows at a time.
+    """
+    return query_frame(sbh_query, GRNA_QUERY, 'find_grna', ['s', 'title'], page_size, executor=executor)
 
 
 def format_query_result(sbh_query, result, bindings=None):
@@ -279,91 +624,539 @@ def format_query_result(sbh_query, result, bindings=None):
     return formatted_result
 
 
+def result_frame(result, keys=None, categorical=True):
+    """Convert a SPARQL JSON result straight to a DataFrame with one
+    column per variable in `keys` (default: all of them), without going
+    through a dict per row. Unbound values are None. Columns holding
+    only URIs are categorical if `categorical` is true, so each distinct
+    URI is stored once.
+    """
+    import pandas as pd
+    if keys is None:
+        keys = result['head']['vars']
+    bindings = result['results']['bindings']
+    columns = {}
+    for key in keys:
+        values = [row[key]['value'] if key in row else None for row in bindings]
+        if categorical and all(row[key]['type'] == 'uri' for row in bindings if key in row):
+            values = pd.Categorical(values)
+        columns[key] = values
+    return pd.DataFrame(columns, columns=keys)
+
+
+def concat_frames(frames, keys):
+    """Concatenate DataFrames from `result_frame`, merging the
+    categories of categorical columns instead of falling back to object
+    columns. Empty frames are left out, as their categories may not
+    have the same dtype as the others'.
+    """
+    import pandas as pd
+    frames = list(frames)
+    frames = [frame for frame in frames if len(frame)] or frames[:1]
+    if not frames:
+        return pd.DataFrame(columns=keys)
+    columns = {}
+    for key in keys:
+        parts = [frame[key] for frame in frames]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            columns[key] = pd.api.types.union_categoricals(parts)
+        else:
+            columns[key] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns, columns=keys)
+
+
+def _read_checkpoint(path, sparql, page_size):
+    """Return the offset saved in the checkpoint file at `path` for a
+    scan of `sparql`, or 0.
+    """
+    if path is None or not os.path.exists(path):
+        return 0
+    with open(path) as checkpoint:
+        saved = json.load(checkpoint)
+    if saved['query'] != hashlib.sha256(sparql.encode('utf-8')).hexdigest() or saved['page_size'] != page_size:
+        logging.warning('Ignoring checkpoint %s, which is for a different scan', path)
+        return 0
+    logging.info('Resuming scan at offset %d', saved['offset'])
+    return saved['offset']
+
+
+def _write_checkpoint(path, sparql, page_size, offset):
+    if path is None:
+        return
+    saved = dict(query=hashlib.sha256(sparql.encode('utf-8')).hexdigest(), page_size=page_size, offset=offset)
+    with open(path + '.tmp', 'w') as checkpoint:
+        json.dump(saved, checkpoint)
+    os.replace(path + '.tmp', path)
+
+
+def iter_pages(sbh_query, sparql, template, keys, page_size=None, executor=None, checkpoint=None, bindings=()):
+    """Run the SELECT query `sparql` a page of `page_size` rows at a
+    time, yielding the raw result of each page, so that scans of the
+    whole store neither time out nor hold every row in memory. `keys`
+    are the selected variables, which are sorted on so that pages do
+    not overlap. `bindings` are passed to `run_query` for tracing.
+
+    Given an `executor`, as many pages as it has workers are fetched at
+    once. Given a `checkpoint` path, the offset of the next page is
+    saved there each time the caller asks for it, so an interrupted
+    scan of the same query resumes after the last page the caller
+    finished with. The checkpoint is removed when the scan completes.
+
+    Delivery is at least once: the page being worked on when the scan
+    was interrupted is yielded again in full when it resumes, so a
+    caller that has acted on some of its rows sees them twice.
+    """
+    if page_size is None:
+        page_size = QUERY_PAGE_SIZE
+    order = ' '.join('?' + key for key in keys)
+    offset = _read_checkpoint(checkpoint, sparql, page_size)
+    window = 1 if executor is None else executor.max_workers
+    while True:
+        offsets = [offset + i * page_size for i in range(window)]
+        sparqls = [PAGE_QUERY.format(sparql.rstrip(), order, page_size, o) for o in offsets]
+        results = fetch_all(sbh_query, sparqls, executor, template,
+                            [tuple(bindings) + (page_size, o) for o in offsets])
+        for page_offset, result in zip(offsets, results):
+            rows = len(result['results']['bindings'])
+            logging.info('Fetched %d rows at offset %d', rows, page_offset)
+            if rows:
+                yield result
+            offset = page_offset + page_size
+            if rows < page_size:
+                if checkpoint is not None and os.path.exists(checkpoint):
+                    os.remove(checkpoint)
+                return
+            _write_checkpoint(checkpoint, sparql, page_size, offset)
+
+
+def iter_query_frames(sbh_query, sparql, template, keys, page_size=None, categorical=True, executor=None,
+                      checkpoint=None):
+    """Run the SELECT query `sparql` a page of `page_size` rows at a
+    time, yielding each page as a DataFrame from `result_frame`. See
+    `iter_pages` for the optional arguments.
+    """
+    for result in iter_pages(sbh_query, sparql, template, keys, page_size, executor, checkpoint):
+        yield result_frame(result, keys, categorical)
+
+
+def query_frame(sbh_query, sparql, template, keys, page_size=None, categorical=True, executor=None):
+    """All the pages of `iter_query_frames` as one DataFrame."""
+    frames = iter_query_frames(sbh_query, sparql, template, keys, page_size, categorical, executor)
+    return concat_frames(frames, keys)
+
+
+def map_queries(executor, func, items):
+    """Return [func(item) for item in items]. The calls are made
+    concurrently if a `QueryExecutor` is given.
+    """
+    if executor is None:
+        return [func(item) for item in items]
+    return executor.map(func, items)
+
+
+def fetch_all(sbh_query, sparqls, executor=None, template=None, bindings=None, helper=None):
+    """Run each query in `sparqls` and return the raw results in order.
+    The queries are run concurrently if a `QueryExecutor` is given.
+    `template`, the per query `bindings` and `helper` (by default the
+    calling function) are passed to `run_query`.
+    """
+    if helper is None:
+        helper = sys._getframe(1).f_code.co_name
+    if bindings is None:
+        bindings = [()] * len(sparqls)
+    if executor is not None:
+        return executor.fetch_many(sbh_query, sparqls, template, bindings, helper)
+    return [run_query(sbh_query, sparql, template, b, helper) for sparql, b in zip(sparqls, bindings)]
+
+
+def chunks(items, size):
+    """Yield successive lists of at most `size` items."""
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def child_definitions_many(sbh_query, uris, preds, chunk_size=None, executor=None):
+    """Find the definitions reachable from each of `uris` through an
+    intervening node linked by one of `preds` (e.g. SBOL_MODULE or
+    SBOL_FUNCTIONAL_COMPONENT):
+
+        uri --pred--> Module/FunctionalComponent --definition--> child
+
+    Issues one query per `chunk_size` URIs instead of 1 + N queries per
+    URI, concurrently if an `executor` is given. Returns a dict mapping
+    each URI to a dict of pred -> set of child definitions.
+    """
+    if chunk_size is None:
+        chunk_size = VALUES_CHUNK_SIZE
+    result = {uri: {pred: set() for pred in preds} for uri in uris}
+    rows = [(uri, pred, SBOL_DEFINITION) for uri in result for pred in preds]
+    results = run_compiled(sbh_query, COMPILED_CHILD_DEFINITIONS_QUERY, rows, chunk_size * max(1, len(preds)),
+                           executor)
+    for (uri, pred, _), children in zip(rows, results):
+        result[uri][pred].update(format_query_result(sbh_query, children, ['o']))
+    return result
+
+
+def child_module_definitions_many(sbh_query, uris, chunk_size=None, executor=None):
+    """Batched `child_module_definitions`. Returns a dict mapping each
+    of `uris` to the set of its child module definitions.
+    """
+    children = child_definitions_many(sbh_query, uris, [SBOL_MODULE], chunk_size, executor)
+    return {uri: children[uri][SBOL_MODULE] for uri in children}
+
+
+def child_component_definitions_many(sbh_query, uris, chunk_size=None, executor=None):
+    """Batched `child_component_definitions`. Returns a dict mapping
+    each of `uris` to the set of its child component definitions.
+    """
+    children = child_definitions_many(sbh_query, uris, [SBOL_FUNCTIONAL_COMPONENT], chunk_size, executor)
+    return {uri: children[uri][SBOL_FUNCTIONAL_COMPONENT] for uri in children}
+
+
+def child_definitions_all_many(sbh_query, uris, chunk_size=None, executor=None):
+    """Find both the child module definitions and the child component
+    definitions of each of `uris` in a single query per chunk. Returns a
+    dict mapping each URI to a list of children, modules first.
+    """
+    preds = [SBOL_MODULE, SBOL_FUNCTIONAL_COMPONENT]
+    children = child_definitions_many(sbh_query, uris, preds, chunk_size, executor)
+    return {uri: [c for pred in preds for c in children[uri][pred]] for uri in children}
+
+
+def parent_module_definitions_many(sbh_query, uris, chunk_size=None, executor=None):
+    """Batched `parent_module_definitions`. Returns a dict mapping each
+    of `uris` to the set of module definitions that contain it.
+    """
+    if chunk_size is None:
+        chunk_size = VALUES_CHUNK_SIZE
+    preds = [SBOL_MODULE, SBOL_FUNCTIONAL_COMPONENT]
+    result = {uri: set() for uri in uris}
+    rows = [(uri, pred, SBOL_DEFINITION) for uri in result for pred in preds]
+    results = run_compiled(sbh_query, COMPILED_PARENT_DEFINITIONS_QUERY, rows, chunk_size * len(preds), executor)
+    for (uri, _, _), parents in zip(rows, results):
+        result[uri].update(format_query_result(sbh_query, parents, ['s']))
+    return result
+
+
+class ExploredGraph:
+    """The part of a hierarchy explored by a walk. `depth` maps each
+    node visited to its distance from the start of the walk, and
+    `children` maps each node that was expanded to its children. Nodes
+    reached by more than one path are only visited once, so a graph
+    holds the explored DAG rather than the tree of paths.
+
+    Nodes are interned as integer IDs, so each URI is stored once
+    however many parents it has, and the children of all the nodes are
+    kept in one array of IDs. `depth` and `children` are built from the
+    IDs when asked for.
+    """
+
+    def __init__(self):
+        self.terms = TermTable()
+        # By node ID: the depth, or -1 for a node only seen as a child,
+        # and the slice of `_child_ids` holding the children, or -1 for
+        # a node not expanded
+        self._depth = array('l')
+        self._first = array('l')
+        self._count = array('l')
+        self._child_ids = array('l')
+
+    def __contains__(self, node):
+        node_id = self.terms.lookup(node)
+        return node_id is not None and self._depth[node_id] >= 0
+
+    @property
+    def depth(self):
+        terms = self.terms.terms
+        return {terms[node_id]: depth for node_id, depth in enumerate(self._depth) if depth >= 0}
+
+    @property
+    def children(self):
+        terms = self.terms.terms
+        return {terms[node_id]: self.terms.decode(self._children(node_id))
+                for node_id, first in enumerate(self._first) if first >= 0}
+
+    @property
+    def nodes(self):
+        terms = self.terms.terms
+        return [terms[node_id] for node_id, depth in enumerate(self._depth) if depth >= 0]
+
+    def edges(self):
+        terms = self.terms.terms
+        return [(terms[node_id], terms[child]) for node_id in range(len(self.terms))
+                for child in self._children(node_id)]
+
+    def parents(self, node):
+        node_id = self.terms.lookup(node)
+        terms = self.terms.terms
+        return [terms[parent] for parent in range(len(self.terms)) if node_id in self._children(parent)]
+
+    def _intern(self, node):
+        node_id = self.terms.intern(node)
+        if node_id == len(self._depth):
+            self._depth.append(-1)
+            self._first.append(-1)
+            self._count.append(0)
+        return node_id
+
+    def _children(self, node_id):
+        first = self._first[node_id]
+        if first < 0:
+            return ()
+        return self._child_ids[first:first + self._count[node_id]]
+
+    def add_node(self, node, depth):
+        """Record `node` at `depth`. Returns False if it was already
+        visited.
+        """
+        node_id = self._intern(node)
+        if self._depth[node_id] >= 0:
+            return False
+        self._depth[node_id] = depth
+        return True
+
+    def add_children(self, node, children):
+        """Record that `node` was expanded to `children`."""
+        node_id = self._intern(node)
+        child_ids = [self._intern(child) for child in children]
+        self._first[node_id] = len(self._child_ids)
+        self._count[node_id] = len(child_ids)
+        self._child_ids.extend(child_ids)
+
+    def children_of(self, node):
+        """The children of `node`, or [] if it was not expanded."""
+        node_id = self.terms.lookup(node)
+        if node_id is None:
+            return []
+        return self.terms.decode(self._children(node_id))
+
+    def leaves(self):
+        """The nodes below the start of the walk that have no children,
+        or were not expanded.
+        """
+        terms = self.terms.terms
+        return [terms[node_id] for node_id, depth in enumerate(self._depth)
+                if depth > 0 and not self._count[node_id]]
+
+    def descendants(self, node):
+        """`node` and every node below it, breadth first."""
+        node_id = self.terms.lookup(node)
+        if node_id is None:
+            return []
+        seen = bytearray(len(self.terms))
+        seen[node_id] = 1
+        order = [node_id]
+        for parent in order:
+            for child in self._children(parent):
+                if not seen[child]:
+                    seen[child] = 1
+                    order.append(child)
+        return self.terms.decode(order)
+
+
+def walk_levels(sbh_query, uris, expand, chunk_size=None, executor=None, max_depth=None, graph=None):
+    """Level-synchronous breadth first search starting from `uris`.
+
+    `expand` is a batched function like `child_module_definitions_many`
+    that maps a collection of URIs to a dict of URI -> children. The
+    whole frontier is expanded at once, so each level of the hierarchy
+    costs one query per `chunk_size` distinct URIs. Given an `executor`,
+    the chunks of a level are fetched concurrently.
+
+    Each URI is visited once, however many paths lead to it, so shared
+    sub-modules are expanded once and cycles terminate. Nodes, depths
+    and edges are recorded in `graph` (an `ExploredGraph`) if given.
+
+    Yields a (depth, frontier) pair per level, `uris` being depth 0. A
+    level is only expanded when the caller asks for the next one, and
+    levels deeper than `max_depth` are not visited.
+    """
+    if graph is None:
+        graph = ExploredGraph()
+    queue = collections.deque(uri for uri in uris if graph.add_node(uri, 0))
+    depth = 0
+    while queue:
+        frontier = [queue.popleft() for _ in range(len(queue))]
+        yield depth, frontier
+        if max_depth is not None and depth >= max_depth:
+            return
+        children = expand(sbh_query, frontier, chunk_size=chunk_size, executor=executor)
+        depth += 1
+        for uri in frontier:
+            graph.add_children(uri, children[uri])
+            queue.extend(child for child in children[uri] if graph.add_node(child, depth))
+
+
+# Closure indexes (see closure.py) consulted by the hierarchy searches
+# before they go to the server
+_closure_indexes = []
+
+
+def add_closure_index(index):
+    _closure_indexes.append(index)
+
+
+def remove_closure_index(index):
+    _closure_indexes.remove(index)
+
+
+def closure_lookup(sbh_query, lookup, uri):
+    """Answer `lookup` ('contained_strains', 'contained_reagents' or
+    'roots') for `uri` from a registered closure index built from the
+    same server, or the same serverless backend, as `sbh_query`. Returns
+    None if no index can.
+    """
+    key = memo_server(sbh_query)
+    for index in _closure_indexes:
+        if index.key == key:
+            found = getattr(index, lookup)(uri)
+            if found is not None:
+                logging.debug('Found %s of %s in closure index', lookup, uri)
+                return found
+    return None
+
+
 # cache size 256 is an arbitrary choice
-@functools.lru_cache(maxsize=256)
+@memoize('parent_module_definitions', many=parent_module_definitions_many)
 def parent_module_definitions(sbh_query, uri):
     """Find all the module definitions that contain this element. This
     function does not recursively find grandparents, etc. It only goes
     one level up via either a module or functionaComponent predicate.
     """
-    # First, gather module definitions found via an intervening "Module" node
-    modules = subjects_for(sbh_query, SBOL_DEFINITION, uri)
-    module_defs = [subjects_for(sbh_query, SBOL_MODULE, m) for m in modules]
-    result = set(md for md_list in module_defs for md in md_list)
-    # Second, gather module definitions found via an intervening "Functional Component" node
-    functional_components = subjects_for(sbh_query, SBOL_DEFINITION, uri)
-    module_defs = [subjects_for(sbh_query, SBOL_FUNCTIONAL_COMPONENT, fc) for fc in functional_components]
-    result.update(set(md for md_list in module_defs for md in md_list))
-    return result
+    return parent_module_definitions_many(sbh_query, [uri])[uri]
 
 
 # cache size 256 is an arbitrary choice
-@functools.lru_cache(maxsize=256)
-def root_module_definitions(sbh_query, uri):
+@memoize('root_module_definitions')
+def root_module_definitions(sbh_query, uri, chunk_size=None, graph=None):
     """Perform a breadth first search up the module definition hierarchy
-    looking for module definitions which have no parent module.
-    """
-    ancestors = list(parent_module_definitions(sbh_query, uri))
-    roots = []
-    # print(ancestors)
-    while ancestors:
-        parent = ancestors.pop(0)
-        # print('Parent: {}'.format(parent))
-        parents = parent_module_definitions(sbh_query, parent)
-        # print('Found {} ancestors'.format(len(parents)))
-        if not parents:
-            roots.append(parent)
-        ancestors.extend(parents)
-    return roots
+    looking for module definitions which have no parent module. The
+    explored ancestors are recorded in `graph` if given, with edges
+    pointing from child to parent. Otherwise a registered closure index
+    is used if it covers `uri`.
+    """
+    if graph is None:
+        roots = closure_lookup(sbh_query, 'roots', uri)
+        if roots is not None:
+            return roots
+        graph = ExploredGraph()
+    for _ in walk_levels(sbh_query, [uri], parent_module_definitions_many, chunk_size, graph=graph):
+        pass
+    return graph.leaves()
 
 
 # cache size 256 is an arbitrary choice
-@functools.lru_cache(maxsize=256)
+@memoize('child_module_definitions', many=child_module_definitions_many)
 def child_module_definitions(sbh_query, uri):
     """Find all children that are module definitions
     """
     # Gather module definitions found via an intervening "Module" node
-    modules = objects_for(sbh_query, uri, SBOL_MODULE)
-    module_defs = [objects_for(sbh_query, m, SBOL_DEFINITION) for m in modules]
-    result = set(md for md_list in module_defs for md in md_list)
-    return result
+    return child_module_definitions_many(sbh_query, [uri])[uri]
 
 
 # cache size 256 is an arbitrary choice
-@functools.lru_cache(maxsize=256)
+@memoize('child_component_definitions', many=child_component_definitions_many)
 def child_component_definitions(sbh_query, uri):
     """Find all children that are component definitions.
     """
     # Gather component definitions found via an intervening "FunctionalComponent" node
     # uri --functionalComponent--> FunctionComponent --definition--> ComponentDefinition
-    fcs = objects_for(sbh_query, uri, SBOL_FUNCTIONAL_COMPONENT)
-    comp_defs = [objects_for(sbh_query, fc, SBOL_DEFINITION) for fc in fcs]
-    result = set(cd for cd_list in comp_defs for cd in cd_list)
-    return result
+    return child_component_definitions_many(sbh_query, [uri])[uri]
 
 
 def triple_exists(sbh_query, subj, pred, obj):
     """Determine if the given triple exists. Returns a bool."""
-    sparql = SPO_QUERY.format(subj, pred, obj)
     logging.info('Querying for %s %s %s', subj, pred, obj)
-    logging.debug('Query is %s', sparql)
-    result = sbh_query.fetch_SPARQL(None, sparql)
+    result = run_compiled(sbh_query, COMPILED_SPO_QUERY, [(subj, pred, obj)])[0]
     result = format_query_result(sbh_query, result)
     return bool(result)
 
 
+def triples_exist(sbh_query, triples, chunk_size=None, executor=None):
+    """Batched `triple_exists`. Returns a bool for each (subj, pred, obj)
+    triple in `triples`, in order.
+    """
+    results = run_compiled(sbh_query, COMPILED_SPO_QUERY, triples, chunk_size, executor)
+    return [bool(result['results']['bindings']) for result in results]
+
+
+def matching_many(sbh_query, uris, query, args=(), chunk_size=None, executor=None):
+    """Run `query`, a `CompiledQuery` selecting its ?s parameter if it
+    matches some condition, like COMPILED_STRAINS_QUERY, over `uris`
+    with one query per `chunk_size` URIs. `args` are the rest of the
+    parameters of each row. Returns a dict mapping each of `uris` to
+    whether it matched.
+    """
+    uris = list(dict.fromkeys(uris))
+    results = run_compiled(sbh_query, query, [(uri,) + tuple(args) for uri in uris], chunk_size, executor,
+                           sys._getframe(1).f_code.co_name)
+    return {uri: bool(result['results']['bindings']) for uri, result in zip(uris, results)}
+
+
+def module_is_strain_many(sbh_query, uris, chunk_size=None, executor=None):
+    """Batched `module_is_strain`. Returns a dict mapping each of `uris`
+    to whether it is a strain.
+    """
+    return matching_many(sbh_query, uris, COMPILED_STRAINS_QUERY, (SBOL_ROLE, NCIT_STRAIN), chunk_size, executor)
+
+
+def is_reagent_many(sbh_query, uris, chunk_size=None, executor=None):
+    """Batched `is_reagent`. The CHEBI prefixes are matched on the
+    server. Returns a dict mapping each of `uris` to whether it is a
+    reagent.
+    """
+    return matching_many(sbh_query, uris, COMPILED_REAGENTS_QUERY,
+                         (SBOL_TYPE, CHEBI_PURL_PREFIX, CHEBI_IDENTIFIERS_PREFIX), chunk_size, executor)
+
+
+def batched(many):
+    """Give a predicate `func(sbh_query, uri)` for `find_contained_items`
+    and the like a batched version, `many(sbh_query, uris,
+    chunk_size=None, executor=None)` returning a dict mapping each of
+    `uris` to a bool, so that each level of a search is checked in a
+    few queries rather than one per item:
+
+        @batched(has_sequence_many)
+        def has_sequence(sbh_query, uri):
+            return has_sequence_many(sbh_query, [uri])[uri]
+
+    Predicates memoized with `memoize(..., many=...)` already have one.
+    """
+    def decorator(func):
+        func.many = many
+        return func
+
+    return decorator
+
+
+def classify(sbh_query, predicate, items, chunk_size=None, executor=None):
+    """Return `predicate(sbh_query, item)` for each of `items`, in
+    order, using the batched version of `predicate` if it has one (see
+    `batched`), and otherwise checking the items concurrently if an
+    `executor` is given.
+    """
+    many = getattr(predicate, 'many', None)
+    if many is not None:
+        flags = many(sbh_query, items, chunk_size=chunk_size, executor=executor)
+        return [flags[item] for item in items]
+    if executor is None:
+        return [predicate(sbh_query, item) for item in items]
+    return executor.map(lambda item: predicate(sbh_query, item), items)
+
+
 # cache size 256 is an arbitrary choice
-@functools.lru_cache(maxsize=256)
+@memoize('module_is_strain', many=module_is_strain_many)
 def module_is_strain(sbh_query, module_uri):
     """Determines if the given module contains the given strain."""
     # Just this module, not a recursive search
     # Strains are ModuleDefinitions that have a role ('http://sbols.org/v2#role’)
     # of 'http://purl.obolibrary.org/obo/NCIT_C14419’.
-    return triple_exists(sbh_query, module_uri, SBOL_ROLE, 'http://purl.obolibrary.org/obo/NCIT_C14419')
+    return triple_exists(sbh_query, module_uri, SBOL_ROLE, NCIT_STRAIN)
 
 
 # cache size 256 is an arbitrary choice
-@functools.lru_cache(maxsize=256)
+@memoize('is_reagent', many=is_reagent_many)
 def is_reagent(sbh_query, uri):
     types = objects_for(sbh_query, uri, SBOL_TYPE)
     for typ in types:
@@ -373,7 +1166,7 @@ def is_reagent(sbh_query, uri):
 
 
 # cache size 256 is an arbitrary choice
-@functools.lru_cache(maxsize=256)
+@memoize('is_stub')
 def is_stub(sbh_query, uri):
     """Determines if the given URI is marked as a stub in SynBioHub.
     Returns True if it is marked as a stub, False otherwise.
@@ -385,159 +1178,218 @@ def is_stub(sbh_query, uri):
     return 'true' in stub_values
 
 
+def iter_contained(sbh_query, uri, predicate, expand, max_depth=None, limit=None, chunk_size=None,
+                   executor=None, graph=None):
+    """Breadth first search down from `uri`, yielding each item that
+    matches `predicate(sbh_query, item)` as soon as it is found. `expand`
+    is a batched child lookup like `child_module_definitions_many`.
+
+    `uri` is at depth 0, and items deeper than `max_depth` are not
+    visited. The search stops after `limit` matches. Given an
+    `executor`, each level is fetched and checked concurrently, so its
+    matches are yielded together, as they are if `predicate` has a
+    batched version (see `batched`). Each item is visited, and yielded,
+    once. The explored hierarchy is recorded in `graph` if given.
+    """
+    if limit is not None and limit <= 0:
+        return
+    found = 0
+    for _, frontier in walk_levels(sbh_query, [uri], expand, chunk_size, executor, max_depth, graph):
+        if executor is None and not hasattr(predicate, 'many'):
+            matches = (item for item in frontier if predicate(sbh_query, item))
+        else:
+            flags = classify(sbh_query, predicate, frontier, chunk_size, executor)
+            matches = [item for item, flag in zip(frontier, flags) if flag]
+        for item in matches:
+            yield item
+            found += 1
+            if limit is not None and found >= limit:
+                return
+
+
+def iter_contained_items(sbh_query, uri, predicate, max_depth=None, limit=None, chunk_size=None, executor=None,
+                         graph=None):
+    """Generator version of `find_contained_items`. See `iter_contained`
+    for the optional arguments.
+    """
+    return iter_contained(sbh_query, uri, predicate, child_definitions_all_many, max_depth, limit, chunk_size,
+                          executor, graph)
+
+
+def iter_contained_reagents(sbh_query, uri, max_depth=None, limit=None, chunk_size=None, executor=None,
+                            graph=None):
+    """Generator version of `find_contained_reagents`. For example, to
+    check if there are any reagents at all:
+
+        any(iter_contained_reagents(sbh_query, uri))
+    """
+    return iter_contained_items(sbh_query, uri, is_reagent, max_depth, limit, chunk_size, executor, graph)
+
+
+def iter_contained_strains(sbh_query, uri, max_depth=None, limit=None, chunk_size=None, executor=None,
+                           graph=None):
+    """Generator version of `find_contained_strains`. For example, to
+    find at most 10 strains at most 2 levels down:
+
+        list(iter_contained_strains(sbh_query, uri, max_depth=2, limit=10))
+    """
+    return iter_contained(sbh_query, uri, module_is_strain, child_module_definitions_many, max_depth, limit,
+                          chunk_size, executor, graph)
+
+
 # Don't cache here, cache in the next layer out, like `find_contained_reagents`
-def find_contained_items(sbh_query, uri, predicate):
-    found = []
-    uris = [uri]
-    while uris:
-        item = uris.pop(0)
-        if predicate(sbh_query, item):
-            found.append(item)
-        uris.extend(child_module_definitions(sbh_query, item))
-        uris.extend(child_component_definitions(sbh_query, item))
-    return found
+def find_contained_items(sbh_query, uri, predicate, chunk_size=None, executor=None, graph=None):
+    return list(iter_contained_items(sbh_query, uri, predicate, chunk_size=chunk_size, executor=executor,
+                                     graph=graph))
 
 
 # Syntactic sugar. Find contained items that match the `is_reagent`
 # predicate.
 #
 # cache size 256 is an arbitrary choice
-@functools.lru_cache(maxsize=256)
-def find_contained_reagents(sbh_query, uri):
+@memoize('find_contained_reagents')
+def find_contained_reagents(sbh_query, uri, chunk_size=None, executor=None, graph=None):
     """Walk down the hierarchy of ModuleDefinitions and
     ComponentDefinitions finding items that match the `is_reagent`
     predicate.
 
     """
-    return find_contained_items(sbh_query, uri, is_reagent)
+    if graph is None:
+        reagents = closure_lookup(sbh_query, 'contained_reagents', uri)
+        if reagents is not None:
+            return reagents
+    return find_contained_items(sbh_query, uri, is_reagent, chunk_size, executor, graph)
 
 
-# This should leverage `find_contained_items` now that it exists.
-#
-# An optimization could be to have find_contained_items only search
-# the module definitions to make the search for strains faster.
+# This could leverage `find_contained_items`, but only searching the
+# module definitions makes the search for strains faster.
 #
 # cache size 256 is an arbitrary choice
-@functools.lru_cache(maxsize=256)
-def find_contained_strains(sbh_query, uri):
-    strains = []
-    modules = [uri]
-    while modules:
-        module = modules.pop(0)
-        # print('Module: {}'.format(module))
-        if module_is_strain(sbh_query, module):
-            strains.append(module)
-        # print('Modules: {}'.format(modules))
-        children = child_module_definitions(sbh_query, module)
-        # print('children: {}'.format(children))
-        # print('Module {} has {} children'.format(module, len(children)))
-        modules.extend(children)
-    # print('Strains: {}'.format(strains))
-    return strains
-
-
-def parse_args(args):
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-d', '--debug', action='store_true',
-                        help="(default: %(default)s)")
-    parser.add_argument('--staging', action='store_true',
-                        help="(default: %(default)s)")
-    parser.add_argument('-u', '--user', default='sd2e',
-                        help="(default: %(default)s)")
-    args = parser.parse_args(args)
-    return args
-
-
-def init_logging(debug=False):
-    msgFormat = '%(asctime)s %(levelname)s %(message)s'
-    dateFormat = '%m/%d/%Y %H:%M:%S'
-    level = logging.INFO
-    if debug:
-        level = logging.DEBUG
-    logging.basicConfig(format=msgFormat, datefmt=dateFormat, level=level)
-
-
-def main(argv=None):
-    args = parse_args(argv)
-
-    # Init logging
-    init_logging(args.debug)
-
-    # Get SynBioHub password
-    sbh_password = os.getenv('SBH_PASSWORD')
-    if sbh_password is None:
-        raise Exception('Environment does not contain SBH_PASSWORD')
-
-    if args.staging:
-        sbh_query = sbha.SynBioHubQuery(sbha.SD2Constants.SD2_STAGING_SERVER,
-                                        spoofed_url=sbha.SD2Constants.SD2_SERVER)
-    else:
-        sbh_query = sbha.SynBioHubQuery(sbha.SD2Constants.SD2_SERVER)
-    logging.info('Authenticating to {}'.format(sbh_query._server))
-    sbh_query.login(args.user, sbh_password)
-    logging.info('Authentication complete')
-
-    # --------------------------------------------------
-
-    # for s, title in find_grna(sbh_query):
-    #     if 'gRNA Gene' in title:
-    #         logging.info('%s     %s', s, title)
-    # return
+@memoize('find_contained_strains')
+def find_contained_strains(sbh_query, uri, chunk_size=None, executor=None, graph=None):
+    """Walk down the hierarchy of ModuleDefinitions finding strains.
+    Given an `executor`, the nodes of each level are fetched and checked
+    concurrently. The explored modules are recorded in `graph` if given.
+    Otherwise a registered closure index is used if it covers `uri`.
+    """
+    if graph is None:
+        strains = closure_lookup(sbh_query, 'contained_strains', uri)
+        if strains is not None:
+            return strains
+    return list(iter_contained_strains(sbh_query, uri, chunk_size=chunk_size, executor=executor, graph=graph))
+
+
+def find_contained_bulk(sbh_query, roots, predicate, expand, chunk_size=None, executor=None, graph=None):
+    """Find the items matching `predicate` contained in each of `roots`
+    with one breadth first search from all of them at once. Every node
+    reachable from any root is expanded and checked once, so a scan of
+    a whole collection costs about one query per distinct node rather
+    than one per path.
+
+    Returns a pair of dicts: root -> matching items contained in it,
+    and matching item -> roots containing it.
+    """
+    if graph is None:
+        graph = ExploredGraph()
+    matches = set()
+    for _, frontier in walk_levels(sbh_query, roots, expand, chunk_size, executor, graph=graph):
+        flags = classify(sbh_query, predicate, frontier, chunk_size, executor)
+        matches.update(item for item, flag in zip(frontier, flags) if flag)
+
+    by_root = {}
+    by_item = {}
+    for root in roots:
+        if root in by_root:
+            continue
+        found = by_root[root] = [node for node in graph.descendants(root) if node in matches]
+        for node in found:
+            by_item.setdefault(node, []).append(root)
+    return by_root, by_item
+
+
+def find_contained_strains_bulk(sbh_query, roots, chunk_size=None, executor=None, graph=None):
+    """Find the strains contained in each of `roots`, e.g. all the
+    members of a collection. Returns a pair of dicts: root -> strains
+    and strain -> roots. See `find_contained_bulk`.
+    """
+    return find_contained_bulk(sbh_query, roots, module_is_strain, child_module_definitions_many, chunk_size,
+                               executor, graph)
 
-    # --------------------------------------------------
 
-    # coll = 'https://hub.sd2e.org/user/sd2e/design/yeast_gates_plasmids/1'
-    # coll_members = format_query_result(sbh_query, sbh_query.query_collection_members([coll]))
-    # for m in sorted(coll_members):
-    #     logging.info('yeast_gates_plasmid: %s', m)
+def find_contained_reagents_bulk(sbh_query, roots, chunk_size=None, executor=None, graph=None):
+    """Find the reagents contained in each of `roots`. Returns a pair of
+    dicts: root -> reagents and reagent -> roots. See
+    `find_contained_bulk`.
+    """
+    return find_contained_bulk(sbh_query, roots, is_reagent, child_definitions_all_many, chunk_size, executor,
+                               graph)
 
-    # --------------------------------------------------
 
-    # Tell me about this thing...
+# Servers that have rejected a property path query. Searches against
+# these go straight to the client side walk.
+_no_property_paths = set()
 
-    # subj = 'https://hub.sd2e.org/user/sd2e/design/anno_120009203/1'
-    # for p, o in subject_info(sbh_query, subj):
-    #     logging.info('%s    %s    %s', subj, p, o)
-    # return
 
-    # --------------------------------------------------
+def find_by_path(sbh_query, sparql, template, uri, fallback):
+    """Run a single property path query. If the endpoint rejects it, log
+    it, remember not to try that server again, and return `fallback()`
+    instead. If it fails in a way worth retrying, like a timeout, only
+    this search falls back.
+    """
+    from .executor import is_retryable
+    server = memo_server(sbh_query)
+    if server not in _no_property_paths:
+        try:
+            result = run_query(sbh_query, sparql, template, (uri,), sys._getframe(1).f_code.co_name)
+        except Exception as err:
+            logging.warning('Property path query failed on %s, falling back to client side walk: %s',
+                            server, err)
+            if not is_retryable(err):
+                _no_property_paths.add(server)
+        else:
+            return format_query_result(sbh_query, result, ['o'])
+    return fallback()
 
-    # things = so_query(sbh_query, SBOL_FUNCTIONAL_COMPONENT)
-    # for thing in things:
-    #     logging.info('%s     ---->     %s', thing['s'], thing['o'])
-    # sys.exit(0)
 
-    # definers = subjects_for(sbh_query, SBOL_DEFINITION, 'https://hub.sd2e.org/user/sd2e/design/anno_120009203/1')
-    gene = R10_GRNA_GENE
-    gene = R3_GRNA_GENE
+# cache size 256 is an arbitrary choice
+@memoize('find_contained_strains_by_path')
+def find_contained_strains_by_path(sbh_query, uri):
+    """Like `find_contained_strains` but the hierarchy is walked on the
+    server in one query. Each strain is reported once. Falls back to
+    `find_contained_strains` if the server does not support property
+    paths.
+    """
+    sparql = format_uris(CONTAINED_STRAINS_PATH_QUERY, uri, SBOL_MODULE, SBOL_DEFINITION, SBOL_ROLE, NCIT_STRAIN)
+    return find_by_path(sbh_query, sparql, 'CONTAINED_STRAINS_PATH_QUERY', uri,
+                        lambda: find_contained_strains(sbh_query, uri))
 
-    data_frame = find_construct_experiments(sbh_query, gene)
-    logging.info('Found %d experiments', data_frame.size)
 
-    sys.exit(0)
+# cache size 256 is an arbitrary choice
+@memoize('find_contained_reagents_by_path')
+def find_contained_reagents_by_path(sbh_query, uri):
+    """Like `find_contained_reagents` but the hierarchy is walked on the
+    server in one query. Each reagent is reported once. Falls back to
+    `find_contained_reagents` if the server does not support property
+    paths.
+    """
+    sparql = format_uris(CONTAINED_REAGENTS_PATH_QUERY, uri, SBOL_MODULE, SBOL_FUNCTIONAL_COMPONENT,
+                         SBOL_DEFINITION, SBOL_TYPE, CHEBI_PURL_PREFIX, CHEBI_IDENTIFIERS_PREFIX)
+    return find_by_path(sbh_query, sparql, 'CONTAINED_REAGENTS_PATH_QUERY', uri,
+                        lambda: find_contained_reagents(sbh_query, uri))
 
-    for x in results:
-        logging.info('%s', x)
-        title = title_for(sbh_query, x)
-        logging.info('\ttitle: %s', title)
-        # for triple in results[x]:
-        #     logging.info('\t%r', triple)
-        logging.info('--------------------------------------------------')
 
-    sys.exit(0)
+def __getattr__(name):
+    # CHALLENGE_PROBLEMS comes from synbiohub_adapter, which is slow to
+    # import, so it is only looked up when used
+    if name == 'CHALLENGE_PROBLEMS':
+        return challenge_problems()
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
-    cp_members = {}
-    for cp in CHALLENGE_PROBLEMS:
-        cp_members[cp] = format_query_result(sbh_query, sbh_query.query_collection_members([cp]))
 
-    for cp in cp_members:
-        actual_members = set(members).intersection(set(cp_members[cp]))
-        for m in actual_members:
-            logging.info('Component of %s (%s)', m, cp)
-            titles = title_for(sbh_query, m)
-            for title in titles:
-                logging.info('%s title: %s', m, title)
-            logging.info('Chain: %r', [(cp, SBOL_MEMBER, m)] + results[m])
+def main(argv=None):
+    """The sbh-prospector command line. See cli.py."""
+    from .cli import main
+    return main(argv)
 
 
 if __name__ == "__main__":
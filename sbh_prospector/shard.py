@@ -0,0 +1,240 @@
+"""Scans split into shards run by a pool of processes.
+
+A scan of a very large collection is bound by parsing and walking
+results as much as by the server, which threads do not help with. A
+`ShardPool` starts `processes` worker processes, each with its own
+`sbh_query` made by calling `connect`, hands each of them a shard of the
+scan at a time and retries shards that fail:
+
+    connect = functools.partial(shard.sparql_session, SERVER, user, password)
+    frame = shard.find_contained_strains_sharded(connect, members, processes=8)
+
+`connect` is sent to the workers, so it must be picklable: a module
+level function, a class or a `functools.partial` of one. Shards share
+no memo, so a node reachable from roots in two shards is queried by
+both; the default shard size keeps shards large for that reason.
+"""
+
+import concurrent.futures
+import functools
+import itertools
+import logging
+import os
+import time
+
+from . import prospector
+
+# shards per process when the shard size is not given, so a slow shard
+# does not hold up the end of the scan for long
+SHARDS_PER_PROCESS = 4
+
+# The sbh_query and executor of a worker process, set by _start_worker
+_sbh_query = None
+_executor = None
+
+
+def sparql_session(server, user=None, password=None, pool_size=10):
+    """Make a `SparqlSession` for `server`, logged in if `user` is given.
+    A `functools.partial` of it is the usual `connect` of a `ShardPool`.
+    """
+    from .executor import SparqlSession
+    sbh_query = SparqlSession(server, pool_size=pool_size)
+    if user is not None:
+        sbh_query.login(user, password)
+    return sbh_query
+
+
+def log_progress(done, total):
+    """The default progress report of a `ShardPool`."""
+    if total is None:
+        logging.info('Finished %d shards', done)
+    else:
+        logging.info('Finished %d of %d shards', done, total)
+
+
+def _start_worker(connect, threads):
+    global _sbh_query, _executor
+    _sbh_query = connect()
+    if threads > 1:
+        from .executor import QueryExecutor
+        _executor = QueryExecutor(max_workers=threads)
+
+
+def _run_shard(func, shard, delay):
+    if delay:
+        time.sleep(delay)
+    return func(_sbh_query, shard, _executor)
+
+
+class ShardPool:
+    """Run the shards of a scan on `processes` worker processes (default:
+    one per CPU). Each worker calls `connect()` once to make its own
+    `sbh_query`, and with `threads` > 1 also has a `QueryExecutor` of
+    that many threads. A shard that fails is run again, up to `retries`
+    times, after waiting `backoff` seconds and then twice as long after
+    each further failure. `progress(done, total)` is called as each
+    shard finishes; `total` is None when the number of shards is not
+    known in advance.
+    """
+
+    def __init__(self, connect, processes=None, threads=1, retries=2, backoff=1.0, progress=None):
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if progress is None:
+            progress = log_progress
+        self.processes = processes
+        self.retries = retries
+        self.backoff = backoff
+        self.progress = progress
+        self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=_start_worker,
+                                                            initargs=(connect, threads))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._pool.shutdown()
+
+    def run(self, func, shards, total=None):
+        """Call `func(sbh_query, shard, executor)` in the workers for each
+        of `shards`, yielding (position, result) pairs as shards finish,
+        where position is the index of the shard in `shards`. `func` and
+        the shards are sent to the workers, so must be picklable.
+
+        Only `processes` shards are in flight at once, and `shards` is
+        read lazily, one more each time a result has been taken, so it
+        may be a generator that stops once the caller has seen enough.
+        """
+        shards = enumerate(shards)
+        pending = {}
+
+        def start(position, shard, attempt):
+            delay = self.backoff * 2 ** (attempt - 1) if attempt else 0
+            future = self._pool.submit(_run_shard, func, shard, delay)
+            pending[future] = (position, shard, attempt)
+
+        for position, shard in itertools.islice(shards, self.processes):
+            start(position, shard, 0)
+        done = 0
+        while pending:
+            finished, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                position, shard, attempt = pending.pop(future)
+                try:
+                    result = future.result()
+                except concurrent.futures.process.BrokenProcessPool:
+                    raise
+                except Exception as err:
+                    if attempt >= self.retries:
+                        raise
+                    logging.warning('Retrying shard %d after %s', position, err)
+                    start(position, shard, attempt + 1)
+                    continue
+                done += 1
+                self.progress(done, total)
+                yield position, result
+                for position, shard in itertools.islice(shards, 1):
+                    start(position, shard, 0)
+
+    def map(self, func, shards):
+        """Return the results of `run` in the order of `shards`."""
+        shards = list(shards)
+        results = [None] * len(shards)
+        for position, result in self.run(func, shards, len(shards)):
+            results[position] = result
+        return results
+
+
+# kind -> (predicate, batched child lookup) of a contained items scan
+CONTAINED = {
+    'strain': ('module_is_strain', 'child_module_definitions_many'),
+    'reagent': ('is_reagent', 'child_definitions_all_many'),
+}
+
+
+def _contained_frame(kind, chunk_size, sbh_query, roots, executor):
+    import pandas as pd
+    predicate, expand = (getattr(prospector, name) for name in CONTAINED[kind])
+    by_root, _ = prospector.find_contained_bulk(sbh_query, roots, predicate, expand, chunk_size, executor)
+    rows = [(root, item) for root, items in by_root.items() for item in items]
+    return pd.DataFrame(rows, columns=['root', kind]).astype('category')
+
+
+def scan_contained(pool, roots, kind, shard_size=None, chunk_size=None):
+    """Find the items of `kind` ('strain' or 'reagent') contained in each
+    of `roots`, splitting `roots` into shards of `shard_size` run on the
+    `ShardPool` `pool`. Each shard is searched with `find_contained_bulk`.
+    Returns a DataFrame with columns root and `kind`, in the order of
+    `roots`.
+    """
+    roots = list(dict.fromkeys(roots))
+    if shard_size is None:
+        shard_size = max(1, -(-len(roots) // (pool.processes * SHARDS_PER_PROCESS)))
+    func = functools.partial(_contained_frame, kind, chunk_size)
+    frames = pool.map(func, prospector.chunks(roots, shard_size))
+    return prospector.concat_frames(frames, ['root', kind])
+
+
+def find_contained_strains_sharded(connect, roots, processes=None, shard_size=None, threads=1, retries=2,
+                                   progress=None):
+    """Find the strains contained in each of `roots` on a pool of
+    processes. Returns a DataFrame with columns root and strain. See
+    `ShardPool` and `scan_contained`.
+    """
+    with ShardPool(connect, processes, threads, retries, progress=progress) as pool:
+        return scan_contained(pool, roots, 'strain', shard_size)
+
+
+def find_contained_reagents_sharded(connect, roots, processes=None, shard_size=None, threads=1, retries=2,
+                                    progress=None):
+    """Find the reagents contained in each of `roots` on a pool of
+    processes. Returns a DataFrame with columns root and reagent. See
+    `ShardPool` and `scan_contained`.
+    """
+    with ShardPool(connect, processes, threads, retries, progress=progress) as pool:
+        return scan_contained(pool, roots, 'reagent', shard_size)
+
+
+def _page_frame(sparql, template, keys, page_size, categorical, sbh_query, offset, executor):
+    order = ' '.join('?' + key for key in keys)
+    page = prospector.PAGE_QUERY.format(sparql.rstrip(), order, page_size, offset)
+    result = prospector.run_query(sbh_query, page, template, (page_size, offset), 'scan_pages')
+    return prospector.result_frame(result, keys, categorical)
+
+
+def scan_pages(pool, sparql, template, keys, page_size=None, categorical=True):
+    """Run the SELECT query `sparql` a page of `page_size` rows at a time
+    on the `ShardPool` `pool`, each page being a shard, and return all
+    the rows as one DataFrame with a column per variable in `keys`, like
+    `query_frame`. Pages are handed out until one comes back short.
+    """
+    if page_size is None:
+        page_size = prospector.QUERY_PAGE_SIZE
+    end = []
+
+    def offsets():
+        for offset in itertools.count(0, page_size):
+            if end:
+                return
+            yield offset
+
+    func = functools.partial(_page_frame, sparql, template, keys, page_size, categorical)
+    frames = {}
+    for position, frame in pool.run(func, offsets()):
+        frames[position] = frame
+        if len(frame) < page_size:
+            end.append(position)
+    last = min(end)
+    return prospector.concat_frames([frames[position] for position in range(last + 1)], keys)
+
+
+def find_grna_sharded(connect, processes=None, page_size=None, threads=1, retries=2, progress=None):
+    """Sharded version of `find_grna_frame`, fetching and converting the
+    pages on a pool of processes. Returns a DataFrame with columns s and
+    title.
+    """
+    with ShardPool(connect, processes, threads, retries, progress=progress) as pool:
+        return scan_pages(pool, prospector.GRNA_QUERY, 'find_grna', ['s', 'title'], page_size)
@@ -0,0 +1,440 @@
+import gzip
+import itertools
+import logging
+import os
+import re
+import time
+import urllib.parse
+from xml.etree import ElementTree
+
+from . import sparql
+from .interning import TermTable
+from .prospector import (RDF_TYPE, SBOL_DEFINITION, SBOL_FUNCTIONAL_COMPONENT, SBOL_MEMBER, SBOL_MODULE,
+                         SBOL_PRED_COMPONENT, VALUES_CHUNK_SIZE, chunks, iter_pages, run_query, server_for,
+                         values_rows)
+
+SUBJECT_TRIPLES_QUERY = """
+    SELECT ?s ?p ?o WHERE {{
+        VALUES (?s) {{ {} }}
+        ?s ?p ?o .
+    }}
+"""
+
+TRIPLES_QUERY = """
+    SELECT ?s ?p ?o WHERE {{
+        {}
+    }}
+"""
+
+# Predicates followed by `SnapshotIndex.load_reachable`. These are the
+# edges walked by the hierarchy searches in prospector.py.
+HIERARCHY_PREDICATES = (SBOL_MEMBER, SBOL_MODULE, SBOL_FUNCTIONAL_COMPONENT, SBOL_DEFINITION,
+                        SBOL_PRED_COMPONENT)
+
+NT_TERM = r'(<[^>]*>|_:\S+|"(?:[^"\\]|\\.)*"(?:@[A-Za-z0-9-]+|\^\^<[^>]*>)?)'
+NT_LINE = re.compile(r'\s*' + NT_TERM + r'\s+' + NT_TERM + r'\s+' + NT_TERM + r'\s*\.\s*$')
+
+
+def ntriples_term(text):
+    """Convert an N-Triples term to a term as used by `sparql`."""
+    if text.startswith('<'):
+        return sparql.unescape(text[1:-1]) if '\\' in text else text[1:-1]
+    if text.startswith('_:'):
+        return text
+    end = text.rindex('"')
+    value = sparql.unescape(text[1:end])
+    suffix = text[end + 1:]
+    if suffix.startswith('@'):
+        return sparql.encode_literal(value, lang=suffix[1:])
+    if suffix.startswith('^^'):
+        return sparql.encode_literal(value, suffix[3:-1])
+    return sparql.encode_literal(value)
+
+
+def parse_ntriples(lines):
+    """Yield (s, p, o) terms from N-Triples lines."""
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        match = NT_LINE.match(line)
+        if match is None:
+            raise ValueError('Malformed N-Triples on line {}: {}'.format(line_number, line))
+        yield tuple(ntriples_term(t) for t in match.groups())
+
+
+RDF_NS = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+XML_NS = '{http://www.w3.org/XML/1998/namespace}'
+RDF_XML_LITERAL = RDF_NS + 'XMLLiteral'
+RDF = '{' + RDF_NS + '}'
+
+# File formats by extension. SBOL2 files are RDF/XML.
+FORMATS = {'.nt': 'nt', '.ttl': 'turtle', '.xml': 'xml', '.rdf': 'xml', '.sbol': 'xml'}
+
+
+def _uri(tag):
+    """The URI of a `{namespace}local` element or attribute name."""
+    namespace, _, local = tag[1:].partition('}')
+    return namespace + local
+
+
+def _resolve(base, uri):
+    return urllib.parse.urljoin(base, uri) if base else uri
+
+
+def _rdfxml_literal(value, elem, lang):
+    datatype = elem.get(RDF + 'datatype')
+    return sparql.encode_literal(value, datatype, None if datatype else lang)
+
+
+def _rdfxml_node(elem, base, lang, blanks, triples):
+    """Append the triples of the node element `elem`, and of the nodes
+    nested in it, to `triples`. Returns the term of its subject.
+    """
+    base = elem.get(XML_NS + 'base', base)
+    lang = elem.get(XML_NS + 'lang', lang)
+    if elem.get(RDF + 'about') is not None:
+        subj = _resolve(base, elem.get(RDF + 'about'))
+    elif elem.get(RDF + 'ID') is not None:
+        subj = _resolve(base, '#' + elem.get(RDF + 'ID'))
+    elif elem.get(RDF + 'nodeID') is not None:
+        subj = '_:' + elem.get(RDF + 'nodeID')
+    else:
+        subj = '_:rdfxml{}'.format(next(blanks))
+    if elem.tag != RDF + 'Description':
+        triples.append((subj, RDF_TYPE, _uri(elem.tag)))
+    for name, value in elem.attrib.items():
+        if not name.startswith(RDF) and not name.startswith(XML_NS):
+            triples.append((subj, _uri(name), sparql.encode_literal(value, lang=lang)))
+    items = itertools.count(1)
+    for prop in elem:
+        pred = _uri(prop.tag)
+        if pred == RDF_NS + 'li':
+            pred = RDF_NS + '_{}'.format(next(items))
+        prop_lang = prop.get(XML_NS + 'lang', lang)
+        parse_type = prop.get(RDF + 'parseType')
+        if prop.get(RDF + 'resource') is not None:
+            obj = _resolve(base, prop.get(RDF + 'resource'))
+        elif prop.get(RDF + 'nodeID') is not None:
+            obj = '_:' + prop.get(RDF + 'nodeID')
+        elif parse_type == 'Resource':
+            description = ElementTree.Element(RDF + 'Description', prop.attrib)
+            description.extend(prop)
+            obj = _rdfxml_node(description, base, prop_lang, blanks, triples)
+        elif parse_type == 'Literal':
+            value = (prop.text or '') + ''.join(ElementTree.tostring(child, encoding='unicode') for child in prop)
+            obj = sparql.encode_literal(value, RDF_XML_LITERAL)
+        elif len(prop):
+            obj = _rdfxml_node(prop[0], base, prop_lang, blanks, triples)
+        else:
+            obj = _rdfxml_literal(prop.text or '', prop, prop_lang)
+        triples.append((subj, pred, obj))
+    return subj
+
+
+def parse_rdfxml(source, base=None):
+    """Yield (s, p, o) terms from an RDF/XML document, such as an SBOL2
+    file, given as a path or binary file. The document is streamed:
+    each top level description is parsed and then discarded.
+    """
+    blanks = itertools.count()
+    depth = 0
+    root = None
+    for event, elem in ElementTree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+                base = root.get(XML_NS + 'base', base)
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1 and root.tag == RDF + 'RDF':
+            triples = []
+            _rdfxml_node(elem, base, root.get(XML_NS + 'lang'), blanks, triples)
+            yield from triples
+            root.clear()
+        elif depth == 0 and root.tag != RDF + 'RDF':
+            triples = []
+            _rdfxml_node(root, base, None, blanks, triples)
+            yield from triples
+
+
+def _rdflib_term(term):
+    import rdflib
+    if isinstance(term, rdflib.BNode):
+        return '_:' + str(term)
+    if isinstance(term, rdflib.Literal):
+        return sparql.encode_literal(str(term), term.datatype and str(term.datatype), term.language)
+    return str(term)
+
+
+def parse_rdflib(source, format):
+    """Yield (s, p, o) terms from a document in any format rdflib reads,
+    such as Turtle. Unlike the other parsers, the whole document is
+    parsed into memory first. Requires rdflib.
+    """
+    import rdflib
+    graph = rdflib.Graph()
+    graph.parse(source, format=format)
+    for triple in graph:
+        yield tuple(_rdflib_term(term) for term in triple)
+
+
+def file_format(path):
+    """The format of `path`, from its extension, ignoring any '.gz'."""
+    root, ext = os.path.splitext(path)
+    if ext == '.gz':
+        ext = os.path.splitext(root)[1]
+    if ext not in FORMATS:
+        raise ValueError('Unknown RDF file extension: {}'.format(path))
+    return FORMATS[ext]
+
+
+def _index_add(index, a, b, c):
+    inner = index.get(a)
+    if inner is None:
+        inner = index[a] = {}
+    values = inner.get(b)
+    if values is None:
+        values = inner[b] = set()
+    if c in values:
+        return False
+    values.add(c)
+    return True
+
+
+class SnapshotIndex:
+    """An in-memory copy of (part of) a SynBioHub triple store.
+
+    Triples are bulk loaded once, from the server or from an N-Triples
+    dump, and kept in SPO, POS and OSP indexes over interned integer
+    term IDs. A `SnapshotIndex` answers `fetch_SPARQL` and
+    `format_query_result` like a `SynBioHubQuery`, so it can be passed
+    as the `sbh_query` of any function in prospector.py and hierarchy
+    walks no longer need a round trip per hop.
+    """
+
+    def __init__(self, server=None):
+        self._server = server
+        self.terms = TermTable()
+        self.spo = {}
+        self.pos = {}
+        self.osp = {}
+        self.size = 0
+        # path, format, triples and seconds of each file loaded
+        self.loads = []
+        self._evaluator = sparql.Evaluator(self)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def memo_key(self):
+        # A snapshot is keyed on itself in the memo rather than on its
+        # server, as its answers differ from the server's when it holds
+        # only what is reachable from some roots
+        return self
+
+    def add(self, subj, pred, obj):
+        """Add a triple of terms. Returns True if it was new."""
+        s = self.terms.intern(subj)
+        p = self.terms.intern(pred)
+        o = self.terms.intern(obj)
+        if not _index_add(self.spo, s, p, o):
+            return False
+        _index_add(self.pos, p, o, s)
+        _index_add(self.osp, o, s, p)
+        self.size += 1
+        return True
+
+    def lookup(self, term):
+        return self.terms.lookup(term)
+
+    def term(self, term_id):
+        return self.terms[term_id]
+
+    def objects(self, s, p):
+        return self.spo.get(s, {}).get(p, ())
+
+    def subjects(self, p, o):
+        return self.pos.get(p, {}).get(o, ())
+
+    def nodes(self):
+        return set(self.spo) | set(self.osp)
+
+    def match(self, s=None, p=None, o=None):
+        """Yield (s, p, o) ID triples matching a pattern. None matches
+        anything.
+        """
+        if s is not None:
+            by_pred = self.spo.get(s, {})
+            if p is not None:
+                objs = by_pred.get(p, ())
+                if o is not None:
+                    if o in objs:
+                        yield s, p, o
+                    return
+                for obj in objs:
+                    yield s, p, obj
+            elif o is not None:
+                for pred in self.osp.get(o, {}).get(s, ()):
+                    yield s, pred, o
+            else:
+                for pred, objs in by_pred.items():
+                    for obj in objs:
+                        yield s, pred, obj
+        elif p is not None:
+            by_obj = self.pos.get(p, {})
+            if o is not None:
+                for subj in by_obj.get(o, ()):
+                    yield subj, p, o
+            else:
+                for obj, subjs in by_obj.items():
+                    for subj in subjs:
+                        yield subj, p, obj
+        elif o is not None:
+            for subj, preds in self.osp.get(o, {}).items():
+                for pred in preds:
+                    yield subj, pred, o
+        else:
+            for subj, by_pred in self.spo.items():
+                for pred, objs in by_pred.items():
+                    for obj in objs:
+                        yield subj, pred, obj
+
+    def triples(self, subj=None, pred=None, obj=None):
+        """Yield (s, p, o) term triples matching a pattern of terms.
+        None matches anything.
+        """
+        ids = []
+        for term in (subj, pred, obj):
+            if term is None:
+                ids.append(None)
+                continue
+            term_id = self.terms.lookup(term)
+            if term_id is None:
+                return
+            ids.append(term_id)
+        terms = self.terms.terms
+        for s, p, o in self.match(*ids):
+            yield terms[s], terms[p], terms[o]
+
+    def fetch_SPARQL(self, server, query):
+        return self._evaluator.run(query)
+
+    def format_query_result(self, query_result, binding_keys, group_key=None):
+        return sparql.format_bindings(query_result, binding_keys)
+
+    def _add_rows(self, result):
+        count = 0
+        for row in result['results']['bindings']:
+            count += 1
+            self.add(sparql.term_from_binding(row['s']), sparql.term_from_binding(row['p']),
+                     sparql.term_from_binding(row['o']))
+        return count
+
+    def load_file(self, path, format=None):
+        """Load an N-Triples ('nt'), RDF/XML ('xml', e.g. an SBOL2 file)
+        or Turtle ('turtle') file, optionally gzipped. The format is
+        guessed from the extension if not given. N-Triples and RDF/XML
+        are streamed, not read into memory; Turtle requires rdflib.
+        Returns the number of triples read.
+        """
+        if format is None:
+            format = file_format(path)
+        start = time.time()
+        count = 0
+        with (gzip.open if path.endswith('.gz') else open)(path, 'rb') as source:
+            if format == 'nt':
+                triples = parse_ntriples(line.decode('utf-8') for line in source)
+            elif format == 'xml':
+                triples = parse_rdfxml(source, 'file://' + urllib.parse.quote(os.path.abspath(path)))
+            else:
+                triples = parse_rdflib(source, format)
+            for subj, pred, obj in triples:
+                self.add(subj, pred, obj)
+                count += 1
+        seconds = time.time() - start
+        self.loads.append(dict(path=path, format=format, triples=count, seconds=seconds))
+        logging.info('Loaded %d triples from %s in %.1f seconds', count, path, seconds)
+        return count
+
+    def load_ntriples(self, path):
+        """Load an N-Triples file. See `load_file`."""
+        return self.load_file(path, 'nt')
+
+    def load_paged(self, sbh_query, where='?s ?p ?o .', page_size=10000, executor=None):
+        """Load every ?s ?p ?o binding of the graph pattern `where` from
+        the server, `page_size` triples per query, several pages at once
+        given an `executor`. Returns the number of triples read.
+        """
+        count = 0
+        sparql_text = TRIPLES_QUERY.format(where)
+        for result in iter_pages(sbh_query, sparql_text, 'TRIPLES_QUERY', ['s', 'p', 'o'], page_size, executor,
+                                 bindings=(where,)):
+            count += self._add_rows(result)
+            logging.info('Loaded %d triples', count)
+        return count
+
+    def load_reachable(self, sbh_query, roots, follow=HIERARCHY_PREDICATES, chunk_size=None):
+        """Load every triple of `roots` and of everything reachable from
+        them through the predicates in `follow`, e.g. all the members of
+        a collection and the modules and components they contain. One
+        query is issued per `chunk_size` subjects at each level. Returns
+        the number of triples read.
+        """
+        if chunk_size is None:
+            chunk_size = VALUES_CHUNK_SIZE
+        follow = [self.terms.intern(pred) for pred in follow]
+        seen = set(roots)
+        frontier = list(seen)
+        count = 0
+        while frontier:
+            for chunk in chunks(frontier, chunk_size):
+                sparql_text = SUBJECT_TRIPLES_QUERY.format(values_rows(chunk))
+                count += self._add_rows(run_query(sbh_query, sparql_text, 'SUBJECT_TRIPLES_QUERY', chunk))
+            next_frontier = []
+            for subj in frontier:
+                s = self.terms.lookup(subj)
+                for p in follow:
+                    for o in self.objects(s, p):
+                        obj = self.terms[o]
+                        if obj not in seen and not sparql.is_literal(obj):
+                            seen.add(obj)
+                            next_frontier.append(obj)
+            logging.info('Loaded %d triples, %d subjects to go', count, len(next_frontier))
+            frontier = next_frontier
+        return count
+
+    @classmethod
+    def from_server(cls, sbh_query, roots=None, page_size=10000, chunk_size=None):
+        """Build a snapshot from the server behind `sbh_query`. If `roots`
+        is given (e.g. a list of collection URIs) only what is reachable
+        from them is loaded, otherwise the whole store is paged in.
+        """
+        index = cls(server_for(sbh_query))
+        start = time.time()
+        if roots is None:
+            index.load_paged(sbh_query, page_size=page_size)
+        else:
+            index.load_reachable(sbh_query, roots, chunk_size=chunk_size)
+        logging.info('Snapshot of %d triples built in %.1f seconds', len(index), time.time() - start)
+        return index
+
+    @classmethod
+    def from_ntriples(cls, path, server=None):
+        """Build a snapshot from an N-Triples dump."""
+        index = cls(server)
+        index.load_ntriples(path)
+        return index
+
+    @classmethod
+    def from_files(cls, paths, format=None, server=None):
+        """Build a snapshot from RDF files, e.g. SBOL2 exports of the
+        collections to analyze, for working with no server at all. See
+        `load_file`. `server` is only used to tell snapshots apart.
+        """
+        index = cls(server)
+        for path in paths:
+            index.load_file(path, format)
+        return index
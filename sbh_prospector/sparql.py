@@ -0,0 +1,789 @@
+"""Evaluate SPARQL queries against a local triple index.
+
+Only the subset of SPARQL 1.1 that sbh_prospector itself generates is
+supported: SELECT and ASK with PREFIX, VALUES, basic graph patterns,
+property paths, FILTER, OPTIONAL, UNION, DISTINCT, ORDER BY, LIMIT and
+OFFSET. Anything else raises `SparqlError`.
+
+RDF terms are represented as strings: URIs as themselves, blank nodes
+as '_:label' and literals in their N-Triples form, e.g. '"title"' or
+'"5"^^<http://www.w3.org/2001/XMLSchema#integer>'.
+"""
+
+import functools
+import re
+
+RDF_TYPE = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
+XSD_INTEGER = 'http://www.w3.org/2001/XMLSchema#integer'
+XSD_DECIMAL = 'http://www.w3.org/2001/XMLSchema#decimal'
+
+TOKEN_RE = re.compile(r'''
+    (?P<ws>\s+|\#[^\n]*)
+  | (?P<iri><[^<>"{}|^`\\\s]*>)
+  | (?P<var>[?$][A-Za-z_][A-Za-z0-9_]*)
+  | (?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+  | (?P<langtag>@[A-Za-z]+(?:-[A-Za-z0-9]+)*)
+  | (?P<number>\d+(?:\.\d+)?)
+  | (?P<bnode>_:[A-Za-z0-9_]+)
+  | (?P<pname>(?:[A-Za-z][\w-]*)?:[\w-]*)
+  | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<op>&&|\|\||!=|<=|>=|\^\^|[{}().,;*+?/|!=<>^])
+''', re.VERBOSE)
+
+ESCAPES = {'t': '\t', 'n': '\n', 'r': '\r', 'b': '\b', 'f': '\f', '"': '"', "'": "'", '\\': '\\'}
+
+
+class SparqlError(Exception):
+    """Raised for malformed queries and queries outside the supported
+    subset of SPARQL.
+    """
+
+
+class _EvalError(Exception):
+    """A FILTER expression could not be evaluated, so it is false."""
+
+
+def _unescape(match):
+    escape = match.group(1)
+    if escape[0] in 'uU' and len(escape) > 1:
+        return chr(int(escape[1:], 16))
+    return ESCAPES.get(escape, escape)
+
+
+def unescape(text):
+    """Decode the backslash escapes of a SPARQL or N-Triples string,
+    including \\uXXXX and \\UXXXXXXXX.
+    """
+    return re.sub(r'\\(u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)', _unescape, text)
+
+
+def encode_literal(value, datatype=None, lang=None):
+    """Return the term for a literal."""
+    term = '"' + value + '"'
+    if lang:
+        term += '@' + lang
+    elif datatype:
+        term += '^^<' + datatype + '>'
+    return term
+
+
+def decode_literal(term):
+    """Split a literal term into (value, datatype, lang)."""
+    end = term.rindex('"')
+    value = term[1:end]
+    suffix = term[end + 1:]
+    if suffix.startswith('@'):
+        return value, None, suffix[1:]
+    if suffix.startswith('^^'):
+        return value, suffix[3:-1], None
+    return value, None, None
+
+
+def is_literal(term):
+    return term.startswith('"')
+
+
+def is_blank(term):
+    return term.startswith('_:')
+
+
+def lexical(term):
+    """The string value of a term, as returned by the SPARQL STR()."""
+    if is_literal(term):
+        return decode_literal(term)[0]
+    return term
+
+
+def term_from_binding(binding):
+    """Convert a SPARQL JSON result binding to a term."""
+    if binding['type'] == 'uri':
+        return binding['value']
+    if binding['type'] == 'bnode':
+        return '_:' + binding['value']
+    return encode_literal(binding['value'], binding.get('datatype'), binding.get('xml:lang'))
+
+
+def binding_for(term):
+    """Convert a term to a SPARQL JSON result binding."""
+    if is_literal(term):
+        value, datatype, lang = decode_literal(term)
+        binding = {'type': 'literal', 'value': value}
+        if datatype:
+            binding['datatype'] = datatype
+        if lang:
+            binding['xml:lang'] = lang
+        return binding
+    if is_blank(term):
+        return {'type': 'bnode', 'value': term[2:]}
+    return {'type': 'uri', 'value': term}
+
+
+def format_bindings(result, binding_keys):
+    """Flatten a SPARQL JSON result the way
+    `SynBioHubQuery.format_query_result` does: a list of values if there
+    is a single binding key, otherwise a list of dicts.
+    """
+    formatted_result = []
+    for row in result['results']['bindings']:
+        if len(binding_keys) == 1:
+            formatted_result.append(row[binding_keys[0]]['value'])
+        else:
+            formatted_result.append({k: row[k]['value'] for k in binding_keys if k in row})
+    return formatted_result
+
+
+def tokenize(text):
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        match = TOKEN_RE.match(text, pos)
+        if match is None:
+            raise SparqlError('Unexpected character {!r} at offset {}'.format(text[pos], pos))
+        pos = match.end()
+        if match.lastgroup != 'ws':
+            tokens.append((match.lastgroup, match.group()))
+    return tokens
+
+
+def is_var(node):
+    return isinstance(node, str) and node.startswith('?')
+
+
+class Query:
+    def __init__(self, form, variables, distinct, pattern, order, limit, offset):
+        self.form = form
+        self.variables = variables
+        self.distinct = distinct
+        self.pattern = pattern
+        self.order = order
+        self.limit = limit
+        self.offset = offset
+
+
+class _Parser:
+    """Recursive descent parser producing a `Query`.
+
+    Group patterns are lists of elements: ('triple', s, p, o),
+    ('values', vars, rows), ('filter', expr), ('optional', group),
+    ('union', [group, ...]) and ('group', group). Variables are strings
+    starting with '?'. Property paths are either a URI or a tuple of
+    ('seq', [...]), ('alt', [...]), ('inv', path), ('*', path),
+    ('+', path) or ('?', path).
+    """
+
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.pos = 0
+        self.prefixes = {}
+
+    def peek(self, offset=0):
+        if self.pos + offset < len(self.tokens):
+            return self.tokens[self.pos + offset]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise SparqlError('Unexpected end of query')
+        self.pos += 1
+        return token
+
+    def at(self, value):
+        kind, text = self.peek()
+        if kind == 'name':
+            return text.upper() == value
+        return kind == 'op' and text == value
+
+    def accept(self, value):
+        if self.at(value):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, value):
+        if not self.accept(value):
+            raise SparqlError('Expected {} but found {!r}'.format(value, self.peek()[1]))
+
+    def parse(self):
+        while self.accept('PREFIX'):
+            kind, pname = self.next()
+            kind2, iri = self.next()
+            if kind != 'pname' or kind2 != 'iri':
+                raise SparqlError('Malformed PREFIX declaration')
+            self.prefixes[pname[:-1]] = iri[1:-1]
+        if self.accept('SELECT'):
+            form = 'select'
+            distinct = self.accept('DISTINCT') or self.accept('REDUCED')
+            variables = []
+            if not self.accept('*'):
+                while self.peek()[0] == 'var':
+                    variables.append('?' + self.next()[1][1:])
+                if not variables:
+                    raise SparqlError('SELECT without variables')
+        elif self.accept('ASK'):
+            form = 'ask'
+            distinct = False
+            variables = []
+        else:
+            raise SparqlError('Only SELECT and ASK queries are supported')
+        self.accept('WHERE')
+        pattern = self.group()
+        order = []
+        limit = offset = None
+        while self.peek()[0] is not None:
+            if self.accept('ORDER'):
+                self.expect('BY')
+                while True:
+                    if self.at('ASC') or self.at('DESC'):
+                        descending = self.next()[1].upper() == 'DESC'
+                        self.expect('(')
+                        order.append((self.variable(), descending))
+                        self.expect(')')
+                    elif self.peek()[0] == 'var':
+                        order.append((self.variable(), False))
+                    else:
+                        break
+            elif self.accept('LIMIT'):
+                limit = self.integer()
+            elif self.accept('OFFSET'):
+                offset = self.integer()
+            else:
+                raise SparqlError('Unsupported solution modifier {!r}'.format(self.peek()[1]))
+        return Query(form, variables, distinct, pattern, order, limit, offset)
+
+    def integer(self):
+        kind, text = self.next()
+        if kind != 'number' or not text.isdigit():
+            raise SparqlError('Expected an integer but found {!r}'.format(text))
+        return int(text)
+
+    def variable(self):
+        kind, text = self.next()
+        if kind != 'var':
+            raise SparqlError('Expected a variable but found {!r}'.format(text))
+        return '?' + text[1:]
+
+    def group(self):
+        self.expect('{')
+        elements = []
+        while not self.accept('}'):
+            if self.accept('.'):
+                continue
+            if self.accept('VALUES'):
+                elements.append(self.values())
+            elif self.accept('FILTER'):
+                elements.append(('filter', self.primary_expression()))
+            elif self.accept('OPTIONAL'):
+                elements.append(('optional', self.group()))
+            elif self.at('{'):
+                groups = [self.group()]
+                while self.accept('UNION'):
+                    groups.append(self.group())
+                if len(groups) > 1:
+                    elements.append(('union', groups))
+                else:
+                    elements.append(('group', groups[0]))
+            elif self.peek()[0] == 'name' and self.peek(1) == ('op', '{'):
+                raise SparqlError('Unsupported pattern {}'.format(self.peek()[1]))
+            else:
+                elements.extend(self.triples())
+        return elements
+
+    def values(self):
+        if self.accept('('):
+            variables = []
+            while not self.accept(')'):
+                variables.append(self.variable())
+            self.expect('{')
+            rows = []
+            while not self.accept('}'):
+                self.expect('(')
+                row = []
+                while not self.accept(')'):
+                    row.append(self.value_term())
+                if len(row) != len(variables):
+                    raise SparqlError('VALUES row has the wrong number of terms')
+                rows.append(row)
+        else:
+            variables = [self.variable()]
+            self.expect('{')
+            rows = []
+            while not self.accept('}'):
+                rows.append([self.value_term()])
+        return ('values', variables, rows)
+
+    def value_term(self):
+        if self.accept('UNDEF'):
+            return None
+        return self.term()
+
+    def triples(self):
+        subject = self.term()
+        triples = []
+        while True:
+            if self.peek()[0] == 'var':
+                pred = self.variable()
+            else:
+                pred = self.path()
+            while True:
+                triples.append(('triple', subject, pred, self.term()))
+                if not self.accept(','):
+                    break
+            if not self.accept(';'):
+                break
+            if self.at('.') or self.at('}'):
+                break
+        return triples
+
+    def term(self):
+        kind, text = self.next()
+        if kind == 'var':
+            return '?' + text[1:]
+        if kind == 'iri':
+            return text[1:-1]
+        if kind == 'pname':
+            return self.expand(text)
+        if kind == 'bnode':
+            # Blank nodes in patterns behave like variables
+            return '?' + text
+        if kind == 'op' and text == '[':
+            raise SparqlError('Anonymous blank nodes are not supported')
+        if kind == 'string':
+            return self.literal(text)
+        if kind == 'number':
+            return encode_literal(text, XSD_DECIMAL if '.' in text else XSD_INTEGER)
+        if kind == 'name' and text.upper() in ('TRUE', 'FALSE'):
+            return encode_literal(text.lower(), 'http://www.w3.org/2001/XMLSchema#boolean')
+        if kind == 'name' and text == 'a':
+            return RDF_TYPE
+        raise SparqlError('Unexpected {!r}'.format(text))
+
+    def literal(self, text):
+        value = unescape(text[1:-1])
+        kind, suffix = self.peek()
+        if kind == 'langtag':
+            self.pos += 1
+            return encode_literal(value, lang=suffix[1:])
+        if self.accept('^^'):
+            return encode_literal(value, self.term())
+        return encode_literal(value)
+
+    def expand(self, pname):
+        prefix, _, local = pname.partition(':')
+        if prefix not in self.prefixes:
+            raise SparqlError('Unknown prefix {}'.format(prefix))
+        return self.prefixes[prefix] + local
+
+    def path(self):
+        alternatives = [self.path_sequence()]
+        while self.accept('|'):
+            alternatives.append(self.path_sequence())
+        return alternatives[0] if len(alternatives) == 1 else ('alt', alternatives)
+
+    def path_sequence(self):
+        steps = [self.path_element()]
+        while self.accept('/'):
+            steps.append(self.path_element())
+        return steps[0] if len(steps) == 1 else ('seq', steps)
+
+    def path_element(self):
+        inverse = self.accept('^')
+        if self.accept('('):
+            path = self.path()
+            self.expect(')')
+        else:
+            kind, text = self.next()
+            if kind == 'iri':
+                path = text[1:-1]
+            elif kind == 'pname':
+                path = self.expand(text)
+            elif kind == 'name' and text == 'a':
+                path = RDF_TYPE
+            else:
+                raise SparqlError('Unexpected {!r} in property path'.format(text))
+        kind, text = self.peek()
+        if kind == 'op' and text in ('*', '+', '?'):
+            self.pos += 1
+            path = (text, path)
+        return ('inv', path) if inverse else path
+
+    def expression(self):
+        expr = self.and_expression()
+        while self.accept('||'):
+            expr = ('or', expr, self.and_expression())
+        return expr
+
+    def and_expression(self):
+        expr = self.relational_expression()
+        while self.accept('&&'):
+            expr = ('and', expr, self.relational_expression())
+        return expr
+
+    def relational_expression(self):
+        expr = self.unary_expression()
+        kind, text = self.peek()
+        if kind == 'op' and text in ('=', '!=', '<', '>', '<=', '>='):
+            self.pos += 1
+            expr = (text, expr, self.unary_expression())
+        return expr
+
+    def unary_expression(self):
+        if self.accept('!'):
+            return ('not', self.unary_expression())
+        return self.primary_expression()
+
+    def primary_expression(self):
+        if self.accept('('):
+            expr = self.expression()
+            self.expect(')')
+            return expr
+        kind, text = self.peek()
+        if kind == 'name' and self.peek(1) == ('op', '('):
+            self.pos += 2
+            args = []
+            while not self.accept(')'):
+                args.append(self.expression())
+                self.accept(',')
+            return ('call', text.upper(), args)
+        return ('term', self.term())
+
+
+@functools.lru_cache(maxsize=1024)
+def parse(text):
+    """Parse SPARQL text into a `Query`. Parses are cached."""
+    return _Parser(text).parse()
+
+
+def _number(term):
+    if is_literal(term):
+        try:
+            return float(decode_literal(term)[0])
+        except ValueError:
+            pass
+    return None
+
+
+def _boolean(value):
+    """Effective boolean value."""
+    if isinstance(value, bool):
+        return value
+    if is_literal(value):
+        text, datatype, _ = decode_literal(value)
+        if datatype and datatype.endswith('#boolean'):
+            return text == 'true'
+        number = _number(value)
+        if number is not None and datatype:
+            return number != 0
+        return bool(text)
+    raise _EvalError()
+
+
+def _compare(op, left, right):
+    if isinstance(left, bool) or isinstance(right, bool):
+        left, right = _boolean(left), _boolean(right)
+    else:
+        left_number, right_number = _number(left), _number(right)
+        if left_number is not None and right_number is not None:
+            left, right = left_number, right_number
+        elif op in ('=', '!='):
+            pass
+        else:
+            left, right = lexical(left), lexical(right)
+    if op == '=':
+        return left == right
+    if op == '!=':
+        return left != right
+    if op == '<':
+        return left < right
+    if op == '>':
+        return left > right
+    if op == '<=':
+        return left <= right
+    return left >= right
+
+
+def _call(name, args, solution):
+    if name == 'BOUND':
+        return args[0][0] == 'term' and args[0][1] in solution
+    values = [_eval_expression(arg, solution) for arg in args]
+    strings = [lexical(v) if isinstance(v, str) else v for v in values]
+    if name == 'STR':
+        return encode_literal(strings[0])
+    if name == 'STRSTARTS':
+        return strings[0].startswith(strings[1])
+    if name == 'STRENDS':
+        return strings[0].endswith(strings[1])
+    if name == 'CONTAINS':
+        return strings[1] in strings[0]
+    if name == 'CONCAT':
+        return encode_literal(''.join(strings))
+    if name == 'LCASE':
+        return encode_literal(strings[0].lower())
+    if name == 'UCASE':
+        return encode_literal(strings[0].upper())
+    if name == 'STRLEN':
+        return encode_literal(str(len(strings[0])), XSD_INTEGER)
+    if name == 'REGEX':
+        flags = re.IGNORECASE if len(strings) > 2 and 'i' in strings[2] else 0
+        return re.search(strings[1], strings[0], flags) is not None
+    if name in ('ISIRI', 'ISURI'):
+        return not is_literal(values[0]) and not is_blank(values[0])
+    if name == 'ISLITERAL':
+        return is_literal(values[0])
+    if name == 'ISBLANK':
+        return is_blank(values[0])
+    if name == 'SAMETERM':
+        return values[0] == values[1]
+    raise SparqlError('Unsupported function {}'.format(name))
+
+
+def _eval_expression(expr, solution):
+    op = expr[0]
+    if op == 'term':
+        term = expr[1]
+        if is_var(term):
+            if term not in solution:
+                raise _EvalError()
+            return solution[term]
+        return term
+    if op == 'or':
+        return _filter(expr[1], solution) or _filter(expr[2], solution)
+    if op == 'and':
+        return _filter(expr[1], solution) and _filter(expr[2], solution)
+    if op == 'not':
+        return not _boolean(_eval_expression(expr[1], solution))
+    if op == 'call':
+        return _call(expr[1], expr[2], solution)
+    return _compare(op, _eval_expression(expr[1], solution), _eval_expression(expr[2], solution))
+
+
+def _filter(expr, solution):
+    try:
+        return _boolean(_eval_expression(expr, solution))
+    except _EvalError:
+        return False
+
+
+class Evaluator:
+    """Evaluate parsed queries against `index`, which must provide
+    `lookup(term) -> id or None`, `term(id)`, `match(s, p, o)` yielding
+    id triples (None is a wildcard), `objects(s, p)`, `subjects(p, o)`
+    and `nodes()`.
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def run(self, sparql):
+        """Evaluate SPARQL text. Returns a SPARQL JSON result dict."""
+        query = parse(sparql)
+        solutions = self.group(query.pattern, [{}])
+        if query.form == 'ask':
+            return {'head': {}, 'boolean': bool(solutions)}
+        variables = query.variables or self.pattern_variables(query.pattern)
+        for var, descending in reversed(query.order):
+            solutions.sort(key=lambda s: (var in s, lexical(s.get(var, ''))), reverse=descending)
+        rows = [tuple(s.get(v) for v in variables) for s in solutions]
+        if query.distinct:
+            rows = list(dict.fromkeys(rows))
+        start = query.offset or 0
+        end = None if query.limit is None else start + query.limit
+        rows = rows[start:end]
+        names = [v[1:] for v in variables]
+        bindings = [{name: binding_for(term) for name, term in zip(names, row) if term is not None}
+                    for row in rows]
+        return {'head': {'vars': names}, 'results': {'bindings': bindings}}
+
+    def pattern_variables(self, pattern):
+        found = []
+
+        def visit(node):
+            if isinstance(node, str):
+                if is_var(node) and not node.startswith('?_:') and node not in found:
+                    found.append(node)
+            elif isinstance(node, (list, tuple)):
+                for child in node:
+                    visit(child)
+        for element in pattern:
+            if element[0] != 'filter':
+                visit(element[1:])
+        return found
+
+    def group(self, elements, solutions):
+        filters = []
+        pending = []
+        for element in elements:
+            kind = element[0]
+            if kind in ('triple', 'values'):
+                pending.append(element)
+                continue
+            solutions = self.basic_graph_pattern(pending, solutions)
+            pending = []
+            if kind == 'filter':
+                filters.append(element[1])
+            elif kind == 'optional':
+                joined = []
+                for solution in solutions:
+                    extended = self.group(element[1], [solution])
+                    joined.extend(extended or [solution])
+                solutions = joined
+            elif kind == 'union':
+                solutions = [s for g in element[1] for s in self.group(g, solutions)]
+            else:
+                solutions = self.group(element[1], solutions)
+        solutions = self.basic_graph_pattern(pending, solutions)
+        for expr in filters:
+            solutions = [s for s in solutions if _filter(expr, s)]
+        return solutions
+
+    def basic_graph_pattern(self, patterns, solutions):
+        remaining = []
+        for pattern in patterns:
+            if pattern[0] == 'values':
+                solutions = self.join_values(pattern[1], pattern[2], solutions)
+            else:
+                remaining.append(pattern)
+        while remaining and solutions:
+            bound = solutions[0]
+            pattern = max(remaining, key=lambda p: self.selectivity(p, bound))
+            remaining.remove(pattern)
+            solutions = [extended for s in solutions for extended in self.join_triple(pattern, s)]
+        return solutions if not remaining else []
+
+    def join_values(self, variables, rows, solutions):
+        joined = []
+        for solution in solutions:
+            for row in rows:
+                merged = dict(solution)
+                for var, value in zip(variables, row):
+                    if value is None:
+                        continue
+                    if merged.setdefault(var, value) != value:
+                        break
+                else:
+                    joined.append(merged)
+        return joined
+
+    @staticmethod
+    def selectivity(pattern, bound):
+        _, subj, pred, obj = pattern
+
+        def known(node):
+            return not is_var(node) or node in bound
+        return 4 * known(subj) + 2 * known(obj) + (not isinstance(pred, tuple) and known(pred))
+
+    def join_triple(self, pattern, solution):
+        _, subj, pred, obj = pattern
+        ids = []
+        for node in (subj, pred, obj):
+            if isinstance(node, tuple):
+                ids.append(node)
+                continue
+            term = solution.get(node) if is_var(node) else node
+            if term is None:
+                ids.append(None)
+                continue
+            node_id = self.index.lookup(term)
+            if node_id is None:
+                if isinstance(pred, tuple) and node is not pred:
+                    return self.foreign_path(pattern, solution, term)
+                return []
+            ids.append(node_id)
+        if isinstance(pred, tuple):
+            pairs = self.path_pairs(pred, ids[0], ids[2])
+            matches = ((s, None, o) for s, o in pairs)
+        else:
+            matches = self.index.match(*ids)
+        results = []
+        term = self.index.term
+        for s, p, o in matches:
+            extended = dict(solution)
+            ok = True
+            for node, node_id in ((subj, s), (pred, p), (obj, o)):
+                if node_id is None or not is_var(node):
+                    continue
+                value = term(node_id)
+                if extended.setdefault(node, value) != value:
+                    ok = False
+                    break
+            if ok:
+                results.append(extended)
+        return results
+
+    def foreign_path(self, pattern, solution, term):
+        """A path endpoint is a term that is not in the index, so only a
+        zero length path can match it.
+        """
+        _, subj, pred, obj = pattern
+        if not self.nullable(pred):
+            return []
+        extended = dict(solution)
+        for node in (subj, obj):
+            if is_var(node):
+                if extended.setdefault(node, term) != term:
+                    return []
+            elif node != term:
+                return []
+        return [extended]
+
+    def nullable(self, path):
+        if not isinstance(path, tuple):
+            return False
+        kind = path[0]
+        if kind in ('*', '?'):
+            return True
+        if kind == 'seq':
+            return all(self.nullable(p) for p in path[1])
+        if kind == 'alt':
+            return any(self.nullable(p) for p in path[1])
+        if kind == 'inv':
+            return self.nullable(path[1])
+        return False
+
+    def path_pairs(self, path, subj, obj):
+        if subj is not None:
+            return [(subj, o) for o in self.forward(path, subj) if obj is None or o == obj]
+        if obj is not None:
+            return [(s, obj) for s in self.backward(path, obj)]
+        return [(s, o) for s in self.index.nodes() for o in self.forward(path, s)]
+
+    def forward(self, path, node):
+        return self.step(path, node, False)
+
+    def backward(self, path, node):
+        return self.step(path, node, True)
+
+    def step(self, path, node, reverse):
+        if not isinstance(path, tuple):
+            pred = self.index.lookup(path)
+            if pred is None:
+                return set()
+            if reverse:
+                return set(self.index.subjects(pred, node))
+            return set(self.index.objects(node, pred))
+        kind, arg = path
+        if kind == 'inv':
+            return self.step(arg, node, not reverse)
+        if kind == 'seq':
+            nodes = {node}
+            for part in (reversed(arg) if reverse else arg):
+                nodes = set().union(*(self.step(part, n, reverse) for n in nodes))
+            return nodes
+        if kind == 'alt':
+            return set().union(*(self.step(part, node, reverse) for part in arg))
+        if kind == '?':
+            return {node} | self.step(arg, node, reverse)
+        # '*' and '+' are closures
+        seen = set()
+        frontier = [node]
+        while frontier:
+            next_frontier = []
+            for n in frontier:
+                for m in self.step(arg, n, reverse):
+                    if m not in seen:
+                        seen.add(m)
+                        next_frontier.append(m)
+            frontier = next_frontier
+        if kind == '*':
+            seen.add(node)
+        return seen
@@ -6,7 +6,16 @@ setup(name='sbh_prospector',
       url='https://github.com/SD2E/sbh-prospector',
       license='MIT',
       packages=['sbh_prospector'],
+      entry_points={
+          'console_scripts': ['sbh-prospector=sbh_prospector.cli:main']
+      },
       install_requires=[
           'pandas',
+          'requests',
           'synbiohub_adapter@git+https://github.com/SD2E/synbiohub_adapter'
-      ])
+      ],
+      extras_require={
+          'async': ['aiohttp'],
+          'parquet': ['pyarrow'],
+          'rdf': ['rdflib']
+      })
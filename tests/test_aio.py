@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from sbh_prospector import aio, bench, memo, prospector
+
+pytest.importorskip('aiohttp')
+
+
+@pytest.fixture(scope='module')
+def hierarchy():
+    return bench.synthetic_hierarchy(depth=3, fanout=2, shared_fraction=0.3)
+
+
+@pytest.fixture(scope='module')
+def modules(hierarchy):
+    index, _ = hierarchy
+    return sorted(prospector.subjects_for(index, prospector.RDF_TYPE, bench.SBOL_MODULE_DEFINITION))
+
+
+@pytest.fixture(scope='module')
+def server(hierarchy):
+    index, _ = hierarchy
+    with bench.StandInServer(index) as server:
+        yield server
+
+
+@pytest.fixture(params=['session', 'wrapped'])
+def run_async(request, hierarchy, server):
+    """Run a coroutine function of an async `sbh_query` against the
+    stand-in server, or the snapshot itself wrapped in an `AsyncQuery`.
+    """
+    index, _ = hierarchy
+
+    def run(func):
+        async def main():
+            if request.param == 'session':
+                async with aio.AsyncSparqlSession(server.url) as sbh_query:
+                    return await func(sbh_query)
+            return await func(aio.AsyncQuery(index))
+
+        memo.clear()
+        try:
+            return asyncio.run(main())
+        finally:
+            memo.clear()
+
+    return run
+
+
+def normalized(found):
+    """Sort the children or parents of each URI of a batched lookup."""
+    return {uri: value if isinstance(value, bool) else sorted(value) for uri, value in found.items()}
+
+
+def sync(func, *args, **kwargs):
+    memo.clear()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        memo.clear()
+
+
+@pytest.mark.parametrize('name', ['find_contained_strains', 'find_contained_reagents', 'root_module_definitions'])
+def test_searches_match_sync(hierarchy, modules, run_async, name):
+    index, _ = hierarchy
+    expected = {uri: sorted(sync(getattr(prospector, name), index, uri)) for uri in modules}
+
+    async def search(sbh_query):
+        found = await asyncio.gather(*[getattr(aio, name)(sbh_query, uri, chunk_size=3) for uri in modules])
+        return {uri: sorted(items) for uri, items in zip(modules, found)}
+
+    assert any(expected.values())
+    assert run_async(search) == expected
+
+
+@pytest.mark.parametrize('name', ['iter_contained_strains', 'iter_contained_reagents'])
+@pytest.mark.parametrize('max_depth, limit', [(1, None), (None, 2), (2, 1)])
+def test_iter_contained_matches_sync(hierarchy, run_async, name, max_depth, limit):
+    index, uris = hierarchy
+    expected = sync(lambda: list(getattr(prospector, name)(index, uris['root'], max_depth, limit)))
+
+    async def search(sbh_query):
+        return [item async for item in getattr(aio, name)(sbh_query, uris['root'], max_depth, limit)]
+
+    assert run_async(search) == expected
+
+
+@pytest.mark.parametrize('name', ['child_module_definitions_many', 'child_component_definitions_many',
+                                  'child_definitions_all_many', 'parent_module_definitions_many',
+                                  'module_is_strain_many', 'is_reagent_many'])
+def test_batched_lookups_match_sync(hierarchy, modules, run_async, name):
+    index, _ = hierarchy
+    expected = sync(getattr(prospector, name), index, modules, chunk_size=3)
+
+    async def lookup(sbh_query):
+        return await getattr(aio, name)(sbh_query, modules, chunk_size=3)
+
+    assert normalized(run_async(lookup)) == normalized(expected)
+
+
+def test_find_implementations_matches_sync(hierarchy, run_async):
+    index, _ = hierarchy
+    designs = sorted(o for _, _, o in index.triples(pred=prospector.SBOL_BUILT))
+    expected = [sync(prospector.find_implementations, index, design) for design in designs]
+
+    async def find(sbh_query):
+        return await asyncio.gather(*[aio.find_implementations(sbh_query, design) for design in designs])
+
+    assert designs and all(expected)
+    assert run_async(find) == expected
@@ -0,0 +1,23 @@
+from sbh_prospector import cache
+
+
+def test_sqlite_cache_trims_periodically():
+    query_cache = cache.SQLiteQueryCache(':memory:', max_entries=1000)
+    for i in range(1005):
+        query_cache.put(str(i), 'value {}'.format(i))
+    # Entries are counted every 10 inserts, so the last 5 are not yet
+    # trimmed
+    assert len(query_cache) == 1005
+    for i in range(5):
+        query_cache.put('more {}'.format(i), 'value')
+    assert len(query_cache) == 1000
+    assert query_cache.get('0') is None
+    assert query_cache.get('more 4') == 'value'
+
+
+def test_small_sqlite_cache_is_exact():
+    query_cache = cache.SQLiteQueryCache(':memory:', max_entries=10)
+    for i in range(20):
+        query_cache.put(str(i), 'value')
+    assert len(query_cache) == 10
+    assert query_cache.get('9') is None and query_cache.get('19') == 'value'
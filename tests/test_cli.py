@@ -0,0 +1,34 @@
+import io
+import json
+
+import pytest
+
+from sbh_prospector import bench, cli
+
+
+@pytest.fixture(scope='module')
+def snapshot_file(tmp_path_factory):
+    index, uris = bench.synthetic_hierarchy(depth=2, fanout=3)
+    path = tmp_path_factory.mktemp('cli') / 'hierarchy.nt'
+    with open(path, 'w') as nt:
+        for triple in index.triples():
+            nt.write(' '.join('<{}>'.format(term) for term in triple) + ' .\n')
+    return str(path), uris
+
+
+def run(argv):
+    output = io.StringIO()
+    cli.run(cli.parse_args(argv), output)
+    return sorted(json.loads(line)['reagent'] for line in output.getvalue().splitlines())
+
+
+def test_sharded_reagents_match_serial(snapshot_file):
+    path, uris = snapshot_file
+    serial = run(['--snapshot', path, 'reagents', uris['root'], uris['leaf']])
+    assert serial
+    assert run(['--snapshot', path, '-p', '2', 'reagents', uris['root'], uris['leaf']]) == serial
+
+
+def test_staging_needs_one_worker():
+    with pytest.raises(SystemExit):
+        cli.parse_args(['--staging', '-w', '4', 'roots', 'https://example.org/a'])
@@ -0,0 +1,90 @@
+from sbh_prospector import ClosureIndex, SnapshotIndex, SparqlSession, bench, memo, prospector
+
+
+def fresh_hierarchy():
+    return bench.synthetic_hierarchy(depth=3, fanout=2, strain_fraction=0.5, shared_fraction=0.3)
+
+
+def expanded(index):
+    return [uri for uri, in index._conn.execute('SELECT uri FROM nodes WHERE expanded')]
+
+
+def assert_matches_searches(index, snapshot):
+    """Check every lookup of `index` against a search of `snapshot`."""
+    memo.clear()
+    for uri in expanded(index):
+        assert sorted(index.contained_strains(uri)) == sorted(prospector.find_contained_strains(snapshot, uri))
+        assert sorted(index.contained_reagents(uri)) == sorted(prospector.find_contained_reagents(snapshot, uri))
+        assert sorted(index.roots(uri)) == sorted(prospector.root_module_definitions(snapshot, uri))
+
+
+def add_module(snapshot, parent, module, strain=False):
+    node = parent[:-2] + '/added_' + module.rsplit('/', 2)[-2] + '/1'
+    snapshot.add(parent, prospector.SBOL_MODULE, node)
+    snapshot.add(node, prospector.SBOL_DEFINITION, module)
+    snapshot.add(module, prospector.RDF_TYPE, bench.SBOL_MODULE_DEFINITION)
+    if strain:
+        snapshot.add(module, prospector.SBOL_ROLE, prospector.NCIT_STRAIN)
+
+
+def test_build_matches_searches():
+    snapshot, uris = fresh_hierarchy()
+    index = ClosureIndex.build(snapshot, [uris['root']])
+    assert uris['leaf'] in expanded(index)
+    assert_matches_searches(index, snapshot)
+
+
+def test_build_over_http_matches_searches():
+    snapshot, uris = fresh_hierarchy()
+    with bench.StandInServer(snapshot) as server:
+        index = ClosureIndex.build(SparqlSession(server.url), [uris['root']])
+    assert index.key == server.url
+    assert_matches_searches(index, snapshot)
+
+
+def test_refresh_after_adding_a_child():
+    snapshot, uris = fresh_hierarchy()
+    index = ClosureIndex.build(snapshot, [uris['root']])
+    module = bench.DESIGN_PREFIX + 'module_new/1'
+    add_module(snapshot, uris['leaf'], module, strain=True)
+    changed = index.refresh(snapshot)
+    assert uris['leaf'] in changed and module in changed
+    assert module in index.contained_strains(uris['root'])
+    assert_matches_searches(index, snapshot)
+
+
+def test_refresh_after_adding_a_parent():
+    snapshot, uris = fresh_hierarchy()
+    index = ClosureIndex.build(snapshot, [uris['root']])
+    parent = bench.DESIGN_PREFIX + 'module_parent/1'
+    snapshot.add(parent, prospector.RDF_TYPE, bench.SBOL_MODULE_DEFINITION)
+    add_module(snapshot, parent, uris['root'])
+    index.refresh(snapshot)
+    assert index.roots(uris['leaf']) == [parent]
+    assert_matches_searches(index, snapshot)
+
+
+def test_registered_index_answers_only_for_its_backend():
+    snapshot, uris = fresh_hierarchy()
+    other = SnapshotIndex()
+    index = ClosureIndex.build(snapshot, [uris['root']])
+    strains = index.contained_strains(uris['root'])
+    assert strains
+    memo.clear()
+    prospector.add_closure_index(index)
+    try:
+        assert prospector.find_contained_strains(other, uris['root']) == []
+        assert prospector.find_contained_strains(snapshot, uris['root']) == strains
+    finally:
+        prospector.remove_closure_index(index)
+
+
+def test_reopened_index_keeps_its_server(tmp_path):
+    snapshot, uris = fresh_hierarchy()
+    path = str(tmp_path / 'closure.sqlite')
+    with bench.StandInServer(snapshot) as server:
+        ClosureIndex.build(SparqlSession(server.url), [uris['root']], path).close()
+    assert ClosureIndex(path).key == server.url
+    snapshot_path = str(tmp_path / 'snapshot.sqlite')
+    ClosureIndex.build(snapshot, [uris['root']], snapshot_path).close()
+    assert ClosureIndex(snapshot_path).key is None
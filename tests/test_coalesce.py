@@ -0,0 +1,23 @@
+import asyncio
+
+import pytest
+
+from sbh_prospector import AsyncCoalescingQuery, aio, bench, prospector
+
+pytest.importorskip('aiohttp')
+
+
+def test_async_identical_queries_are_sent_once():
+    index, uris = bench.synthetic_hierarchy(depth=1, fanout=2)
+    sparql = prospector.COMPILED_SUBJECT_INFO_QUERY.render([(uris['root'],)])
+
+    async def main(url):
+        async with AsyncCoalescingQuery(aio.AsyncSparqlSession(url)) as sbh_query:
+            results = await asyncio.gather(*[sbh_query.fetch_SPARQL(None, sparql) for _ in range(8)])
+            return results, sbh_query.flight.stats()
+
+    with bench.StandInServer(index, latency=0.05) as server:
+        results, stats = asyncio.run(main(server.url))
+        assert server.queries == 1
+    assert all(result == results[0] for result in results)
+    assert stats['calls'] == 1 and stats['shared'] == 7
@@ -0,0 +1,27 @@
+import pytest
+
+from sbh_prospector import bench, prospector
+
+INJECTED = 'http://x> ) } ?s ?p ?o . { VALUES (?s) { ( <http://y'
+
+
+@pytest.fixture(scope='module')
+def index():
+    return bench.synthetic_hierarchy(depth=1, fanout=2)[0]
+
+
+@pytest.mark.parametrize('call', [
+    lambda q: prospector.subjects_for(q, prospector.SBOL_MODULE, INJECTED),
+    lambda q: prospector.child_module_definitions(q, INJECTED),
+    lambda q: prospector.module_is_strain_many(q, [INJECTED]),
+    lambda q: prospector.is_reagent_many(q, [INJECTED]),
+    lambda q: prospector.child_definitions_many(q, [INJECTED], [prospector.SBOL_MODULE]),
+    lambda q: prospector.parent_module_definitions_many(q, [INJECTED]),
+    lambda q: prospector.find_contained_strains_by_path(q, INJECTED),
+    lambda q: prospector.find_contained_reagents_by_path(q, INJECTED),
+    lambda q: prospector.find_construct_experiments_joined(q, INJECTED),
+    lambda q: prospector.implementations_query('http://x', INJECTED),
+])
+def test_uris_are_checked(index, call):
+    with pytest.raises(ValueError):
+        call(index)
@@ -0,0 +1,70 @@
+import pytest
+
+from sbh_prospector import executor as executor_module
+from sbh_prospector.executor import QueryExecutor
+
+SPARQL = 'SELECT ?s WHERE { ?s ?p ?o }'
+RESULT = {'head': {'vars': ['s']}, 'results': {'bindings': []}}
+
+
+class ServerError(Exception):
+    code = 503
+
+
+class FlakyBackend:
+    """Fails the first `failures` queries with `error`, then answers."""
+
+    _server = 'http://flaky.test'
+
+    def __init__(self, failures, error=TimeoutError):
+        self.failures = failures
+        self.error = error
+        self.attempts = 0
+
+    def fetch_SPARQL(self, server, sparql):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise self.error('attempt {}'.format(self.attempts))
+        return RESULT
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(executor_module.time, 'sleep', delays.append)
+    return delays
+
+
+@pytest.mark.parametrize('error', [TimeoutError, ConnectionError, ServerError])
+def test_retries_until_success(sleeps, error):
+    backend = FlakyBackend(2, error)
+    with QueryExecutor(retries=3, backoff=0.5) as executor:
+        assert executor.fetch(backend, SPARQL) == RESULT
+    assert backend.attempts == 3
+    assert sleeps == [0.5, 1.0]
+
+
+def test_gives_up_after_retries(sleeps):
+    backend = FlakyBackend(10)
+    with QueryExecutor(retries=3, backoff=0.5) as executor:
+        with pytest.raises(TimeoutError, match='attempt 4'):
+            executor.fetch(backend, SPARQL)
+    assert backend.attempts == 4
+    assert sleeps == [0.5, 1.0, 2.0]
+
+
+def test_other_errors_are_not_retried(sleeps):
+    backend = FlakyBackend(1, ValueError)
+    with QueryExecutor(retries=3, backoff=0.5) as executor:
+        with pytest.raises(ValueError):
+            executor.fetch(backend, SPARQL)
+    assert backend.attempts == 1
+    assert sleeps == []
+
+
+def test_map_retries_each_call(sleeps):
+    backends = [FlakyBackend(failures) for failures in range(3)]
+    with QueryExecutor(max_workers=3, retries=3, backoff=0) as executor:
+        results = executor.map(lambda backend: backend.fetch_SPARQL(None, SPARQL), backends)
+    assert results == [RESULT] * 3
+    assert [backend.attempts for backend in backends] == [1, 2, 3]
@@ -0,0 +1,10 @@
+from sbh_prospector import bench, instrument, prospector
+
+
+def test_unreported_response_size_is_none():
+    index, uris = bench.synthetic_hierarchy(depth=1, fanout=2)
+    with instrument.tracing(instrument.MemorySink()) as sink:
+        prospector.subject_info(index, uris['root'])
+    assert sink.events
+    assert all(event.response_bytes is None for event in sink.events)
+    assert all(event.rows for event in sink.events)
@@ -0,0 +1,19 @@
+from sbh_prospector import SnapshotIndex, SparqlSession, bench, memo, prospector
+
+
+def test_partial_snapshot_does_not_share_server_memo():
+    index, uris = bench.synthetic_hierarchy(depth=2, fanout=2)
+    memo.clear()
+    with bench.StandInServer(index) as server:
+        live = SparqlSession(server.url)
+        snapshot = SnapshotIndex.from_server(live, roots=[uris['leaf']])
+        assert prospector.root_module_definitions(snapshot, uris['leaf']) == []
+        assert prospector.root_module_definitions(live, uris['leaf']) == [uris['root']]
+
+
+def test_package_memo_is_the_shared_instance():
+    import sbh_prospector
+    from sbh_prospector import memoization
+    assert sbh_prospector.memo is memoization.memo
+    assert isinstance(memo, memoization.Memo)
+    assert memoization.memo_server(SnapshotIndex()) is not None
@@ -0,0 +1,63 @@
+import os
+
+from sbh_prospector import bench, memo, prospector, sparql
+
+
+class FlakyQuery:
+    """Wraps an `sbh_query`, failing the first property path query with
+    `error`.
+    """
+
+    def __init__(self, sbh_query, error):
+        self.sbh_query = sbh_query
+        self.error = error
+
+    def __getattr__(self, name):
+        return getattr(self.sbh_query, name)
+
+    def fetch_SPARQL(self, server, sparql):
+        if self.error is not None and ')*' in sparql:
+            error, self.error = self.error, None
+            raise error
+        return self.sbh_query.fetch_SPARQL(server, sparql)
+
+
+def test_timeout_does_not_disable_property_paths():
+    index, uris = bench.synthetic_hierarchy(depth=2, fanout=2)
+    memo.clear()
+    sbh_query = FlakyQuery(index, TimeoutError('timed out'))
+    strains = prospector.find_contained_strains_by_path(sbh_query, uris['root'])
+    assert sorted(strains) == sorted(prospector.find_contained_strains(index, uris['root']))
+    assert prospector.memo_server(sbh_query) not in prospector._no_property_paths
+
+
+def test_find_subjects_returns_triple_chains():
+    index, uris = bench.synthetic_hierarchy(depth=1, fanout=2)
+    found = prospector.find_subjects(index, {uris['construct']: []}, prospector.SBOL_DEFINITION)
+    assert found
+    for s, chain in found.items():
+        assert chain == [(s, prospector.SBOL_DEFINITION, uris['construct'])]
+    up = prospector.find_subjects(index, found, prospector.SBOL_PRED_COMPONENT)
+    for s, chain in up.items():
+        assert chain[0][0] == s and chain[1:] == found[chain[0][2]]
+
+
+def test_resumed_scan_repeats_the_interrupted_page(tmp_path):
+    index, _ = bench.synthetic_hierarchy(depth=1, fanout=2)
+    for i in range(7):
+        uri = '{}grna_{}/1'.format(bench.DESIGN_PREFIX, i)
+        index.add(uri, prospector.RDF_TYPE, bench.SBOL_COMPONENT_DEFINITION)
+        index.add(uri, 'http://purl.org/dc/terms/title', sparql.encode_literal('gRNA {}'.format(i)))
+    expected = list(prospector.iter_grna(index, page_size=3))
+    assert len(expected) >= 7
+    checkpoint = str(tmp_path / 'grna.json')
+
+    # stop after the second row of the second page
+    scan = prospector.iter_grna(index, page_size=3, checkpoint=checkpoint)
+    first = [next(scan) for _ in range(5)]
+    scan.close()
+    resumed = list(prospector.iter_grna(index, page_size=3, checkpoint=checkpoint))
+
+    assert first == expected[:5]
+    assert resumed == expected[3:]
+    assert not os.path.exists(checkpoint)
@@ -0,0 +1,60 @@
+import functools
+
+import pytest
+
+from sbh_prospector import bench, prospector, shard, sparql
+from sbh_prospector.executor import SparqlSession
+
+
+@pytest.fixture(scope='module')
+def hierarchy():
+    index, uris = bench.synthetic_hierarchy(depth=3, fanout=2)
+    # gRNA-like components, so a full scan has a known number of rows
+    for i in range(13):
+        uri = '{}grna_{}/1'.format(bench.DESIGN_PREFIX, i)
+        index.add(uri, prospector.RDF_TYPE, bench.SBOL_COMPONENT_DEFINITION)
+        index.add(uri, 'http://purl.org/dc/terms/title', sparql.encode_literal('gRNA {}'.format(i)))
+    return index, uris
+
+
+@pytest.fixture(scope='module')
+def connect(hierarchy):
+    index, _ = hierarchy
+    with bench.StandInServer(index) as server:
+        yield functools.partial(SparqlSession, server.url)
+
+
+def rows(frame):
+    return sorted(tuple(row) for row in frame.itertuples(index=False))
+
+
+def test_contained_reagents_with_empty_shard(hierarchy, connect):
+    index, uris = hierarchy
+    roots = [uris['root'], uris['leaf']]
+    by_root, _ = prospector.find_contained_reagents_bulk(index, roots)
+    assert not by_root[uris['leaf']]
+    expected = sorted((root, item) for root, items in by_root.items() for item in items)
+    frame = shard.find_contained_reagents_sharded(connect, roots, processes=2, shard_size=1)
+    assert list(frame.columns) == ['root', 'reagent']
+    assert rows(frame) == expected
+
+
+def test_contained_strains_progress(hierarchy, connect):
+    index, uris = hierarchy
+    roots = prospector.child_module_definitions(index, uris['root'])
+    by_root, _ = prospector.find_contained_strains_bulk(index, roots)
+    expected = sorted((root, item) for root, items in by_root.items() for item in items)
+    progress = []
+    frame = shard.find_contained_strains_sharded(connect, roots, processes=2, shard_size=1,
+                                                 progress=lambda done, total: progress.append((done, total)))
+    assert rows(frame) == expected
+    assert progress[-1] == (len(roots), len(roots))
+
+
+@pytest.mark.parametrize('page_size', [5, 13, 100])
+def test_grna_pages(hierarchy, connect, page_size):
+    index, _ = hierarchy
+    expected = rows(prospector.find_grna_frame(index))
+    frame = shard.find_grna_sharded(connect, processes=2, page_size=page_size)
+    assert rows(frame) == expected
+    assert len(frame) == len(prospector.find_grna(index)) >= 13
@@ -0,0 +1,114 @@
+import collections
+import json
+
+import pytest
+
+from sbh_prospector import SnapshotIndex, bench, memo, prospector, snapshot, sparql
+
+rdflib = pytest.importorskip('rdflib')
+
+DC_TITLE = 'http://purl.org/dc/terms/title'
+
+# Literals written to the N-Triples file as they are, escapes and all
+LITERAL_TRIPLES = [
+    '<{}grna_1/1> <{}> "caf\\u00E9 \\U0001F600" .',
+    '<{}grna_2/1> <{}> "say \\"hi\\"\\tthere" .',
+    '<{}grna_3/1> <{}> "gRNA 3"@en .',
+    '<{}grna_4/1> <{}> "gRNA 4"^^<http://www.w3.org/2001/XMLSchema#string> .',
+]
+
+
+def nt_term(term):
+    if sparql.is_literal(term):
+        value, datatype, lang = sparql.decode_literal(term)
+        text = '"' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        if lang:
+            return text + '@' + lang
+        if datatype:
+            return text + '^^<' + datatype + '>'
+        return text
+    if sparql.is_blank(term):
+        return term
+    return '<' + term + '>'
+
+
+def normalize(result):
+    """The rows of a SPARQL JSON result as comparable values."""
+    rows = []
+    for binding in result['results']['bindings']:
+        row = []
+        for var, value in sorted(binding.items()):
+            kind = 'literal' if value['type'] == 'typed-literal' else value['type']
+            row.append((var, kind, value['value'], value.get('datatype'), value.get('xml:lang')))
+        rows.append(tuple(row))
+    return rows
+
+
+class CheckedQuery:
+    """Answers queries from `index`, checking each answer against rdflib
+    querying `graph`.
+    """
+
+    def __init__(self, index, graph):
+        self.index = index
+        self.graph = graph
+        self.queries = 0
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+    def fetch_SPARQL(self, server, query):
+        result = self.index.fetch_SPARQL(server, query)
+        expected = json.loads(self.graph.query(query).serialize(format='json'))
+        if 'ORDER BY' in query:
+            assert normalize(result) == normalize(expected), query
+        else:
+            assert collections.Counter(normalize(result)) == collections.Counter(normalize(expected)), query
+        self.queries += 1
+        return result
+
+
+@pytest.fixture(scope='module')
+def hierarchy(tmp_path_factory):
+    index, uris = bench.synthetic_hierarchy(depth=2, fanout=3, shared_fraction=0.3)
+    for i in range(6):
+        uri = '{}grna_{}/1'.format(bench.DESIGN_PREFIX, i)
+        index.add(uri, prospector.RDF_TYPE, bench.SBOL_COMPONENT_DEFINITION)
+    path = tmp_path_factory.mktemp('sparql') / 'hierarchy.nt'
+    with open(path, 'w', encoding='utf-8') as nt:
+        for triple in index.triples():
+            nt.write(' '.join(nt_term(term) for term in triple) + ' .\n')
+        for line in LITERAL_TRIPLES:
+            nt.write(line.format(bench.DESIGN_PREFIX, DC_TITLE) + '\n')
+    graph = rdflib.Graph()
+    graph.parse(str(path), format='nt')
+    return CheckedQuery(SnapshotIndex.from_files([str(path)]), graph), uris
+
+
+def test_ntriples_escapes(hierarchy):
+    sbh_query, _ = hierarchy
+    titles = dict(prospector.find_grna(sbh_query.index))
+    assert titles[bench.DESIGN_PREFIX + 'grna_1/1'] == 'caf\u00e9 \U0001F600'
+    assert titles[bench.DESIGN_PREFIX + 'grna_2/1'] == 'say "hi"\tthere'
+
+
+@pytest.mark.parametrize('call', [
+    lambda q, u: prospector.find_contained_strains(q, u['root']),
+    lambda q, u: prospector.find_contained_reagents(q, u['root']),
+    lambda q, u: prospector.find_contained_strains_by_path(q, u['root']),
+    lambda q, u: prospector.find_contained_reagents_by_path(q, u['root']),
+    lambda q, u: prospector.root_module_definitions(q, u['leaf']),
+    lambda q, u: prospector.subject_info(q, u['root']),
+    lambda q, u: prospector.subjects_for(q, prospector.SBOL_DEFINITION, u['leaf']),
+    lambda q, u: prospector.titles_for_many(q, [bench.DESIGN_PREFIX + 'grna_{}/1'.format(i) for i in range(6)]),
+    lambda q, u: prospector.find_grna(q, page_size=2),
+    lambda q, u: prospector.find_implementations(q, u['construct']),
+    lambda q, u: prospector.find_construct_experiments(q, u['construct']),
+    lambda q, u: prospector.find_construct_experiments_joined(q, u['construct']),
+])
+def test_generated_queries_match_rdflib(hierarchy, call):
+    sbh_query, uris = hierarchy
+    memo.clear()
+    before = sbh_query.queries
+    call(sbh_query, uris)
+    assert sbh_query.queries > before